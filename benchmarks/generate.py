@@ -0,0 +1,290 @@
+import argparse
+import orjson as json
+import os
+import random
+import sys
+
+sys.path.append("./")
+
+
+# Syllables combined into the synthetic concept names, e.g. "methylbenzoxazine"
+syllables = ["meth", "eth", "prop", "but", "pent", "hex", "benz", "chlor", "fluor", "brom",
+    "amin", "amid", "ox", "az", "ol", "on", "yl", "ine", "ate", "ide", "cyclo", "pyr",
+    "thi", "phen", "sulf", "nitr", "carb", "hydr", "ester", "anth"]
+
+words = ["acid", "syndrome", "disease", "deficiency", "receptor", "inhibitor", "chloride",
+    "sodium", "type", "acute", "chronic", "tumor", "derivative", "oxide", "complex"]
+
+pubtator_dir = "BioCreative-V-CDR-Corpus/CDR_Data/CDR.Corpus.v010516/"
+
+
+def concept_id(kb, i):
+    """Id of the i-th synthetic concept in the OBO file of kb."""
+
+    if kb == "chebi":
+        return "CHEBI:{}".format(i + 1)
+
+    return "MESH:D{:06d}".format(i + 1)
+
+
+
+def concept_url(kb, i):
+    """Id of the i-th synthetic concept as it appears in the candidates of kb."""
+
+    if kb == "chebi":
+        return "CHEBI_{}".format(i + 1)
+
+    return "D{:06d}".format(i + 1)
+
+
+
+def generate_name(rng, names_seen):
+    """A new random name, not in names_seen."""
+
+    while True:
+        name = "".join(rng.choice(syllables) for i in range(rng.randint(2, 5)))
+
+        if rng.random() < 0.4:
+            name = "{} {}".format(name, rng.choice(words))
+
+        if rng.random() < 0.1:
+            name = "{}-{}".format(rng.randint(1, 9), name)
+
+        if name not in names_seen:
+            names_seen.add(name)
+            return name
+
+
+
+def generate_concepts(kb, n_concepts, synonyms_per_concept=1.0, parents_per_concept=1.5, seed=0):
+    """Generate the concepts of a synthetic ontology.
+
+    Requires:
+        kb: is str, either 'chebi' or 'medic' (format of the ids)
+        n_concepts: is int, number of concepts
+        synonyms_per_concept: is float, mean number of synonyms of each concept
+        parents_per_concept: is float, mean number of 'is_a' parents of each concept
+            (the parents are always concepts generated before, so the ontology is acyclic)
+
+    Ensures:
+        concepts: is list of dicts with the keys 'id', 'url', 'name', 'synonyms' and 'parents'
+    """
+
+    rng = random.Random(seed)
+    names_seen, concepts = set(), []
+
+    for i in range(n_concepts):
+        n_synonyms = int(synonyms_per_concept) + (rng.random() < synonyms_per_concept % 1)
+        n_parents = min(i, int(parents_per_concept) + (rng.random() < parents_per_concept % 1))
+        parents = sorted(set(rng.randrange(i) for j in range(n_parents))) if i > 0 else []
+        concepts.append({"id": concept_id(kb, i), "url": concept_url(kb, i),
+            "name": generate_name(rng, names_seen),
+            "synonyms": [generate_name(rng, names_seen) for j in range(n_synonyms)],
+            "parents": [concept_id(kb, j) for j in parents]})
+
+    return concepts
+
+
+
+def write_obo(filename, kb, concepts):
+    """Write the concepts in the OBO format read by the loader of kb."""
+
+    lines = ["format-version: 1.2", "ontology: {}".format(kb), ""]
+
+    if kb == "medic": # Root concept of MEDIC
+        lines.extend(["[Term]", "id: MESH:C", "name: Diseases", ""])
+
+    for concept in concepts:
+        lines.extend(["[Term]", "id: " + concept["id"], "name: " + concept["name"]])
+
+        if kb == "medic" and len(concept["parents"]) == 0:
+            lines.append("is_a: MESH:C")
+
+        lines.extend("is_a: " + parent for parent in concept["parents"])
+        lines.extend('synonym: "{}" EXACT []'.format(synonym) for synonym in concept["synonyms"])
+        lines.append("")
+
+    with open(filename, "w") as obo_file:
+        obo_file.write("\n".join(lines))
+        obo_file.close()
+
+
+
+def write_relations(filename, concepts, relation_density=0.001, seed=0):
+    """Write a file of extracted relations (same format as 'chebi_relations.json').
+
+    Requires:
+        relation_density: is float, probability of a relation between two concepts
+    """
+
+    rng = random.Random(seed)
+    n_relations = int(relation_density * len(concepts) * (len(concepts) - 1) / 2)
+    relations = dict()
+
+    for k in range(n_relations):
+        i, j = rng.randrange(len(concepts)), rng.randrange(len(concepts))
+
+        if i != j:
+            relations.setdefault(concepts[i]["url"], set()).add(concepts[j]["url"])
+            relations.setdefault(concepts[j]["url"], set()).add(concepts[i]["url"])
+
+    with open(filename, "wb") as relations_file:
+        relations_file.write(json.dumps({url: sorted(relations[url]) for url in relations}))
+        relations_file.close()
+
+
+
+def mutate(text, rng):
+    """Random typo: a character is removed, duplicated or replaced."""
+
+    if len(text) < 4:
+        return text
+
+    i = rng.randrange(len(text))
+    operation = rng.randrange(3)
+
+    if operation == 0:
+        return text[:i] + text[i + 1:]
+
+    elif operation == 1:
+        return text[:i] + text[i] + text[i:]
+
+    return text[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + text[i + 1:]
+
+
+
+def generate_corpus(concepts, n_documents, mentions_per_document=10, synonym_rate=0.3, typo_rate=0.2,
+        unknown_rate=0.05, seed=0):
+    """Generate the entity mentions of a synthetic corpus.
+
+    Requires:
+        concepts: is list outputted by generate_concepts
+        mentions_per_document: is int, mean number of mentions in each document
+        synonym_rate: is float, fraction of mentions that are a synonym instead of the name
+        typo_rate: is float, fraction of mentions with a typo
+        unknown_rate: is float, fraction of mentions that are not in the ontology
+
+    Ensures:
+        annotations: is dict, each key is a document id, values are lists of tuples (concept url, mention text)
+    """
+
+    rng = random.Random(seed)
+    names_seen = set(concept["name"] for concept in concepts)
+    annotations = dict()
+
+    # Some concepts are mentioned much more often than others, as in real corpora
+    weights = [1.0 / (i + 1) for i in range(len(concepts))]
+    rng.shuffle(weights)
+
+    for d in range(n_documents):
+        n_mentions = max(1, int(rng.expovariate(1.0 / mentions_per_document)))
+        document_annotations = []
+
+        for concept in rng.choices(concepts, weights=weights, k=n_mentions):
+
+            if rng.random() < unknown_rate:
+                document_annotations.append(("-1", generate_name(rng, names_seen)))
+                continue
+
+            text = concept["name"]
+
+            if len(concept["synonyms"]) > 0 and rng.random() < synonym_rate:
+                text = rng.choice(concept["synonyms"])
+
+            if rng.random() < typo_rate:
+                text = mutate(text, rng)
+
+            document_annotations.append((concept["url"], text))
+
+        annotations["doc_{}".format(d + 1)] = document_annotations
+
+    return annotations
+
+
+
+def write_json_corpus(filename, annotations):
+    """Write the corpus as an input file of run.py ('.jsonl' writes one document per line)."""
+
+    in_annotations = {document: [text for url, text in annotations[document]] for document in annotations}
+
+    with open(filename, "wb") as corpus_file:
+
+        if filename.endswith(".jsonl"):
+            corpus_file.write(b"".join(json.dumps({document: in_annotations[document]}) + b"\n"
+                for document in in_annotations))
+
+        else:
+            corpus_file.write(json.dumps(in_annotations))
+
+        corpus_file.close()
+
+
+
+def write_pubtator_corpus(filename, annotations, entity_type):
+    """Write the corpus in the PubTator format of the BC5CDR corpus."""
+
+    lines = []
+
+    for document in annotations:
+        document_id = document.split("_")[1]
+        text = " ".join(text for url, text in annotations[document])
+        lines.append("{}|t|Synthetic document {}".format(document_id, document_id))
+        lines.append("{}|a|{}".format(document_id, text))
+        start = 0
+
+        for url, mention in annotations[document]:
+            lines.append("\t".join([document_id, str(start), str(start + len(mention)), mention, entity_type, url]))
+            start += len(mention) + 1
+
+        lines.append("")
+
+    with open(filename, "w") as corpus_file:
+        corpus_file.write("\n".join(lines) + "\n")
+        corpus_file.close()
+
+
+
+def generate_workspace(workdir, kb="chebi", n_concepts=10000, synonyms_per_concept=1.0, parents_per_concept=1.5,
+        relation_density=0.001, n_documents=1000, mentions_per_document=10, seed=0):
+    """Write in workdir the files read by run.py for a synthetic KB and corpus: the ontology ('chebi.obo'
+    or 'CTD_diseases.obo'), the extracted relations, the corpus as 'corpus.json', 'corpus.jsonl' and
+    as the BC5CDR test set in PubTator format.
+
+    Ensures:
+        annotations: is dict outputted by generate_corpus
+    """
+
+    entity_type = "Chemical" if kb == "chebi" else "Disease"
+    obo_filename = "chebi.obo" if kb == "chebi" else "CTD_diseases.obo"
+    relations_filename = "chebi_relations.json" if kb == "chebi" else "Disease_relations.json"
+
+    os.makedirs(workdir + "/" + pubtator_dir, exist_ok=True)
+
+    concepts = generate_concepts(kb, n_concepts, synonyms_per_concept, parents_per_concept, seed=seed)
+    write_obo(workdir + "/" + obo_filename, kb, concepts)
+    write_relations(workdir + "/" + relations_filename, concepts, relation_density, seed=seed)
+
+    annotations = generate_corpus(concepts, n_documents, mentions_per_document, seed=seed)
+    write_json_corpus(workdir + "/corpus.json", annotations)
+    write_json_corpus(workdir + "/corpus.jsonl", annotations)
+    write_pubtator_corpus(workdir + "/" + pubtator_dir + "CDR_TestSet.PubTator.txt", annotations, entity_type)
+
+    return annotations
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic ontology, extracted relations and corpus")
+    parser.add_argument("workdir", type=str)
+    parser.add_argument("--kb", type=str, default="chebi", choices=["chebi", "medic"])
+    parser.add_argument("--concepts", type=int, default=10000)
+    parser.add_argument("--synonyms", type=float, default=1.0, help="Mean number of synonyms of each concept")
+    parser.add_argument("--parents", type=float, default=1.5, help="Mean number of 'is_a' parents of each concept")
+    parser.add_argument("--relation_density", type=float, default=0.001)
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--mentions", type=int, default=10, help="Mean number of mentions in each document")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate_workspace(args.workdir, args.kb, args.concepts, args.synonyms, args.parents, args.relation_density,
+        args.documents, args.mentions, args.seed)
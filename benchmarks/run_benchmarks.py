@@ -0,0 +1,188 @@
+import argparse
+import orjson as json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.append("./")
+
+from benchmarks.generate import generate_workspace
+from src.annotations import parse_cdr_annotations_pubtator, parse_input_file
+from src.candidates import build_candidate_links
+from src.information_content import build_ic_table, build_extrinsic_information_content_dict
+from src.ppr import disambiguate_documents
+from src.pre_process import build_entity_candidate_dict, load_extracted_relations, load_target_kb
+from src.process_results import build_results_dict, parse_results_file
+
+
+@contextmanager
+def timed(stages, stage):
+    """Record the wall and CPU time of the block in stages[stage] (in seconds)."""
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    yield
+    stages[stage] = {"wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu}
+
+
+
+def write_results_file(filename, answers):
+    """Write the answers in the format of the file outputted by ppr_for_ned_all."""
+
+    lines = []
+
+    for document in answers:
+        lines.append("=== {}".format(document))
+        lines.extend("{}\tE={}\t{}\tANS={}".format(number_of_mentions, entity_text, correct_answer, answer)
+            for number_of_mentions, entity_text, correct_answer, answer in answers[document])
+        lines.append("")
+
+    with open(filename, "w") as results_file:
+        results_file.write("\n".join(lines) + "\n")
+        results_file.close()
+
+
+
+def git_commit():
+    """Current commit of the repository (None outside a git repository)."""
+
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            check=True).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def run_benchmark(args):
+    """Generate a synthetic KB and corpus in a working directory and time each stage of the PPR-IC model.
+
+    Ensures:
+        report: is dict with the parameters, the counts of the synthetic data and the wall and CPU time of each stage
+    """
+
+    stages, counts = dict(), dict()
+    entity_type = "Chemical" if args.kb == "chebi" else "Disease"
+    workdir = args.workdir or tempfile.mkdtemp(prefix="reel_benchmark_")
+    report = {"commit": git_commit(), "python": platform.python_version(), "machine": platform.machine(),
+        "cpus": os.cpu_count(), "parameters": vars(args)}
+
+    with timed(stages, "generate"):
+        generate_workspace(workdir, args.kb, args.concepts, args.synonyms, args.parents, args.relation_density,
+            args.documents, args.mentions, args.seed)
+
+    cwd = os.getcwd()
+    os.chdir(workdir) # The KB loaders and the caches use paths relative to the working directory
+
+    try:
+        with timed(stages, "kb_build"): # Parse the OBO file and compile the snapshot
+            load_target_kb(args.kb)
+
+        with timed(stages, "kb_load"): # Open the snapshot
+            ontology_graph, name_to_id, synonym_to_id, entity_type = load_target_kb(args.kb)
+
+        with timed(stages, "corpus_parse"):
+            dataset = None
+
+            if args.corpus == "pubtator":
+                annotations = parse_cdr_annotations_pubtator(entity_type, "test")
+                dataset = "bc5cdr_{}_test".format("chemicals" if entity_type == "Chemical" else "medic")
+
+            else:
+                annotations = parse_input_file("corpus.json")
+
+        with timed(stages, "retrieval"):
+            documents_entity_list, statistics = build_entity_candidate_dict(args.kb, annotations, 0.5, ontology_graph,
+                name_to_id, synonym_to_id, dataset=dataset, show_progress=False, retrieval=args.retrieval,
+                workers=args.workers)
+
+        with timed(stages, "retrieval_cached"): # The matches of every mention are in the candidates cache
+            documents_entity_list, statistics = build_entity_candidate_dict(args.kb, annotations, 0.5, ontology_graph,
+                name_to_id, synonym_to_id, dataset=dataset, show_progress=False, retrieval=args.retrieval,
+                workers=args.workers)
+
+        with timed(stages, "relations_load"):
+            extracted_relations = load_extracted_relations(args.kb, entity_type, args.link_mode)
+
+        with timed(stages, "links"):
+            linked_ids = dict()
+
+            for document in documents_entity_list:
+                build_candidate_links(documents_entity_list[document], ontology_graph, args.link_mode,
+                    extracted_relations, linked_ids=linked_ids)
+
+        with timed(stages, "ic"):
+            ic_dict = build_ic_table(documents_entity_list, build_extrinsic_information_content_dict(annotations))
+
+        with timed(stages, "ppr"):
+            answers = disambiguate_documents(documents_entity_list, ic_dict)
+
+        write_results_file("all_all", answers)
+
+        with timed(stages, "results"):
+            results_dict = build_results_dict(parse_results_file("all_all"), args.kb)
+
+        counts["kb_names"], counts["kb_synonyms"] = len(name_to_id), len(synonym_to_id)
+        counts["kb_edges"] = ontology_graph.number_of_edges()
+        counts["documents"] = len(annotations)
+        counts["mentions"] = sum(len(annotations[document]) for document in annotations)
+        counts["unique_entities"] = sum(len(documents_entity_list[document]) for document in documents_entity_list)
+        counts["candidates"] = sum(len(entity_list[e]) - 1 for entity_list in documents_entity_list.values()
+            for e in entity_list)
+        counts["candidate_links"] = sum(len(c["links"]) for entity_list in documents_entity_list.values()
+            for e in entity_list for c in entity_list[e][1:])
+        counts["answers"] = sum(len(results_dict[document]) for document in results_dict)
+
+    finally:
+        os.chdir(cwd)
+
+        if args.workdir == None and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report["counts"] = counts
+    report["stages"] = stages
+    report["total_wall"] = sum(stages[stage]["wall"] for stage in stages)
+
+    return report
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time each stage of the PPR-IC model on a synthetic KB and corpus")
+    parser.add_argument("--kb", type=str, default="chebi", choices=["chebi", "medic"])
+    parser.add_argument("--concepts", type=int, default=10000)
+    parser.add_argument("--synonyms", type=float, default=1.0, help="Mean number of synonyms of each concept")
+    parser.add_argument("--parents", type=float, default=1.5, help="Mean number of 'is_a' parents of each concept")
+    parser.add_argument("--relation_density", type=float, default=0.001)
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--mentions", type=int, default=10, help="Mean number of mentions in each document")
+    parser.add_argument("--corpus", type=str, default="json", choices=["json", "pubtator"])
+    parser.add_argument("--link_mode", type=str, default="kb_corpus_link",
+        choices=["kb_link", "corpus_link", "kb_corpus_link"])
+    parser.add_argument("--retrieval", type=str, default="cdist", choices=["cdist", "none", "ngram"])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", type=str, help="Directory for the generated files (a temporary directory by default)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary directory")
+    parser.add_argument("--out", type=str, help="JSON file with the report (printed if not given)")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+
+    if args.out != None:
+
+        with open(args.out, "wb") as out_file:
+            out_file.write(json.dumps(report, option=json.OPT_INDENT_2))
+            out_file.close()
+
+    for stage in report["stages"]:
+        print("{:<18}{:>10.3f} s wall{:>10.3f} s cpu".format(stage, report["stages"][stage]["wall"],
+            report["stages"][stage]["cpu"]), file=sys.stderr)
+
+    if args.out == None:
+        print(json.dumps(report, option=json.OPT_INDENT_2).decode("utf-8"))
@@ -0,0 +1,182 @@
+import java.io.BufferedReader;
+import java.io.BufferedWriter;
+import java.io.EOFException;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.util.Comparator;
+import java.util.stream.Stream;
+
+/**
+ * Persistent disambiguation worker: keeps one JVM alive and applies ppr_for_ned_all
+ * to the candidates received over stdin, answering over stdout.
+ *
+ * Request (one per run, all lines in UTF-8):
+ *
+ *   RUN <model> <link_mode>
+ *   IC <n>                      followed by n lines of the information content file
+ *   DOC <n> <doc_id>            followed by n lines of the candidates file of doc_id
+ *   ...
+ *   END
+ *
+ * Response: the lines of the 'all_all' results file of ppr_for_ned_all, followed by
+ * a line 'END' (or a line 'ERROR <message>' followed by 'END').
+ *
+ * The files of each request are written under a private run label ('worker_<pid>'),
+ * so the ppr_for_ned_all class is used as is. The class is loaded again for each
+ * request by a new class loader, so its static fields start from their initial
+ * values, but the JVM startup is only paid once. The output of ppr_for_ned_all
+ * is redirected to stderr.
+ *
+ * Compile with 'javac ppr_worker.java' and start with 'java ppr_worker' in the
+ * directory with ppr_for_ned_all.class.
+ */
+public class ppr_worker {
+
+    static final String RUN_LABEL = "worker_" + ProcessHandle.current().pid();
+
+    public static void main(String[] args) throws IOException {
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), false, "UTF-8");
+        URL classDir = new File(".").getAbsoluteFile().toURI().toURL();
+        System.setOut(System.err);
+
+        String line;
+
+        while ((line = in.readLine()) != null) {
+
+            if (line.isEmpty()) {
+                continue;
+            }
+
+            String[] request = line.split(" ");
+
+            try {
+
+                if (request.length != 3 || !request[0].equals("RUN")) {
+                    skipRequest(in);
+                    throw new IllegalArgumentException("expected 'RUN <model> <link_mode>'");
+                }
+
+                Path resultsFile = writeRequest(in, request[1], request[2]);
+                run(classDir, request[1], request[2]);
+
+                try (BufferedReader results = Files.newBufferedReader(resultsFile, StandardCharsets.UTF_8)) {
+                    String result;
+
+                    while ((result = results.readLine()) != null) {
+                        out.println(result);
+                    }
+                }
+
+            } catch (Exception e) {
+                Throwable cause = e instanceof InvocationTargetException ? e.getCause() : e;
+                out.println("ERROR " + String.valueOf(cause).replace('\n', ' '));
+            }
+
+            out.println("END");
+            out.flush();
+        }
+
+        deleteTree(Paths.get("candidates", RUN_LABEL));
+        deleteTree(Paths.get("results", RUN_LABEL));
+        Files.deleteIfExists(Paths.get(RUN_LABEL + "_ic"));
+    }
+
+    /**
+     * Write the information content and the candidates files of a request, returns the results file.
+     * If the request is malformed, its remaining lines are skipped up to the 'END' line, so the
+     * next request is read from its first line.
+     */
+    static Path writeRequest(BufferedReader in, String model, String linkMode) throws IOException {
+        Path candidatesDir = Paths.get("candidates", RUN_LABEL, linkMode);
+        Path resultsDir = Paths.get("results", RUN_LABEL, model, linkMode);
+        boolean ended = false;
+
+        try {
+            deleteTree(candidatesDir);
+            deleteTree(resultsDir);
+            Files.createDirectories(candidatesDir);
+            Files.createDirectories(resultsDir);
+
+            String header;
+
+            while (!(header = readRequestLine(in)).equals("END")) {
+                String[] fields = header.split(" ", 3);
+
+                if (!(fields[0].equals("IC") && fields.length == 2 || fields[0].equals("DOC") && fields.length == 3)) {
+                    throw new IllegalArgumentException("expected 'IC <n>', 'DOC <n> <doc_id>' or 'END', got '" + header + "'");
+                }
+
+                int n = Integer.parseInt(fields[1]);
+                Path target = fields[0].equals("IC") ? Paths.get(RUN_LABEL + "_ic") : candidatesDir.resolve(fields[2]);
+
+                try (BufferedWriter writer = Files.newBufferedWriter(target, StandardCharsets.UTF_8)) {
+
+                    for (int i = 0; i < n; i++) {
+                        String line = readRequestLine(in);
+
+                        if (line.equals("END")) {
+                            ended = true;
+                            throw new IllegalArgumentException("the request ended before the " + n + " lines of '" + header + "'");
+                        }
+
+                        writer.write(line);
+                        writer.write("\n");
+                    }
+                }
+            }
+
+        } catch (IOException | RuntimeException e) {
+
+            if (!ended) {
+                skipRequest(in);
+            }
+
+            throw e;
+        }
+
+        return resultsDir.resolve("all_all");
+    }
+
+    /** Read a line of a request, the input must not end before the 'END' line. */
+    static String readRequestLine(BufferedReader in) throws IOException {
+        String line = in.readLine();
+
+        if (line == null) {
+            throw new EOFException("the input ended before the 'END' line of the request");
+        }
+
+        return line;
+    }
+
+    /** Apply ppr_for_ned_all, loaded by a new class loader, to the files of the request. */
+    static void run(URL classDir, String model, String linkMode) throws Exception {
+
+        try (URLClassLoader loader = new URLClassLoader(new URL[] {classDir}, ClassLoader.getPlatformClassLoader())) {
+            Class<?> ppr = loader.loadClass("ppr_for_ned_all");
+            ppr.getMethod("main", String[].class).invoke(null, (Object) new String[] {RUN_LABEL, model, linkMode});
+        }
+    }
+
+    static void deleteTree(Path path) throws IOException {
+
+        if (!Files.exists(path)) {
+            return;
+        }
+
+        try (Stream<Path> paths = Files.walk(path)) {
+            paths.sorted(Comparator.reverseOrder()).map(Path::toFile).forEach(File::delete);
+        }
+    }
+}
@@ -1,7 +1,13 @@
 import argparse
-import os
+from src.cache import set_max_entries
+from src.incremental import merge_answers
+from src.metrics import enable, stage, write_report
+from src.multi_kb import multi_kb_choices, run_multi_kb
 from src.pre_process import pre_process
-from src.process_results import process_results
+from src.ppr import disambiguate_documents
+from src.ppr_java import JavaPprWorker, run_java_ppr
+from src.process_results import parse_results_file, process_results
+from src.server import serve, serve_stdin, stream_file
 
 if __name__ == "__main__":
 
@@ -33,18 +39,148 @@ if __name__ == "__main__":
         help= "Read json input file containing the entities to be linked. \
         Format of the file: {'doc_id': 'entity_text_1', 'entity_text_2'}")
     parser.add_argument("-target_kb", type=str, required=True,
-        choices = ['chebi', 'ctd_chem', 'medic'],
+        choices = ['chebi', 'ctd_chem', 'medic', 'medic+ctd_chem', 'medic+chebi'],
         help= "If there is an input file, this argument specifies the target \
-            KB to where the entities must be matched")
+            KB to where the entities must be matched. With 'medic+ctd_chem' or \
+            'medic+chebi' the diseases and the chemicals of the input file (in \
+            PubTator format or json {'doc_id': {'Chemical': [...], 'Disease': \
+            [...]}}) are linked in a single run")
+    parser.add_argument("--ppr_engine", type=str, required=False, default='python',
+        choices = ['python', 'java', 'java_worker'],
+        help= "Implementation of the PPR algorithm used by the 'ppr_ic' model: \
+            'python' (deterministic sparse computation in memory), 'java' \
+            (Monte Carlo random walks in ppr_for_ned_all, reads the candidates files) \
+            or 'java_worker' (ppr_for_ned_all in a single long-lived JVM that \
+            receives the candidates over a pipe, also with '--serve')")
+    parser.add_argument("--retrieval", type=str, required=False, default='cdist',
+        choices = ['cdist', 'none', 'ngram'],
+        help= "How the KB names and synonyms matching the entities are retrieved \
+            before the candidates are generated: 'cdist' (all the entities are \
+            compared with all names and synonyms at once using all CPU cores), \
+            'none' (each entity is compared with all names and synonyms, one at \
+            a time) or 'ngram' (approximate, only the names and synonyms \
+            shortlisted by a character n-gram index are compared with each \
+            entity, so the top 10 candidates may differ from the other modes)")
+    parser.add_argument("--cache_size", type=int, required=False,
+        help= "Maximum number of entity mentions kept in each candidates cache \
+            in 'temp/' (the least recently used are removed), no limit by default")
+    parser.add_argument("--workers", type=int, required=False, default=1,
+        help= "Number of processes generating the candidates of the unique \
+            entity mentions and, with the 'java' PPR engine, number of JVMs \
+            disambiguating shards of the candidates files at the same time. \
+            The statistics and the outputs are the same as with a single process")
+    parser.add_argument("--window", type=int, required=False, default=256,
+        help= "If the input file is a JSON lines file ('.jsonl', one request \
+            {'doc_id': ['entity_text_1', ...]} per line, '-' for stdin), \
+            number of lines linked at once. The results are written to \
+            '<out_dir><run_label>_results.jsonl', one line per input line")
+    parser.add_argument("--in_memory", action='store_true',
+        help= "Keep the candidates, the information content and the answers \
+            in memory from the pre-processing to the output (requires the \
+            'python' or the 'java_worker' PPR engine), no candidates files are written")
+    parser.add_argument("--candidate_store", action='store_true',
+        help= "Write the candidates of the run to a single binary file \
+            'candidates/<run_label>/<link_mode>.store' (integer columns, a shared \
+            string table and an index of the entities of each document) instead \
+            of a candidates file for each document. The 'python' and 'java_worker' \
+            PPR engines read it directly, for the 'java' engine the candidates \
+            files are exported from it")
+    parser.add_argument("--incremental", action='store_true',
+        help= "Only generate the candidates of and disambiguate the documents of \
+            the input file that are new or changed since the last run with the same \
+            run label and link mode, the answers of the other documents are reused \
+            (a manifest with the hash of each document is kept in 'candidates/<run_label>/')")
+    parser.add_argument("--debug_files", action='store_true',
+        help= "With '--in_memory', also write the candidates files and the \
+            information content file to inspect them")
+    parser.add_argument("--metrics_out", "--metrics-out", type=str, required=False,
+        help= "Write a JSON report with the wall time, CPU time and peak RSS of \
+            each stage, the counts of mentions, candidates, links and documents, \
+            the hits and misses of the candidates caches and the slowest mentions")
+    parser.add_argument("--profile", type=str, required=False,
+        help= "Directory where a cProfile dump '<stage>.prof' of each stage is \
+            written (e.g. to open with 'python -m pstats')")
+    parser.add_argument("--slowest", type=int, required=False, default=20,
+        help= "Number of slowest mentions (candidates retrieval time) in the report")
+    parser.add_argument("--serve", type=str, required=False, choices = ['http', 'stdin'],
+        help= "Keep the target KB loaded and link the entities of each request \
+            with the 'ppr_ic' model: 'http' (POST {'doc_id': ['entity_text_1', \
+            'entity_text_2']} to /link, counters in GET /stats) or 'stdin' (one \
+            JSON request per line, one JSON result per line in stdout)")
+    parser.add_argument("--host", type=str, required=False, default='127.0.0.1')
+    parser.add_argument("--port", type=int, required=False, default=8000)
     
     parser.add_argument("--out_dir", type=str,required=False)
     args = parser.parse_args()
 
+    if args.in_memory and args.ppr_engine == "java":
+        parser.error("'--in_memory' requires '--ppr_engine python' or '--ppr_engine java_worker'")
+
+    if args.incremental and (args.input_file == None or not args.input_file.endswith(".json") 
+            or args.model != "ppr_ic" or args.target_kb in multi_kb_choices):
+        parser.error("'--incremental' links a json input file to a single target KB with the 'ppr_ic' model")
+
+    if args.candidate_store and (args.in_memory or args.incremental or args.model == "baseline" or args.serve != None
+            or args.target_kb in multi_kb_choices or (args.input_file != None and not args.input_file.endswith(".json"))):
+        parser.error("'--candidate_store' writes the candidates of a json input file or of a dataset linked to a \
+single target KB with the 'ppr_ic' model (not with '--in_memory' or '--incremental')")
+
+    if args.cache_size != None:
+        set_max_entries(args.cache_size)
+
+    if args.metrics_out != None or args.profile != None:
+        enable(profile=args.profile, slowest=args.slowest)
+
+    if args.target_kb in multi_kb_choices:
+
+        if args.input_file == None or args.model == "baseline" or args.serve != None:
+            parser.error("'-target_kb {}' links an input file with the 'ppr_ic' model".format(args.target_kb))
+
+        # The candidates are always kept in memory, there are no candidates files for 'java' or '--debug_files'
+        if args.ppr_engine == "java" or args.debug_files:
+            parser.error("'-target_kb {}' keeps the candidates in memory, it requires '--ppr_engine python' or \
+'--ppr_engine java_worker' and can not be used with '--debug_files'".format(args.target_kb))
+
+        run_multi_kb(args.target_kb, args.link_mode, args.input_file, 
+            '{}{}_results.json'.format(args.out_dir or '', args.run_label), 
+            retrieval=args.retrieval, workers=args.workers, ppr_engine=args.ppr_engine)
+        
+        if args.metrics_out != None:
+            write_report(args.metrics_out)
+        
+        exit()
+
+    if args.serve == "http":
+        serve(args.target_kb, args.link_mode, host=args.host, port=args.port, retrieval=args.retrieval, 
+            ppr_engine=args.ppr_engine)
+        exit()
+
+    elif args.serve == "stdin":
+        serve_stdin(args.target_kb, args.link_mode, retrieval=args.retrieval, ppr_engine=args.ppr_engine)
+        exit()
+
+    if args.input_file != None and (args.input_file.endswith(".jsonl") or args.input_file == "-"):
+        
+        if args.model == "baseline":
+            parser.error("JSON lines input files are linked with the 'ppr_ic' model")
+
+        out_filename = '{}{}_results.jsonl'.format(args.out_dir or '', args.run_label)
+        stream_file(args.target_kb, args.link_mode, args.input_file, out_filename, 
+            window_size=args.window, retrieval=args.retrieval, ppr_engine=args.ppr_engine)
+        
+        if args.metrics_out != None:
+            write_report(args.metrics_out)
+        
+        exit()
+
     #------------------------------------------------------------------------------
     #               Pre-processing or 'baseline' model application
     #------------------------------------------------------------------------------
-    pre_process(args.model, run_label=args.run_label, link_mode=args.link_mode, 
-        dataset=args.dataset, input_file=args.input_file, target_kb=args.target_kb)
+    documents_entity_list, ic_dict = pre_process(args.model, run_label=args.run_label, 
+        link_mode=args.link_mode, dataset=args.dataset, input_file=args.input_file, 
+        target_kb=args.target_kb, retrieval=args.retrieval, workers=args.workers, 
+        write_files=not args.in_memory or args.debug_files, incremental=args.incremental, 
+        ppr_engine=args.ppr_engine, candidate_store=args.candidate_store)
 
     #------------------------------------------------------------------------------
     #                                 REEL model
@@ -54,15 +190,60 @@ if __name__ == "__main__":
     # and relations are added according to link_mode
 
     if args.model != "baseline":
-        comm = ''
+        answers = None
+
+        if args.ppr_engine == "python":
+            
+            with stage("ppr"):
+                answers = disambiguate_documents(documents_entity_list, ic_dict)
+
+        elif args.ppr_engine == "java_worker":
+            java_worker = JavaPprWorker("Disease" if args.target_kb == "medic" else "Chemical", args.link_mode, 
+                model=args.model)
+
+            with stage("ppr_java"):
+                answers = java_worker.disambiguate_documents(documents_entity_list, ic_dict)
+            
+            java_worker.close()
 
         if args.input_file != None:
-            comm = 'java ppr_for_ned_all {} {} {}'.format(args.run_label, args.model, args.link_mode)
-            os.system(comm)
-            process_results(args.target_kb, args.link_mode, run_label=args.run_label, input_file=args.input_file, out_dir=args.out_dir)
+            
+            if args.ppr_engine == "java" and args.incremental:
+                
+                if len(documents_entity_list) > 0:
+                    
+                    with stage("ppr_java"):
+                        run_java_ppr(args.run_label, args.model, args.link_mode, list(documents_entity_list.keys()), 
+                            shards=args.workers, subset=True)
+                    
+                    answers = parse_results_file("results/{}/{}/{}/all_all".format(args.run_label, args.model, args.link_mode))
+                
+                else:
+                    answers = dict()
+            
+            elif args.ppr_engine == "java":
+                
+                with stage("ppr_java"):
+                    run_java_ppr(args.run_label, args.model, args.link_mode, list(documents_entity_list.keys()), 
+                        shards=args.workers)
+            
+            if args.incremental:
+                # Answers of the new or changed documents and of the unchanged documents
+                answers = merge_answers(args.run_label, args.link_mode, list(documents_entity_list.keys()), answers)
+
+            with stage("process_results"):
+                process_results(args.target_kb, args.link_mode, run_label=args.run_label, input_file=args.input_file, out_dir=args.out_dir, answers=answers)
 
         elif args.dataset:
-            comm = 'java ppr_for_ned_all {} {} {}'.format(args.dataset, args.model, args.link_mode)
-            os.system(comm)
-            process_results(args.target_kb, args.link_mode, dataset= args.dataset, out_dir=args.out_dir)
+            
+            if args.ppr_engine == "java":
+                
+                with stage("ppr_java"):
+                    run_java_ppr(args.dataset, args.model, args.link_mode, list(documents_entity_list.keys()), 
+                        shards=args.workers)
+            
+            with stage("process_results"):
+                process_results(args.target_kb, args.link_mode, dataset= args.dataset, out_dir=args.out_dir, answers=answers)
 
+    if args.metrics_out != None:
+        write_report(args.metrics_out)
@@ -6,25 +6,38 @@ import sys
 sys.path.append("./")
 
 
-def parse_input_file(filepath):
-    """Annotations format: {'doc_id: [(kb_id, annot1)]}"""
+def build_input_annotations(in_annotations):
+    """Convert the entities inputted by the user to the annotations format.
     
+    Requires:
+        in_annotations: is dict, each key is a document id, values are lists with the entities text
+
+    Ensures:
+        annotations: is dict, format: {'doc_id: [(kb_id, annot1)]}, the kb_id of each annotation is 'none'
+    """
+
     annotations = {}
 
+    for doc_id in in_annotations.keys():
+        doc_entities = in_annotations[doc_id]
+        doc_entities_up = []
+
+        for entity in doc_entities:
+            doc_entities_up.append(('none', entity))
+    
+        annotations[doc_id] = doc_entities_up
+
+    return annotations
+
+
+def parse_input_file(filepath):
+    """Annotations format: {'doc_id: [(kb_id, annot1)]}"""
+    
     with open(filepath, 'r') as input_file:
         in_annotations = json.loads(input_file.read())
         input_file.close()
 
-        for doc_id in in_annotations.keys():
-            doc_entities = in_annotations[doc_id]
-            doc_entities_up = []
-
-            for entity in doc_entities:
-                doc_entities_up.append(('none', entity))
-        
-            annotations[doc_id] = doc_entities_up
-
-        return annotations
+        return build_input_annotations(in_annotations)
 
 
 def parse_cdr_annotations_pubtator(entity_type, subset):
@@ -55,33 +68,71 @@ def parse_cdr_annotations_pubtator(entity_type, subset):
         filenames.append("CDR_TestSet.PubTator.txt")
   
     for filename in filenames:
+        file_annotations = parse_pubtator_file(corpus_dir + filename, entity_types=(entity_type,))[entity_type]
 
-        with open(corpus_dir + filename, 'r') as corpus_file:
-            data = corpus_file.readlines()
-            corpus_file.close()
-
-            for line in data:
-                line_data = line.split("\t")
-                document_id = line_data[0]
-           
-                if len(line_data) == 6 and line_data[4] == entity_type:
-                    mesh_id = line_data[5].strip("\n")
-                    
-                    annotation_text = line_data[3]
-                    annotation = (mesh_id, annotation_text)
-            
-                    if document_id in annotations.keys():
-                        current_values = annotations[document_id]
-                        current_values.append(annotation)
-                        annotations[document_id] = current_values
-                    
-                    else:
-                        annotations[document_id] = [annotation]
+        for document_id in file_annotations:
+            annotations.setdefault(document_id, []).extend(file_annotations[document_id])
  
     return annotations
 
 
 
+def parse_pubtator_file(filename, entity_types=("Chemical", "Disease")):
+    """Get the annotations of several entity types in a file in PubTator format, reading the file once.
+
+    Requires:
+        filename: is str, path of the file
+        entity_types: is tuple with the entity types to keep, e.g. ("Chemical", "Disease")
+
+    Ensures:
+        annotations_by_type: is dict, each key is an entity type and values are dicts, each key is document str, 
+            values are list with all the annotations of that type in document
+    """
+
+    annotations_by_type = {entity_type: dict() for entity_type in entity_types}
+
+    with open(filename, 'r') as corpus_file:
+        data = corpus_file.readlines()
+        corpus_file.close()
+
+    for line in data:
+        line_data = line.split("\t")
+        document_id = line_data[0]
+   
+        if len(line_data) == 6 and line_data[4] in annotations_by_type:
+            mesh_id = line_data[5].strip("\n")
+            annotation = (mesh_id, line_data[3])
+            annotations_by_type[line_data[4]].setdefault(document_id, []).append(annotation)
+
+    return annotations_by_type
+
+
+
+def parse_typed_input_file(filepath):
+    """Get the annotations of each entity type in an input file with the format
+    {'doc_id': {'Chemical': ['entity_text_1', ...], 'Disease': ['entity_text_2', ...]}}.
+
+    Ensures:
+        annotations_by_type: is dict, each key is an entity type and values are 
+            dicts outputted by build_input_annotations
+    """
+
+    with open(filepath, 'rb') as input_file:
+        in_annotations = json.loads(input_file.read())
+        input_file.close()
+
+    in_annotations_by_type = dict()
+
+    for doc_id in in_annotations:
+
+        for entity_type in in_annotations[doc_id]:
+            in_annotations_by_type.setdefault(entity_type, dict())[doc_id] = in_annotations[doc_id][entity_type]
+
+    return {entity_type: build_input_annotations(in_annotations_by_type[entity_type]) 
+        for entity_type in in_annotations_by_type}
+
+
+
 def parse_cdr_annotations_bioc(entity_type, subset):
     """Get each annotation in the BC5CDR corpus with documents in BioCreative format.
 
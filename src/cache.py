@@ -0,0 +1,283 @@
+import argparse
+import orjson as json
+import os
+import pickle
+import sqlite3
+import sys
+
+sys.path.append("./")
+
+
+# Every CandidateCache created, so that settings can be applied to all of them
+candidate_caches = []
+entries_table = ("CREATE TABLE IF NOT EXISTS {}entries (retrieval TEXT NOT NULL, mention TEXT NOT NULL, "
+    "matches BLOB NOT NULL, last_used INTEGER NOT NULL, PRIMARY KEY (retrieval, mention))")
+exact_key = "exact" # 'cdist' and 'none' retrieve the same matches, they share the entries
+legacy_retrieval = exact_key # the legacy pickled caches have the matches of the full process.extract scan
+
+
+
+def retrieval_key(retrieval):
+    """Key of the entries of a retrieval mode: the exact modes share one key, 'ngram' has its own."""
+
+    return "ngram" if retrieval == "ngram" else exact_key
+
+
+class CandidateCache:
+    """Disk-backed cache with the KB matches retrieved for each entity mention.
+
+    The entries are stored in a sqlite3 database and each new entry is written
+    immediately, so nothing is lost if the process is interrupted. The database
+    is opened on first use and reopened after a fork, so several worker processes
+    can share the same cache file. If max_entries is set, the least recently used
+    entries are removed when the cache grows beyond that size.
+
+    The entries of the approximate 'ngram' retrieval (see batch_matches) are stored 
+    apart from the entries of the exact modes ('cdist' and 'none', with the same matches), 
+    so they are never returned to a run with an exact mode. The mode of the lookups is 
+    set with set_retrieval.
+    """
+
+    def __init__(self, filename, legacy_filename=None, max_entries=None):
+        """
+        Requires:
+            filename: is str, path of the sqlite3 database
+            legacy_filename: is str, path of a pickled dict with entries to import
+                when the database is created
+            max_entries: is int, maximum number of entries (None for no limit)
+        """
+
+        self.filename = filename
+        self.legacy_filename = legacy_filename
+        self.max_entries = max_entries
+        self.retrieval = exact_key
+        self.connection, self.pid = None, None
+        self.hits, self.misses, self.writes, self.evictions = 0, 0, 0, 0
+        self.clock = 0
+
+        candidate_caches.append(self)
+
+
+    def connect(self):
+        """Open the database in the current process."""
+
+        if self.connection != None and self.pid == os.getpid():
+            return self.connection
+
+        is_new = not os.path.isfile(self.filename)
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+
+        self.connection = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        # The entries of caches created before the retrieval mode was stored may come from any mode
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(entries)")]
+
+        if len(columns) > 0 and "retrieval" not in columns:
+            self.connection.execute("DROP TABLE entries")
+            is_new = True
+
+        self.connection.execute(entries_table.format(""))
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+        # Entries stored for each exact mode apart are moved to the shared key
+        self.connection.execute("UPDATE OR IGNORE entries SET retrieval = ? WHERE retrieval IN ('cdist', 'none')", 
+            (exact_key,))
+        self.connection.execute("DELETE FROM entries WHERE retrieval IN ('cdist', 'none')")
+        self.pid = os.getpid()
+        self.clock = self.connection.execute("SELECT COALESCE(MAX(last_used), 0) FROM entries").fetchone()[0]
+
+        if is_new and self.legacy_filename != None and os.path.isfile(self.legacy_filename):
+
+            with open(self.legacy_filename, "rb") as legacy_file:
+                legacy_cache = pickle.load(legacy_file)
+                legacy_file.close()
+
+            self.update(legacy_cache, retrieval=legacy_retrieval)
+
+        return self.connection
+
+
+    def tick(self):
+        """Logical time used to find the least recently used entries."""
+
+        self.clock += 1
+
+        return self.clock
+
+
+    def __contains__(self, mention):
+        """Check if there is an entry for mention, without counting a lookup."""
+
+        row = self.connect().execute("SELECT 1 FROM entries WHERE retrieval = ? AND mention = ?", 
+            (self.retrieval, mention)).fetchone()
+
+        return row != None
+
+
+    def get(self, mention, default=None):
+        """Matches stored for mention, the lookup is counted as a hit or a miss.
+
+        Ensures:
+            matches: is list of tuples or default if there is no entry for mention
+        """
+
+        connection = self.connect()
+        row = connection.execute("SELECT rowid, matches FROM entries WHERE retrieval = ? AND mention = ?", 
+            (self.retrieval, mention)).fetchone()
+
+        if row == None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+
+        if self.max_entries != None:
+            connection.execute("UPDATE entries SET last_used = ? WHERE rowid = ?", (self.tick(), row[0]))
+
+        return [tuple(match) for match in json.loads(row[1])]
+
+
+    def __setitem__(self, mention, matches):
+
+        connection = self.connect()
+        connection.execute("INSERT OR REPLACE INTO entries (retrieval, mention, matches, last_used) VALUES (?, ?, ?, ?)",
+            (self.retrieval, mention, json.dumps(matches), self.tick()))
+        self.writes += 1
+
+        if self.max_entries != None and self.writes % 100 == 0:
+            self.evict()
+
+
+    def update(self, entries, retrieval=None):
+        """Add several entries in a single transaction.
+
+        Requires:
+            entries: is dict, each key is an entity mention and values are lists of matches
+            retrieval: is str, the retrieval mode of the matches (None for the current mode)
+        """
+
+        retrieval = retrieval_key(retrieval) if retrieval != None else self.retrieval
+        connection = self.connect()
+        connection.execute("BEGIN")
+        connection.executemany("INSERT OR REPLACE INTO entries (retrieval, mention, matches, last_used) VALUES (?, ?, ?, ?)",
+            ((retrieval, mention, json.dumps(entries[mention]), self.tick()) for mention in entries))
+        connection.execute("COMMIT")
+        self.writes += len(entries)
+        self.evict()
+
+
+    def __len__(self):
+
+        return self.connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+    def evict(self):
+        """Remove the least recently used entries beyond max_entries."""
+
+        if self.max_entries == None:
+            return
+
+        cursor = self.connect().execute("DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries "
+            "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        self.evictions += max(cursor.rowcount, 0)
+
+
+    def stats(self):
+        """Lookups, writes and size of the cache."""
+
+        lookups = self.hits + self.misses
+        modes = dict(self.connect().execute("SELECT retrieval, COUNT(*) FROM entries GROUP BY retrieval").fetchall())
+
+        return {"filename": self.filename, "entries": len(self), "entries_by_retrieval": modes, 
+            "hits": self.hits, "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0, "writes": self.writes,
+            "evictions": self.evictions, "max_entries": self.max_entries}
+
+
+    def export(self, filename):
+        """Copy all the entries to a new cache database."""
+
+        connection = self.connect()
+        connection.execute("ATTACH DATABASE ? AS other", (filename,))
+        connection.execute(entries_table.format("other."))
+        connection.execute("CREATE INDEX IF NOT EXISTS other.entries_last_used ON entries (last_used)")
+        connection.execute("INSERT OR REPLACE INTO other.entries (retrieval, mention, matches, last_used) "
+            "SELECT retrieval, mention, matches, last_used FROM main.entries")
+        connection.execute("DETACH DATABASE other")
+
+
+    def merge(self, filename):
+        """Add the entries of another cache database that are not in this cache.
+
+        Ensures:
+            added: is int, the number of entries added
+        """
+
+        connection = self.connect()
+        before = len(self)
+        connection.execute("ATTACH DATABASE ? AS other", (filename,))
+
+        if "retrieval" not in [row[1] for row in connection.execute("PRAGMA other.table_info(entries)")]:
+            connection.execute("DETACH DATABASE other")
+            raise ValueError("{} has no retrieval mode in the entries (created by an older version)".format(filename))
+
+        connection.execute("INSERT OR IGNORE INTO entries (retrieval, mention, matches, last_used) "
+            "SELECT CASE WHEN retrieval IN ('cdist', 'none') THEN ? ELSE retrieval END, mention, matches, last_used "
+            "FROM other.entries", (exact_key,))
+        connection.execute("DETACH DATABASE other")
+        self.clock = connection.execute("SELECT COALESCE(MAX(last_used), 0) FROM entries").fetchone()[0]
+        self.evict()
+
+        return len(self) - before
+
+
+    def close(self):
+
+        if self.connection != None and self.pid == os.getpid():
+            self.connection.close()
+
+        self.connection, self.pid = None, None
+
+
+
+def set_max_entries(max_entries):
+    """Set the maximum number of entries of every candidate cache."""
+
+    for cache in candidate_caches:
+        cache.max_entries = max_entries
+
+
+
+def set_retrieval(retrieval):
+    """Set the retrieval mode of the entries read and written in every candidate cache."""
+
+    for cache in candidate_caches:
+        cache.retrieval = retrieval_key(retrieval)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect, export or merge candidate caches")
+    parser.add_argument("command", type=str, choices=["stats", "export", "merge"])
+    parser.add_argument("cache_file", type=str, help="The cache database, e.g. temp/chebi_cache.sqlite")
+    parser.add_argument("other_file", type=str, nargs="?",
+        help="'export': the new database, 'merge': the database with the entries to add")
+    args = parser.parse_args()
+
+    cache = CandidateCache(args.cache_file)
+
+    if args.command == "stats":
+        print(json.dumps(cache.stats()).decode("utf-8"))
+
+    elif args.other_file == None:
+        parser.error("'{}' requires other_file".format(args.command))
+
+    elif args.command == "export":
+        cache.export(args.other_file)
+
+    elif args.command == "merge":
+        print("Added {} entries".format(cache.merge(args.other_file)))
+
+    cache.close()
@@ -0,0 +1,344 @@
+import argparse
+import numpy as np
+import orjson as json
+import os
+import sys
+from collections.abc import Mapping
+
+sys.path.append("./")
+
+from src.candidates import format_candidates
+from src.snapshot import build_string_pool
+from src.strings import entity_string
+
+
+# Candidate store: the candidates of all documents of a run in a single file, with
+# integer columns, a shared string table and the offsets of the entities of each
+# document. Layout: magic, header length (uint64), json header, then the arrays
+# (aligned to 8 bytes, offsets in the header relative to the end of the header)
+store_magic = b"REELCAND"
+store_format = 1
+store_alignment = 8
+
+
+def store_filename(run_label, link_mode):
+
+    return "candidates/{}/{}.store".format(run_label, link_mode)
+
+
+
+def aligned(size):
+
+    return (size + store_alignment - 1) // store_alignment * store_alignment
+
+
+
+def parse_entity_string(entity_str):
+    """Values of the fields of an entity string (see src/strings.py).
+
+    Ensures:
+        fields: is tuple (text, normalized_text, entity_type, qid, url)
+    """
+
+    values = [field.split(":", 1)[1] for field in entity_str.rstrip("\n").split("\t")[1:]]
+
+    return values[0], values[1], values[2], int(values[4][1:]), values[7]
+
+
+
+def write_candidate_store(filename, documents_entity_list, entity_type):
+    """Write the entities and the linked candidates of every corpus document to a candidate store.
+
+    Requires:
+        documents_entity_list: is dict outputted by build_entity_candidate_dict, with the links
+            between candidates (see build_candidate_links)
+        entity_type: is str, either "Chemical" or "Disease"
+
+    Ensures:
+        entities_used: (int) number of entities with at least one candidate
+    """
+
+    strings = dict() # string: index in the string table
+
+    def string_index(string):
+        return strings.setdefault(string, len(strings))
+
+    document_name, document_entities = [], [0]
+    entity_text, entity_normal, entity_type_name, entity_qid, entity_url, entity_candidates = [], [], [], [], [], [0]
+    candidate_id, candidate_incount, candidate_outcount, candidate_url, candidate_name, candidate_score = [], [], [], [], [], []
+    candidate_links, links = [0], []
+    entities_used = 0
+
+    for document in documents_entity_list:
+        entity_list = documents_entity_list[document]
+        document_name.append(string_index(document))
+
+        for e in entity_list:
+            text, normalized_text, entity_predicted_type, qid, url = parse_entity_string(entity_list[e][0])
+            entity_text.append(string_index(text))
+            entity_normal.append(string_index(normalized_text))
+            entity_type_name.append(string_index(entity_predicted_type))
+            entity_qid.append(qid)
+            entity_url.append(string_index(url))
+            entities_used += 1
+
+            for c in entity_list[e][1:]:
+                candidate_id.append(c["id"])
+                candidate_incount.append(c["incount"])
+                candidate_outcount.append(c["outcount"])
+                candidate_url.append(string_index(c["url"]))
+                candidate_name.append(string_index(c["name"]))
+                candidate_score.append(c["score"])
+                links.extend(c["links"])
+                candidate_links.append(len(links))
+
+            entity_candidates.append(len(candidate_id))
+
+        document_entities.append(len(entity_text))
+
+    arrays = dict()
+    arrays["string_pool"], arrays["string_offsets"] = build_string_pool(strings.keys())
+    arrays["document_name"] = np.array(document_name, dtype=np.int32)
+    arrays["document_entities"] = np.array(document_entities, dtype=np.int64)
+    arrays["entity_text"] = np.array(entity_text, dtype=np.int32)
+    arrays["entity_normal"] = np.array(entity_normal, dtype=np.int32)
+    arrays["entity_predicted_type"] = np.array(entity_type_name, dtype=np.int32)
+    arrays["entity_qid"] = np.array(entity_qid, dtype=np.int32)
+    arrays["entity_url"] = np.array(entity_url, dtype=np.int32)
+    arrays["entity_candidates"] = np.array(entity_candidates, dtype=np.int64)
+    arrays["candidate_id"] = np.array(candidate_id, dtype=np.int32)
+    arrays["candidate_incount"] = np.array(candidate_incount, dtype=np.int32)
+    arrays["candidate_outcount"] = np.array(candidate_outcount, dtype=np.int32)
+    arrays["candidate_url"] = np.array(candidate_url, dtype=np.int32)
+    arrays["candidate_name"] = np.array(candidate_name, dtype=np.int32)
+    arrays["candidate_score"] = np.array(candidate_score, dtype=np.float64)
+    arrays["candidate_links"] = np.array(candidate_links, dtype=np.int64)
+    arrays["links"] = np.array(links, dtype=np.int32)
+
+    write_store_arrays(filename, arrays, {"entity_type": entity_type, "documents": len(document_name)})
+
+    return entities_used
+
+
+
+def write_store_arrays(filename, arrays, meta):
+    """Write the arrays of a candidate store to a temporary file and rename it, so that
+    a store is never read while incomplete.
+    """
+
+    header = dict(meta, format=store_format, arrays=dict())
+    offset = 0
+
+    for array_name in arrays:
+        header["arrays"][array_name] = [arrays[array_name].dtype.str, len(arrays[array_name]), offset]
+        offset += aligned(arrays[array_name].nbytes)
+
+    header_bytes = json.dumps(header)
+    header_bytes += b" " * (aligned(len(store_magic) + 8 + len(header_bytes)) - len(store_magic) - 8 - len(header_bytes))
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+
+    with open(tmp_filename, "wb") as store_file:
+        store_file.write(store_magic)
+        store_file.write(np.uint64(len(header_bytes)).tobytes())
+        store_file.write(header_bytes)
+
+        for array_name in arrays:
+            data = np.ascontiguousarray(arrays[array_name]).tobytes()
+            store_file.write(data + b"\0" * (aligned(len(data)) - len(data)))
+
+        store_file.close()
+
+    os.replace(tmp_filename, filename)
+
+
+
+class CandidateStore(Mapping):
+    """Read-only view of a candidate store, the arrays are memory-mapped. It is used like
+    the documents_entity_list dict outputted by build_entity_candidate_dict: each key is a
+    document id and the entity list of a document (entity string followed by the candidate
+    dicts, with the links) is built from the arrays when it is accessed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, "rb") as store_file:
+
+            if store_file.read(len(store_magic)) != store_magic:
+                raise ValueError("{} is not a candidate store".format(filename))
+
+            header_size = int(np.frombuffer(store_file.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(store_file.read(header_size))
+            store_file.close()
+
+        if self.header["format"] != store_format:
+            raise ValueError("{} has candidate store format {}, expected {}".format(filename,
+                self.header["format"], store_format))
+
+        self.entity_type = self.header["entity_type"]
+        self.data_start = len(store_magic) + 8 + header_size
+        self.data = np.memmap(filename, dtype=np.uint8, mode="r")
+        self.arrays = dict()
+        self.string_list = None
+        self.document_index = None
+
+
+    def __getattr__(self, array_name):
+        # Arrays are only mapped when first needed
+        if array_name.startswith("__") or array_name in ("filename", "header", "data", "arrays"):
+            raise AttributeError(array_name)
+
+        if array_name not in self.arrays:
+
+            if array_name not in self.header["arrays"]:
+                raise AttributeError(array_name)
+
+            dtype, length, offset = self.header["arrays"][array_name]
+            dtype = np.dtype(dtype)
+            start = self.data_start + offset
+            self.arrays[array_name] = self.data[start:start + length * dtype.itemsize].view(dtype)
+
+        return self.arrays[array_name]
+
+
+    def strings(self):
+        """The decoded string table (decoded once, on first use)."""
+
+        if self.string_list == None:
+            self.string_list = self.string_pool.tobytes().decode("utf-8").split("\0")[:-1]
+
+        return self.string_list
+
+
+    def documents(self):
+
+        if self.document_index == None:
+            strings = self.strings()
+            self.document_index = {strings[i]: position for position, i in enumerate(self.document_name.tolist())}
+
+        return self.document_index
+
+
+    def __len__(self):
+
+        return self.header["documents"]
+
+
+    def __iter__(self):
+
+        return iter(self.documents())
+
+
+    def __contains__(self, document):
+
+        return document in self.documents()
+
+
+    def __getitem__(self, document):
+        """Entity list of a document, with the same entity strings and candidate dicts
+        as the one the store was written from.
+        """
+
+        position = self.documents()[document]
+        strings = self.strings()
+        first, last = self.document_entities[position], self.document_entities[position + 1]
+        candidates_ptr = self.entity_candidates[first:last + 1].tolist()
+        first_candidate, last_candidate = candidates_ptr[0], candidates_ptr[-1]
+        links_ptr = self.candidate_links[first_candidate:last_candidate + 1].tolist()
+        links = self.links[links_ptr[0]:links_ptr[-1]].tolist()
+        link_start = links_ptr[0]
+
+        candidate_columns = list(zip(*(column[first_candidate:last_candidate].tolist() for column in (self.candidate_url,
+            self.candidate_name, self.candidate_outcount, self.candidate_incount, self.candidate_id, self.candidate_score))))
+        entity_list = dict()
+
+        for j, (text, normalized_text, entity_predicted_type, qid, url) in enumerate(zip(*(column[first:last].tolist()
+                for column in (self.entity_text, self.entity_normal, self.entity_predicted_type, self.entity_qid, self.entity_url)))):
+            entity_str = entity_string.format(strings[text], strings[normalized_text], strings[entity_predicted_type],
+                qid, document, strings[url])
+            candidates = []
+
+            for k in range(candidates_ptr[j] - first_candidate, candidates_ptr[j + 1] - first_candidate):
+                url, name, outcount, incount, candidate_id, score = candidate_columns[k]
+                candidates.append({"url": strings[url], "name": strings[name], "outcount": outcount, "incount": incount,
+                    "id": candidate_id, "links": links[links_ptr[k] - link_start:links_ptr[k + 1] - link_start],
+                    "score": score})
+
+            entity_list[strings[normalized_text]] = [entity_str] + candidates
+
+        return entity_list
+
+
+    def urls(self):
+        """Urls of the entities and of the candidates of all documents (except empty urls),
+        in the order they first appear, read from the integer columns only.
+        """
+
+        n_entities, n_candidates = len(self.entity_url), len(self.candidate_url)
+        entity_candidates = np.asarray(self.entity_candidates)
+
+        # Each entity url is followed by the urls of its candidates
+        entity_position = np.arange(n_entities) + entity_candidates[:-1]
+        candidate_owner = np.repeat(np.arange(n_entities), np.diff(entity_candidates))
+        sequence = np.empty(n_entities + n_candidates, dtype=np.int64)
+        sequence[entity_position] = self.entity_url
+        sequence[np.arange(n_candidates) + candidate_owner + 1] = self.candidate_url
+
+        unique, first_position = np.unique(sequence, return_index=True)
+        strings = self.strings()
+
+        return [strings[i] for i in unique[np.argsort(first_position)].tolist() if strings[i] != ""]
+
+
+    def stats(self):
+
+        return {"documents": len(self), "entities": len(self.entity_url), "candidates": len(self.candidate_url),
+            "links": len(self.links), "strings": len(self.string_offsets) - 1, "bytes": os.path.getsize(self.filename)}
+
+
+
+def export_text(store, candidates_dir):
+    """Write a candidates file in the text format (see write_candidates) for each document
+    of a candidate store, e.g. for ppr_for_ned_all.
+
+    Requires:
+        store: is CandidateStore object
+        candidates_dir: is str, the directory of the candidates files (ending with '/')
+
+    Ensures:
+        entities_writen: (int) number of entities with at least one candidate
+    """
+
+    entities_writen = 0
+
+    for document in store:
+        lines, entities_used = format_candidates(store[document], store.entity_type)
+        entities_writen += entities_used
+
+        with open(candidates_dir + document, 'w') as candidates_file:
+            candidates_file.write("".join(lines))
+            candidates_file.close()
+
+    return entities_writen
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect a candidate store or export it to candidates files")
+    parser.add_argument("command", type=str, choices=["stats", "export"])
+    parser.add_argument("store_file", type=str, help="The candidate store, e.g. candidates/run_1/kb_link.store")
+    parser.add_argument("candidates_dir", type=str, nargs="?",
+        help="'export': the directory where the candidates files are written")
+    args = parser.parse_args()
+
+    store = CandidateStore(args.store_file)
+
+    if args.command == "stats":
+        print(json.dumps(store.stats()).decode("utf-8"))
+
+    elif args.candidates_dir == None:
+        parser.error("'export' requires candidates_dir")
+
+    else:
+        os.makedirs(args.candidates_dir, exist_ok=True)
+        print("Entities writen:", export_text(store, os.path.join(args.candidates_dir, "")))
@@ -1,100 +1,152 @@
-import networkx as nx
+from src.cache import set_retrieval
+from src.chebi import chebi_cache, map_to_chebi
+from src.ctd_chemicals import ctd_chem_cache, map_to_ctd_chemicals
+from src.medic import medic_cache, map_to_medic
+from src.normalization import find_exact_match
+from src.relation_store import related_kb_ids
+from src.retrieval import batch_matches
+from src.strings import candidate_string, entity_fields, field_text
 
-from src.chebi import map_to_chebi
-from src.ctd_chemicals import map_to_ctd_chemicals
-from src.medic import map_to_medic
-from src.strings import candidate_string
 
 
+def linked_ids_of(candidate_id, url, link_mode, extracted_relations, ontology_graph, linked_ids):
+    """Get the set of candidate ids linked to the candidate with given id and url according to link_mode.
 
-def write_candidates(entity_list, candidates_filename, entity_type, ontology_graph, link_mode, extracted_relations):
+    In 'kb_link' and 'kb_corpus_link' a candidate is linked to the candidates with the same id (the
+    relation strings 'url1_url2' tested against the edges of the ontology graph never match an edge).
+    In 'corpus_link' and 'kb_corpus_link' a candidate is also linked to the ids related in extracted_relations.
+
+    Requires:
+        candidate_id: is int, the dense id of url in ontology_graph
+        extracted_relations: is RelationStore object or dict, get(url) is the set with the ids of related entities
+        ontology_graph: is SnapshotGraph object, the interning table of the KB
+        linked_ids: is dict (id: set of linked ids) used to memoize the result across documents
+    """
+
+    if candidate_id not in linked_ids:
+        ids = set()
+
+        if link_mode != "corpus_link":
+            ids.add(candidate_id)
+
+        if link_mode == "corpus_link" or link_mode == "kb_corpus_link":
+            ids.update(related_kb_ids(extracted_relations, url, ontology_graph))
+
+        linked_ids[candidate_id] = ids
+
+    return linked_ids[candidate_id]
+
+
+
+def build_candidate_links(entity_list, ontology_graph, link_mode, extracted_relations, linked_ids=None):
+    """Add the links between the candidates of the entities in one corpus document.
+    
+    Requires: 
+        entity_list: is dict of entities in doc, values are the candidates of each entity 
+        ontology_graph: is SnapshotGraph object representing the specified ontology
+        link_mode: is str specifying how the edges in disambiguation graph are built ('kb_link', 'corpus_link', 'kb_corpus_link')
+        extracted_relations: is RelationStore object or dict, get(url) is the set with the ids of related entities 
+        linked_ids: is dict used to memoize the ids linked to each id across documents (see linked_ids_of)
+    
+    Ensures: 
+        each candidate in entity_list has the key "links", a list with the ids of the linked candidates
+            in document order
+    """
+    
+    if linked_ids == None:
+        linked_ids = dict()
+
+    # Index of the candidates of the document by id: (position in document, entity)
+    document_candidates = dict()
+    position = 0
+
+    for e in entity_list:
+
+        for c in entity_list[e][1:]:
+            document_candidates.setdefault(c["id"], []).append((position, e))
+            position += 1
+
+    candidates_links = dict() # (id: links)
+    
+    for e in entity_list:
+        
+        for c in entity_list[e][1:]: # iterate over the candidates for current entity
+            
+            if c["id"] in candidates_links:
+                c["links"] = candidates_links[c["id"]]
+    
+            else: 
+                ids = linked_ids_of(c["id"], c["url"], link_mode, extracted_relations, ontology_graph, linked_ids)
+                links = []
+                
+                for id in ids & document_candidates.keys():
+                    links.extend((position, id) for position, e2 in document_candidates[id] if e2 != e)
+                
+                links.sort()
+                c["links"] = list(dict.fromkeys(id for position, id in links))
+                candidates_links[c["id"]] = c["links"]
+
+
+
+def write_candidates(entity_list, candidates_filename, entity_type, ontology_graph, link_mode, extracted_relations, linked_ids=None):
     """Write the entities and respective candidates of one corpus document to a distinct file.
     
     Requires: 
         entity_list: is dict of entities in doc, values are the candidates of each entity 
         candidates_filename: is str with the output file name 
         entity_type: is str, either "Chemical" or "Diseases
-        ontology_graph: is a MultiDiGraph object from Networkx representing the specified ontology
+        ontology_graph: is SnapshotGraph object representing the specified ontology
         link_mode: is str specifying how the edges in disambiguation graph are built ('kb_link', 'corpus_link', 'kb_corpus_link')
-        extracted_relations: is dict, keys are entities ids and values are the ids of related entities 
+        extracted_relations: is RelationStore object or dict, get(url) is the set with the ids of related entities 
+        linked_ids: is dict used to memoize the ids linked to each id across documents
     
     Ensures: 
         entities_used: (int) number of entities with at least one candidate and that were included in the candidates file
     """
     
-    entities_used = int() # entitites with at least one candidate
-    candidates_links = dict() # (url: links)
+    build_candidate_links(entity_list, ontology_graph, link_mode, extracted_relations, linked_ids=linked_ids)
+    lines, entities_used = format_candidates(entity_list, entity_type)
     candidates_file = open(candidates_filename, 'w')
+    candidates_file.write("".join(lines))
+    candidates_file.close()
+    
+    return entities_used
+
+
+
+def format_candidates(entity_list, entity_type):
+    """Lines of the candidates file of one corpus document (the candidates must be already linked).
+    
+    Requires: 
+        entity_list: is dict of entities in doc, values are the candidates of each entity 
+        entity_type: is str, either "Chemical" or "Diseases
+    
+    Ensures: 
+        lines: is list of str, each ending with a newline
+        entities_used: (int) number of entities with at least one candidate
+    """
+    
+    lines, entities_used = [], int() # entitites with at least one candidate
     
     for e in entity_list:
     
         if len(entity_list[e]) > 0:
             entity_str = entity_list[e][0]
-            candidates_file.write(entity_str)
+
+            # A tab or a line break in a field would shift the lines read by ppr_for_ned_all and ppr_worker
+            if entity_str.count("\n") != 1 or entity_str.count("\r") > 0 or len(entity_str.split("\t")) != entity_fields:
+                raise ValueError("Invalid entity string (tab or line break in a field): {!r}".format(entity_str))
+
+            lines.append(entity_str)
             entities_used += 1
         
         for ic, c in enumerate(entity_list[e][1:]): # iterate over the candidates for current entity
-            
-            if c["url"] in candidates_links:
-                c["links"] = candidates_links[c["url"]]
+            lines.append(candidate_string.format(c["id"], c["incount"],
+                                                 c["outcount"], ";".join(map(str, c["links"])),
+                                                 field_text(c["url"]), field_text(c["name"]), field_text(c["name"].lower()), 
+                                                 field_text(c["name"].lower()), entity_type))
     
-            else: 
-                links, other_candidates = [], []
-                    
-                for e2 in entity_list: # Iterate over candidates for every other entity except current one
-                    
-                    if e2 != e:
-                        
-                        for ic2, c2 in enumerate(entity_list[e2][1:]):
-                            other_candidates.append((c2["url"], c2["id"]))
-    
-                for c2 in other_candidates: # calculate distance between two candidates according to link_mode
-                    c1 = c["url"]
-                    relation_string_1 = c1 + "_" + c2[0]
-                    relation_string_2 = c2[0] + "_" + c1
-                    
-                    if link_mode == "corpus_link":
-                       
-                        if c1 in extracted_relations.keys():
-                            relations_with_c1 = extracted_relations[c1]
-                            
-                            if c2[0] in relations_with_c1: # There is an extracted relation between the two candidates
-                                links.append(str(c2[1]))
-
-                    else:
-
-                        if c1 == c2[0] or relation_string_1 in ontology_graph.edges() or relation_string_2 in ontology_graph.edges(): 
-                            candidates_linked = True
-                        
-                        else:
-                            candidates_linked = False
-                            
-                        if candidates_linked: # The two candidates are linked in the ontology
-                            links.append(str(c2[1]))
-                            
-                        else:
-                            
-                            if link_mode == "kb_link": # There is no relation between the candidates
-                                continue
-                            
-                            elif link_mode == "kb_corpus_link": # Maybe there is an extracted relation between the candidates
-                                
-                                if c1 in extracted_relations.keys():
-                                    relations_with_c1 = extracted_relations[c1]
-                            
-                                    if c2[0] in relations_with_c1: # There is an extracted relation between the two candidates
-                                        links.append(str(c2[1]))
-
-                c["links"] = ";".join(set(links))
-                candidates_links[c["url"]] = c["links"][:]
-
-            candidates_file.write(candidate_string.format(c["id"], c["incount"],
-                                                          c["outcount"], c["links"],
-                                                          c["url"], c["name"], c["name"].lower(), c["name"].lower(), entity_type))
-    
-    candidates_file.close()
-    
-    return entities_used
+    return lines, entities_used
 
 
 
@@ -118,6 +170,55 @@ def update_entity_list(entity_list, solution_found, normalized_text, solution_la
 
 
 
+def prefetch_candidates(entity_texts, ontology_name, name_to_id, synonym_to_id, retrieval="cdist", min_match_score=0.5):
+    """Retrieve in batch the ontology matches of the entity texts that are not yet in the cache of 
+    the ontology and do not match exactly a KB string, so that generate_candidates_for_entity 
+    finds them in the cache.
+    
+    Requires: 
+        entity_texts: is list with the entity texts in the order they appear in corpus
+        ontology_name: is str specifying the target ontology ('chebi', 'medic' or 'ctd_chem')
+        name_to_id:  is dict with mappings between each ontology concept name and the respective ontology id
+        synonym_to_id: is dict with mappings between each synonym for a given ontology concept and the respective ontology id
+        retrieval: is str, 'cdist' (compare all entity texts with all names and synonyms in all CPU cores), 
+            'none' (no batch retrieval, each entity text is compared with all names and synonyms one at a time)
+            or 'ngram' (approximate: compare each entity text only with the names and synonyms shortlisted 
+            by the n-gram index, the top 10 may differ from the other modes)
+        min_match_score: is float, in 'cdist' retrieval matches with lower score are discarded
+    """
+
+    # The matches cached by each retrieval mode are kept apart
+    set_retrieval(retrieval)
+
+    if retrieval == "none":
+        return
+
+    if ontology_name == "chebi":
+        map_function, cache = map_to_chebi, chebi_cache
+    
+    elif ontology_name == "medic":
+        map_function, cache = map_to_medic, medic_cache
+    
+    elif ontology_name == "ctd_chem":
+        map_function, cache = map_to_ctd_chemicals, ctd_chem_cache
+
+    else:
+        raise Exception("Invalid target ontology, valid inputs: 'chebi', 'medic' or 'ctd_chem'")
+
+    entity_texts = [entity_text for entity_text in dict.fromkeys(entity_texts) 
+        if find_exact_match(entity_text, ontology_name) == None and entity_text not in cache]
+    matches = batch_matches(ontology_name, entity_texts, name_to_id, synonym_to_id, 
+        retrieval=retrieval, score_cutoff=min_match_score * 100)
+
+    # Entities are added to the cache in corpus order, as in the sequential retrieval
+    for entity_text in entity_texts:
+        
+        if entity_text in matches:
+            name_matches, synonym_matches = matches[entity_text]
+            map_function(entity_text, name_to_id, synonym_to_id, name_matches=name_matches, synonym_matches=synonym_matches)
+
+
+
 def generate_candidates_for_entity(entity_text, entity_id, ontology_name, name_to_id, synonym_to_id, min_match_score, ontology_graph, dataset=None):
     """Get the structured candidates list for given entity.
     
@@ -129,7 +230,7 @@ def generate_candidates_for_entity(entity_text, entity_id, ontology_name, name_t
         synonym_to_id: is dict with mappings between each synonym for a given ontology concept and the respective ontology id
         min_match_score: is float that represents lexical similarity or edit distance between entity_text and candidate string,
                 candidates below this threshold are excluded from candidates list
-        ontology_graph: is a MultiDiGraph object from Networkx representing the specified ontology
+        ontology_graph: is SnapshotGraph object representing the specified ontology
     
     Ensures: 
         structured_candidates: is list containing all valid candidates for given entity and the respective properties (each 
@@ -166,26 +267,7 @@ def generate_candidates_for_entity(entity_text, entity_id, ontology_name, name_t
         if candidate_match["match_score"] > min_match_score and candidate_match["ontology_id"] != "NIL":
             outcount = ontology_graph.out_degree(candidate_match["ontology_id"])
             incount = ontology_graph.in_degree(candidate_match["ontology_id"])
-            candidate_id = str()
-            
-            if ontology_name == "medic" or ontology_name == "ctd_chem":
-                candidate_id = candidate_match["ontology_id"]
-                
-                if len(candidate_id)>1:
-
-                    if candidate_id[:1] == "D" or candidate_id[:1] == "C":
-                        candidate_id = int(candidate_id[1:])
-
-                    else:
-                        candidate_id = int(candidate_id)
-                
-                elif len(candidate_id) == 1:
-
-                    if candidate_id == "D":
-                        candidate_id = "0000"
-
-            elif ontology_name == "chebi":
-                candidate_id = int(candidate_match["ontology_id"].split("_")[1])
+            candidate_id = ontology_graph.index(candidate_match["ontology_id"]) # dense id interned by the KB
             
             # The first candidate in candidate_names should be the correct solution
             structured_candidates.append({"url": candidate_match["ontology_id"], "name": candidate_match["name"],
@@ -1,53 +1,63 @@
-import atexit
 import logging
-import obonet
 import os
-import networkx as nx
-import pickle
 import sys
 import xml.etree.ElementTree as ET
 
-from rapidfuzz import fuzz, process
+from rapidfuzz import fuzz, process, utils
 
 sys.path.append("./")
 
+from src.cache import CandidateCache
+from src.normalization import find_exact_match, normalized_indexes
+from src.snapshot import KBResource, compile_snapshot, open_snapshot
 
 
-# Import ChEBI cache storing the candidates list for each entity mention in corpus or create it if it does not exist
 
-chebi_cache_file = "temp/chebi_cache.pickle"
+# ChEBI cache storing the candidates list for each entity mention in corpus, the entries 
+# of the previous pickled cache are imported when the cache is created
 
-if os.path.isfile(chebi_cache_file):
-    logging.info("loading ChEBI dictionary...")
-    chebi_cache = pickle.load(open(chebi_cache_file, "rb"))
-    loadedchebi = True
-    logging.info("loaded ChEBI dictionary with %s entries", str(len(chebi_cache)))
-  
-else:
-    chebi_cache = {}
-    loadedchebi = False
-    logging.info("new ChEBI dictionary")
+chebi_cache_file = "temp/chebi_cache.sqlite"
+chebi_cache = CandidateCache(chebi_cache_file, legacy_filename="temp/chebi_cache.pickle")
+
+
+
+def load_chebi():
+    """Load ChEBI from the compiled snapshot in 'temp/' or, if the snapshot does not exist or
+    'chebi.obo' changed, build it from 'chebi.obo' and compile a new snapshot.
+    The components of the KB are only materialized when first used.
+    
+    Ensures: 
+        kb: is KBResource object, it unpacks as (ontology_graph, name_to_id, synonym_to_id): 
+            ontology_graph is a SnapshotGraph object representing ChEBI, name_to_id and synonym_to_id 
+            map each ontology concept name (or synonym) to the respective id
+    """
 
+    snapshot = open_snapshot("chebi", "chebi.obo")
 
-def exit_handler():
-    print('Saving ChEBI dictionary...!')
-    pickle.dump(chebi_cache, open(chebi_cache_file, "wb"))
+    if snapshot == None:
+        edge_list, name_to_id, synonym_to_id = build_chebi()
+        snapshot = compile_snapshot("chebi", "chebi.obo", edge_list, name_to_id, synonym_to_id)
 
-atexit.register(exit_handler)
+    kb = KBResource("chebi", snapshot)
+    normalized_indexes["chebi"] = kb # the index is loaded on the first exact match
 
+    return kb
 
 
-def load_chebi():
+
+def build_chebi():
     """Load ChEBI ontology from local file 'chebi.obo' or from online source.
     
     Ensures: 
-        ontology_graph: is a MultiDiGraph object from Networkx representing ChEBI ontology;
+        edge_list: is list of tuples (ChEBI id, parent ChEBI id) with the "is-a" relations of ChEBI ontology;
         name_to_id: is dict with mappings between each ontology concept name and the respective ChEBI id;
         synonym_to_id: is dict with mappings between each ontology concept name and the respective ChEBI id;
     """
     
     print("Loading ChEBI ontology...")
     
+    import obonet # only needed to compile the snapshot, it is slow to import
+
     graph = obonet.read_obo("chebi.obo") # Load the ontology from local file 
 
     # Add root concept to the graph
@@ -75,64 +85,69 @@ def load_chebi():
                 synonym_name = synonym.split("\"")[1]
                 synonym_to_id[synonym_name] = node_id.replace(':', '_')
   
-    # Create a MultiDiGraph object with only "is-a" relations - this will allow the further calculation of shorthest path lenght
-    ontology_graph = nx.MultiDiGraph([edge for edge in edge_list])
-    
     # Add edges between the ontology root and sub-ontology roots
     chemical_entity = "CHEBI_24431"
     role = "CHEBI_50906"
     subatomic_particle = "CHEBI_36342"
     application = "CHEBI_33232"
-    ontology_graph.add_node(root_concept, name="ROOT")
-    ontology_graph.add_edge(chemical_entity, root_concept, edgetype='is_a')
-    ontology_graph.add_edge(role, root_concept, edgetype='is_a')
-    ontology_graph.add_edge(subatomic_particle, root_concept, edgetype='is_a')
-    ontology_graph.add_edge(application, root_concept, edgetype='is_a')
+    edge_list.append((chemical_entity, root_concept))
+    edge_list.append((role, root_concept))
+    edge_list.append((subatomic_particle, root_concept))
+    edge_list.append((application, root_concept))
 
-    #print("Is ontology_graph acyclic:", nx.is_directed_acyclic_graph(ontology_graph))
     print("ChEBI loading complete")
     
-    return ontology_graph, name_to_id, synonym_to_id
+    return edge_list, name_to_id, synonym_to_id
 
 
 
-def map_to_chebi(entity_text, name_to_id, synonym_to_id):
+def map_to_chebi(entity_text, name_to_id, synonym_to_id, name_matches=None, synonym_matches=None):
     """Get best ChEBI matches for entity text according to lexical similarity (edit distance).
     
     Requires: 
         entity_text: is (str) the surface form of given entity 
         name_to_id:  is dict with mappings between each ontology concept name and the respective ontology id
         synonym_to_id: is dict with mappings between each synonym for a given ontology concept and the respective ontology id
+        name_matches, synonym_matches: are lists with the best names and synonyms for entity_text already 
+            retrieved in batch (outputted by batch_matches), if None they are retrieved here
 
     Ensures: 
         matches: is list; each match is dict with the respective properties
     """
     
-    global chebi_cache
-    
-    if entity_text in name_to_id or entity_text in synonym_to_id: # There is an exact match for this entity
-        drugs = [entity_text]
-    
-    if entity_text.endswith("s") and entity_text[:-1] in chebi_cache: # Removal of suffix -s 
-        drugs = chebi_cache[entity_text[:-1]]
+    exact_match = find_exact_match(entity_text, "chebi")
+
+    cached_matches = None
+
+    if exact_match == None and entity_text.endswith("s"): # Removal of suffix -s 
+        cached_matches = chebi_cache.get(entity_text[:-1])
+
+    if exact_match == None and cached_matches == None: # There may be a candidate list stored in cache file
+        cached_matches = chebi_cache.get(entity_text)
+
+    if exact_match != None: # There is an exact match for the normalized form of this entity
+        drugs = [exact_match]
     
-    elif entity_text in chebi_cache: # There is already a candidate list stored in cache file
-        drugs = chebi_cache[entity_text]
+    elif cached_matches != None:
+        drugs = cached_matches
 
     else:
         # Get first ten MeSH candidates according to lexical similarity with entity_text
-        drugs = process.extract(entity_text, name_to_id.keys(), scorer=fuzz.token_sort_ratio, limit=10)
+        drugs = name_matches if name_matches != None else process.extract(entity_text, name_to_id.keys(), scorer=fuzz.token_sort_ratio, limit=10, processor=utils.default_process)
         
-        if drugs[0][1] == 100: # There is an exact match for this entity
+        # Entities without matches above the minimum score in batch retrieval have no names
+        best_score = drugs[0][1] if len(drugs) > 0 else 0
+
+        if best_score == 100: # There is an exact match for this entity
             drugs = [drugs[0]]
     
-        if drugs[0][1] < 70: # Check for synonyms to this entity
-            drug_syns = process.extract(entity_text, synonym_to_id.keys(), limit=10, scorer=fuzz.token_sort_ratio)
+        if best_score < 70: # Check for synonyms to this entity
+            drug_syns = synonym_matches if synonym_matches != None else process.extract(entity_text, synonym_to_id.keys(), limit=10, scorer=fuzz.token_sort_ratio, processor=utils.default_process)
 
             #print("best synonyms of ", entity_text, ":", drug_syns)
             for drug_syn in drug_syns:
                 
-                if drug_syn[1] > drugs[0][1]:
+                if drug_syn[1] > best_score:
                     drugs.append(drug_syn)
         
         chebi_cache[entity_text] = drugs
@@ -1,45 +1,54 @@
-import atexit
 import csv
 import logging
 import os
-import networkx as nx
-import pickle
 import sys
 
-from rapidfuzz import fuzz, process
+from rapidfuzz import fuzz, process, utils
 
 sys.path.append("./")
 
+from src.cache import CandidateCache
+from src.normalization import find_exact_match, normalized_indexes
+from src.snapshot import KBResource, compile_snapshot, open_snapshot
 
-# Import CTD-Chemicals vocabulary cache storing the candidates list for each entity mention in corpus or create it if it does not exist
 
-ctd_chem_cache_file = "temp/ctd_chemicals_cache.pickle"
+# CTD-Chemicals cache storing the candidates list for each entity mention in corpus, the entries 
+# of the previous pickled cache are imported when the cache is created
 
-if os.path.isfile(ctd_chem_cache_file):
-    logging.info("loading Chemical vocabulary dictionary...")
-    ctd_chem_cache = pickle.load(open(ctd_chem_cache_file, "rb"))
-    loaded_ctdchem = True
-    logging.info("loaded Chemical dictionary with %s entries", str(len(ctd_chem_cache)))
+ctd_chem_cache_file = "temp/ctd_chemicals_cache.sqlite"
+ctd_chem_cache = CandidateCache(ctd_chem_cache_file, legacy_filename="temp/ctd_chemicals_cache.pickle")
 
-else:
-    ctd_chem_cache = {}
-    loaded_ctd_chem = False
-    logging.info("new Chemical vocabulary dictionary")
 
 
-def exit_handler():
-    print('Saving Chemical vocabulary dictionary...!')
-    pickle.dump(ctd_chem_cache, open(ctd_chem_cache_file, "wb"))
+def load_ctd_chemicals():
+    """Load CTD Chemicals from the compiled snapshot in 'temp/' or, if the snapshot does not exist or
+    'CTD_chemicals.tsv' changed, build it from 'CTD_chemicals.tsv' and compile a new snapshot.
+    The components of the KB are only materialized when first used.
+    
+    Ensures: 
+        kb: is KBResource object, it unpacks as (ontology_graph, name_to_id, synonym_to_id): 
+            ontology_graph is a SnapshotGraph object representing CTD Chemicals, name_to_id and synonym_to_id 
+            map each ontology concept name (or synonym) to the respective id
+    """
 
-atexit.register(exit_handler)
+    snapshot = open_snapshot("ctd_chem", "CTD_chemicals.tsv")
 
+    if snapshot == None:
+        edge_list, name_to_id, synonym_to_id = build_ctd_chemicals()
+        snapshot = compile_snapshot("ctd_chem", "CTD_chemicals.tsv", edge_list, name_to_id, synonym_to_id)
 
+    kb = KBResource("ctd_chem", snapshot)
+    normalized_indexes["ctd_chem"] = kb # the index is loaded on the first exact match
 
-def load_ctd_chemicals():
+    return kb
+
+
+
+def build_ctd_chemicals():
     """Load CTD_chemicals vocabulary from local 'CTD_chemicals.tsv' file
     
     Ensures: 
-        ontology_graph: is a MultiDiGraph object from Networkx representing the CTD Chemicals vocabulary;
+        edge_list: is list of tuples (MESH id, parent MESH id) with the "is-a" relations of the CTD Chemicals vocabulary;
         name_to_id: is dict with mappings between each ontology concept name and the respective MESH unique id;
         synonym_to_id: is dict with mappings between each ontology concept name and the respective MESH unique id;
     """
@@ -69,55 +78,63 @@ def load_ctd_chemicals():
                 for synonym in synonyms:
                     synonym_to_id[synonym] = chemical_id
 
-    # Create a MultiDiGraph object with only "is-a" relations - this will allow the further calculation of shorthest path lenght
-    ontology_graph = nx.MultiDiGraph([edge for edge in edge_list])
-    #print("Is ontology_graph acyclic:", nx.is_directed_acyclic_graph(ontology_graph))
     print("Loading complete")
     
-    return ontology_graph, name_to_id, synonym_to_id
+    return edge_list, name_to_id, synonym_to_id
 
 
 
-def map_to_ctd_chemicals(entity_text, name_to_id, synonym_to_id):
+def map_to_ctd_chemicals(entity_text, name_to_id, synonym_to_id, name_matches=None, synonym_matches=None):
     """Get best ctd_chemicals matches for entity text according to lexical similarity (edit distance).
     
     Requires: 
         entity_text: is (str) the surface form of given entity
         name_to_id:  is dict with mappings between each ontology concept name and the respective ontology id
         synonym_to_id: is dict with mappings between each synonym for a given ontology concept and the respective ontology id
+        name_matches, synonym_matches: are lists with the best names and synonyms for entity_text already 
+            retrieved in batch (outputted by batch_matches), if None they are retrieved here
 
     Ensures: 
         matches: is list; each match is dict with the respective properties
     """
     
-    global ctd_chem_cache
-    
-    if entity_text in name_to_id or entity_text in synonym_to_id: # There is an exact match for this entity
-        drugs = [entity_text]
-    
-    if entity_text.endswith("s") and entity_text[:-1] in ctd_chem_cache: # Removal of suffix -s 
-        drugs = ctd_chem_cache[entity_text[:-1]]
+    exact_match = find_exact_match(entity_text, "ctd_chem")
+
+    cached_matches = None
+
+    if exact_match == None and entity_text.endswith("s"): # Removal of suffix -s 
+        cached_matches = ctd_chem_cache.get(entity_text[:-1])
+
+    if exact_match == None and cached_matches == None: # There may be a candidate list stored in cache file
+        cached_matches = ctd_chem_cache.get(entity_text)
+
+    if exact_match != None: # There is an exact match for the normalized form of this entity
+        drugs = [exact_match]
     
-    elif entity_text in ctd_chem_cache: # There is already a candidate list stored in cache file
-        drugs = ctd_chem_cache[entity_text]
+    elif cached_matches != None:
+        drugs = cached_matches
 
     else:
         # Get first ten candidates according to lexical similarity with entity_text
-        drugs = process.extract(entity_text, name_to_id.keys(), scorer=fuzz.token_sort_ratio, limit=10)
+        drugs = name_matches if name_matches != None else process.extract(entity_text, name_to_id.keys(), scorer=fuzz.token_sort_ratio, limit=10, processor=utils.default_process)
         
-        if drugs[0][1] == 100: # There is an exact match for this entity
+        # Entities without matches above the minimum score in batch retrieval have no names
+        best_score = drugs[0][1] if len(drugs) > 0 else 0
+
+        if best_score == 100: # There is an exact match for this entity
             drugs = [drugs[0]]
     
-        elif drugs[0][1] < 100: # Check for synonyms to this entity
-            drug_syns = process.extract(entity_text, synonym_to_id.keys(), limit=10, scorer=fuzz.token_sort_ratio)
+        elif best_score < 100: # Check for synonyms to this entity
+            drug_syns = synonym_matches if synonym_matches != None else process.extract(entity_text, synonym_to_id.keys(), limit=10, scorer=fuzz.token_sort_ratio, processor=utils.default_process)
 
             for synonym in drug_syns:
 
                 if synonym[1] == 100:
                     drugs = [synonym]
+                    best_score = 100
                 
                 else:
-                    if synonym[1] > drugs[0][1]:
+                    if synonym[1] > best_score:
                         drugs.append(synonym)
         
         ctd_chem_cache[entity_text] = drugs
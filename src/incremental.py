@@ -0,0 +1,140 @@
+import hashlib
+import orjson as json
+import os
+import sys
+
+sys.path.append("./")
+
+from src.snapshot import snapshot_version
+
+
+# Manifest of the incremental runs: for each document of the corpus, the hash of its
+# annotations and the version of everything the candidates and answers depend on
+# (KB snapshot, extracted relations, retrieval, model and PPR engine), with the answers
+manifest_format = 1
+
+
+def manifest_filename(run_label, link_mode):
+
+    return "candidates/{}/{}_manifest.json".format(run_label, link_mode)
+
+
+
+def document_hash(document_annotations):
+    """SHA-256 hex digest of the annotations of a document."""
+
+    return hashlib.sha256(json.dumps(document_annotations)).hexdigest()
+
+
+
+def run_version(ontology_graph, extracted_relations, retrieval, model, ppr_engine):
+    """Identifier of the KB snapshot, the relation store and the settings the outputs
+    of a run are generated with, so that the outputs of a document are only reused if
+    all of them are the same.
+    """
+
+    version = [str(snapshot_version), ontology_graph.snapshot.meta["source_hash"], retrieval, model, ppr_engine]
+
+    if hasattr(extracted_relations, "meta"): # 'corpus_link' and 'kb_corpus_link'
+        version.append(extracted_relations.meta["source_hash"])
+
+    return ":".join(version)
+
+
+
+def load_manifest(run_label, link_mode):
+    """
+    Ensures:
+        manifest: is dict, each key is a document id and values are dicts with the keys
+            "hash", "version" and "answers" (None until the document is disambiguated)
+    """
+
+    filename = manifest_filename(run_label, link_mode)
+
+    if not os.path.isfile(filename):
+        return dict()
+
+    with open(filename, "rb") as manifest_file:
+        manifest = json.loads(manifest_file.read())
+        manifest_file.close()
+
+    if manifest.get("format") != manifest_format:
+        return dict()
+
+    return manifest["documents"]
+
+
+
+def write_manifest(run_label, link_mode, manifest):
+
+    filename = manifest_filename(run_label, link_mode)
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+
+    with open(tmp_filename, "wb") as manifest_file:
+        manifest_file.write(json.dumps({"format": manifest_format, "documents": manifest}))
+        manifest_file.close()
+
+    os.replace(tmp_filename, filename)
+
+
+
+def update_manifest(manifest, annotations, version, candidates_dir=None):
+    """Find the documents of the corpus that are new or changed since the last run and
+    update the manifest: the entries of these documents are replaced (without answers)
+    and the entries of the documents no longer in the corpus are removed.
+
+    Requires:
+        manifest: is dict outputted by load_manifest
+        annotations: is dict, each key is a document id, values are the annotations of the document
+        version: is str outputted by run_version
+        candidates_dir: is str, directory of the candidates files (a document without a
+            candidates file is regenerated), None if the candidates files are not written
+
+    Ensures:
+        manifest: is dict with the entries of the documents of the corpus, in corpus order
+        stale_documents: is list with the documents to process, in corpus order
+        removed_documents: is list with the documents removed from the manifest
+    """
+
+    updated_manifest, stale_documents = dict(), []
+
+    for document in annotations:
+        entry = manifest.get(document)
+        doc_hash = document_hash(annotations[document])
+
+        if entry == None or entry["hash"] != doc_hash or entry["version"] != version or entry["answers"] == None \
+                or (candidates_dir != None and not os.path.isfile(candidates_dir + document)):
+            entry = {"hash": doc_hash, "version": version, "answers": None}
+            stale_documents.append(document)
+
+        updated_manifest[document] = entry
+
+    removed_documents = [document for document in manifest if document not in annotations]
+
+    return updated_manifest, stale_documents, removed_documents
+
+
+
+def merge_answers(run_label, link_mode, documents, answers):
+    """Store the answers of the documents processed in this run in the manifest and
+    combine them with the answers of the unchanged documents.
+
+    Requires:
+        documents: is list with the documents processed in this run
+        answers: is dict outputted by disambiguate_documents or parse_results_file (the 
+            documents without answers have no entities with candidates)
+
+    Ensures:
+        all_answers: is dict with the answers of every document in the manifest, in corpus order
+    """
+
+    manifest = load_manifest(run_label, link_mode)
+
+    for document in documents:
+
+        if document in manifest:
+            manifest[document]["answers"] = answers.get(document, [])
+
+    write_manifest(run_label, link_mode, manifest)
+
+    return {document: [tuple(answer) for answer in manifest[document]["answers"] or []] for document in manifest}
@@ -1,7 +1,7 @@
 import os
-import networkx as nx
 import xml.etree.ElementTree as ET
 from math import log
+from src.candidate_store import CandidateStore
 
 
 
@@ -37,65 +37,55 @@ def build_extrinsic_information_content_dict(annotations):
     return extrinsic_ic
 
 
-def generate_ic_file(target_ontology, link_mode, annotations):
-    """Generate file with information content of all entities referred in candidates file."""
+def build_ic_table(documents_entity_list, ic_dict):
+    """Information content of every entity and candidate url in the candidates of the corpus.
+
+    Requires:
+        documents_entity_list: is dict, for each document in corpus there is a dict (entity_dict) with 
+            each entity mention (entity string followed by the candidates), or CandidateStore object
+        ic_dict: is dict outputted by build_extrinsic_information_content_dict
+
+    Ensures:
+        ic_table: is dict, keys are the urls (with ':' replaced by '_') in the order they first appear
+            and values are the respective information content (1.0 if the url is not in ic_dict)
+    """
+
+    if isinstance(documents_entity_list, CandidateStore): # The urls are read from the integer columns
+        return {url.replace(':', '_'): ic_dict.get(url, 1.0) for url in documents_entity_list.urls()}
+
+    ic_table, urls_seen = dict(), set()
+
+    for document in documents_entity_list:
+        entity_list = documents_entity_list[document]
+
+        for e in entity_list:
+            entity_url = entity_list[e][0].strip("\n").split("\t")[8].split("url:")[1]
+            urls = [entity_url] + [c["url"] for c in entity_list[e][1:]]
+
+            for url in urls:
+
+                if url != "" and url not in urls_seen:
+                    urls_seen.add(url)
+                    ic_table[url.replace(':', '_')] = ic_dict.get(url, 1.0)
+
+    return ic_table
+
+
+
+def generate_ic_file(target_ontology, documents_entity_list, ic_dict):
+    """Generate file with information content of all entities referred in candidates file.
+
+    Ensures:
+        ic_table: is dict outputted by build_ic_table
+    """
+
+    ic_table = build_ic_table(documents_entity_list, ic_dict)
 
-    ontology_pop_string = str()
-    
-    candidates_dir = "candidates/{}/{}/".format(target_ontology, link_mode)
-    
-    ic_dict = build_extrinsic_information_content_dict(annotations) 
-    
-    url_temp = list()
-
-    for file in os.listdir(candidates_dir): 
-        data = ''
-        path = candidates_dir + file
-        candidate_file = open(path, 'r', errors="ignore")
-        data = candidate_file.read()
-        candidate_file.close()
-        
-        for line in data.split('\n'):
-            url, surface_form = str(), str()
-            
-            if line[0:6] == "ENTITY":
-                surface_form = line.split('\t')[1].split('text:')[1]
-                url = line.split('\t')[8].split('url:')[1]
-                #predicted_type = line.split('\t')[3][14:]
-            
-            elif line[0:9] == "CANDIDATE":
-                surface_form = line.split('\t')[6].split('name:')[1]
-                url = line.split('\t')[5].split('url:')[1]
-                #predicted_type = line.split('\t')[9][14:]     
-          
-                
-            if url in url_temp:
-                continue
-                
-            else:
-                    
-                if url != "":   
-                    url_temp.append(url)
-
-                    if url in ic_dict.keys():
-                        ic = ic_dict[url]                        
-                                
-                    else:
-                        ic = 1.0
-                        
-                    #if target_ontology == "craft_chebi":
-                    #    print(url)
-                    #    url = url.split("_")[1]
-                        #ontology_pop_string += "url:http:" + url +'\t' + str(ic) + '\n'
-                        
-                    #else:
-                    ontology_pop_string += url.replace(':', '_') +'\t' + str(ic) + '\n'
-                        
     # Create file ontology_pop with information content for all entities in candidates file
     output_file_name = target_ontology + "_ic"
     
     with open(output_file_name, 'w') as ontology_pop:
-        ontology_pop.write(ontology_pop_string)
+        ontology_pop.write("".join("{}\t{}\n".format(url, str(ic)) for url, ic in ic_table.items()))
         ontology_pop.close()
 
-
+    return ic_table
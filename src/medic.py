@@ -1,53 +1,63 @@
-import atexit
 import logging
-import obonet
 import os
-import networkx as nx
-import pickle
 import sys
 import xml.etree.ElementTree as ET
 
-from rapidfuzz import fuzz, process
+from rapidfuzz import fuzz, process, utils
 
 sys.path.append("./")
 
+from src.cache import CandidateCache
+from src.normalization import find_exact_match, normalized_indexes
+from src.snapshot import KBResource, compile_snapshot, open_snapshot
 
 
-# Import MEDIC cache storing the candidates list for each entity mention in corpus or create it if it does not exist
 
-medic_cache_file = "temp/ctd_diseases_cache.pickle"
+# MEDIC cache storing the candidates list for each entity mention in corpus, the entries 
+# of the previous pickled cache are imported when the cache is created
 
-if os.path.isfile(medic_cache_file):
-    logging.info("loading MEDIC dictionary...")
-    medic_cache = pickle.load(open(medic_cache_file, "rb"))
-    loadedmedic = True
-    logging.info("loaded MEDIC dictionary with %s entries", str(len(medic_cache)))
+medic_cache_file = "temp/ctd_diseases_cache.sqlite"
+medic_cache = CandidateCache(medic_cache_file, legacy_filename="temp/ctd_diseases_cache.pickle")
 
-else:
-    medic_cache = {}
-    loadedmedic = False
-    logging.info("new MEDIC dictionary")
 
 
-def exit_handler():
-    print('Saving MEDIC dictionary...!')
-    pickle.dump(medic_cache, open(medic_cache_file, "wb"))
+def load_medic():
+    """Load MEDIC from the compiled snapshot in 'temp/' or, if the snapshot does not exist or
+    'CTD_diseases.obo' changed, build it from 'CTD_diseases.obo' and compile a new snapshot.
+    The components of the KB are only materialized when first used.
+    
+    Ensures: 
+        kb: is KBResource object, it unpacks as (ontology_graph, name_to_id, synonym_to_id): 
+            ontology_graph is a SnapshotGraph object representing MEDIC, name_to_id and synonym_to_id 
+            map each ontology concept name (or synonym) to the respective id
+    """
 
-atexit.register(exit_handler)
+    snapshot = open_snapshot("medic", "CTD_diseases.obo")
 
+    if snapshot == None:
+        edge_list, name_to_id, synonym_to_id = build_medic()
+        snapshot = compile_snapshot("medic", "CTD_diseases.obo", edge_list, name_to_id, synonym_to_id)
 
+    kb = KBResource("medic", snapshot)
+    normalized_indexes["medic"] = kb # the index is loaded on the first exact match
 
-def load_medic():
+    return kb
+
+
+
+def build_medic():
     """Load MEDIC vocabulary from local file 'CTD_diseases.obo'.
     
     Ensures: 
-        ontology_graph: is a MultiDiGraph object from Networkx representing the MEDIC vocabulary
+        edge_list: is list of tuples (MESH id, parent MESH id) with the "is-a" relations of the MEDIC vocabulary
         name_to_id: is dict with mappings between each ontology concept name and the respective MESH unique id
         synonym_to_id: is dict with mappings between each ontology concept name and the respective MESH unique id
     """
     
     print("Loading MEDIC ontology...")
 
+    import obonet # only needed to compile the snapshot, it is slow to import
+
     graph = obonet.read_obo("CTD_diseases.obo") # Load the ontology from local file 
     graph = graph.to_directed()
     
@@ -80,56 +90,63 @@ def load_medic():
                 synonym_to_id[synonym_name] = node_id
             
 
-    # Create a MultiDiGraph object with only "is-a" relations - this will allow the further calculation of shorthest path lenght
-    ontology_graph = nx.MultiDiGraph([edge for edge in edge_list])
-    
-    #print("Is ontology_graph acyclic:", nx.is_directed_acyclic_graph(ontology_graph))
     print("MEDIC loading complete")
 
-    return ontology_graph, name_to_id, synonym_to_id
+    return edge_list, name_to_id, synonym_to_id
 
 
 
-def map_to_medic(entity_text, name_to_id, synonym_to_id):
+def map_to_medic(entity_text, name_to_id, synonym_to_id, name_matches=None, synonym_matches=None):
     """Get best MEDIC matches for entity text according to lexical similarity (edit distance).
     
     Requires: 
         entity_text: is (str) the surface form of given entity 
         name_to_id:  is dict with mappings between each ontology concept name and the respective ontology id
         synonym_to_id: is dict with mappings between each synonym for a given ontology concept and the respective ontology id
+        name_matches, synonym_matches: are lists with the best names and synonyms for entity_text already 
+            retrieved in batch (outputted by batch_matches), if None they are retrieved here
 
     Ensures: 
         matches: is list; each match is dict with the respective properties
     """
     
-    global medic_cache
-    
-    if entity_text in name_to_id or entity_text in synonym_to_id: # There is an exact match for this entity
-        diseases = [entity_text]
-    
-    if entity_text.endswith("s") and entity_text[:-1] in medic_cache: # Removal of suffix -s 
-        diseases = medic_cache[entity_text[:-1]]
+    exact_match = find_exact_match(entity_text, "medic")
+
+    cached_matches = None
+
+    if exact_match == None and entity_text.endswith("s"): # Removal of suffix -s 
+        cached_matches = medic_cache.get(entity_text[:-1])
+
+    if exact_match == None and cached_matches == None: # There may be a candidate list stored in cache file
+        cached_matches = medic_cache.get(entity_text)
+
+    if exact_match != None: # There is an exact match for the normalized form of this entity
+        diseases = [exact_match]
     
-    elif entity_text in medic_cache: # There is already a candidate list stored in cache file
-        diseases = medic_cache[entity_text]
+    elif cached_matches != None:
+        diseases = cached_matches
 
     else:
         # Get first ten MeSH candidates according to lexical similarity with entity_text
-        diseases = process.extract(entity_text, name_to_id.keys(), scorer=fuzz.token_sort_ratio, limit=10)
+        diseases = name_matches if name_matches != None else process.extract(entity_text, name_to_id.keys(), scorer=fuzz.token_sort_ratio, limit=10, processor=utils.default_process)
         
-        if diseases[0][1] == 100: # There is an exact match for this entity
+        # Entities without matches above the minimum score in batch retrieval have no names
+        best_score = diseases[0][1] if len(diseases) > 0 else 0
+
+        if best_score == 100: # There is an exact match for this entity
             diseases = [diseases[0]]
     
-        elif diseases[0][1] < 100: # Check for synonyms to this entity
-            drug_syns = process.extract(entity_text, synonym_to_id.keys(), limit=10, scorer=fuzz.token_sort_ratio)
+        elif best_score < 100: # Check for synonyms to this entity
+            drug_syns = synonym_matches if synonym_matches != None else process.extract(entity_text, synonym_to_id.keys(), limit=10, scorer=fuzz.token_sort_ratio, processor=utils.default_process)
 
             for synonym in drug_syns:
 
                 if synonym[1] == 100:
                     diseases = [synonym]
+                    best_score = 100
                 
                 else:
-                    if synonym[1] > diseases[0][1]:
+                    if synonym[1] > best_score:
                         diseases.append(synonym)
         
         medic_cache[entity_text] = diseases
@@ -0,0 +1,201 @@
+import cProfile
+import heapq
+import orjson as json
+import os
+import pstats
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+sys.path.append("./")
+
+from src.cache import candidate_caches
+
+
+# Metrics of the current run, only recorded after enable() is called
+enabled = False
+profile_dir = None # directory with a cProfile dump for each stage
+slowest_size = 20 # number of slowest mentions kept in the report
+
+stages = dict()
+stage_profiles = dict() # pstats.Stats of each profiled stage, with all its runs
+counts = dict()
+slowest_mentions = [] # heap of tuples (seconds, mention text, kb)
+worker_caches = dict() # cache counters of the worker processes
+
+
+def enable(profile=None, slowest=20):
+    """Start recording the metrics of the run.
+
+    Requires:
+        profile: is str, directory where a cProfile dump '<stage>.prof' is written
+            for each stage (None to not profile)
+        slowest: is int, number of slowest mentions kept in the report
+    """
+
+    global enabled, profile_dir, slowest_size
+
+    enabled, profile_dir, slowest_size = True, profile, slowest
+
+    if profile_dir != None:
+        os.makedirs(profile_dir, exist_ok=True)
+
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident set size of the process (or of its largest child) in MB."""
+
+    return resource.getrusage(who).ru_maxrss / 1024.0
+
+
+
+@contextmanager
+def stage(name):
+    """Record the wall time, CPU time (including finished child processes) and
+    peak RSS of a stage of the run. If the same stage runs several times, the
+    times are added and so are the profiles in '<stage>.prof'.
+    """
+
+    if not enabled:
+        yield
+        return
+
+    profiler = None
+
+    if profile_dir != None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    wall, cpu = time.perf_counter(), os.times()
+
+    try:
+        yield
+
+    finally:
+        end_cpu = os.times()
+
+        if profiler != None:
+            profiler.disable()
+
+            if name in stage_profiles:
+                stage_profiles[name].add(profiler)
+
+            else:
+                stage_profiles[name] = pstats.Stats(profiler)
+
+            stage_profiles[name].dump_stats("{}/{}.prof".format(profile_dir, name))
+
+        stage_metrics = stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "children_cpu": 0.0})
+        stage_metrics["wall"] += round(time.perf_counter() - wall, 6)
+        stage_metrics["cpu"] += round(end_cpu.user + end_cpu.system - cpu.user - cpu.system, 6)
+        stage_metrics["children_cpu"] += round(end_cpu.children_user + end_cpu.children_system 
+            - cpu.children_user - cpu.children_system, 6)
+        stage_metrics["peak_rss_mb"] = peak_rss_mb()
+        stage_metrics["children_peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+
+
+def count(name, n=1):
+    """Add n to the counter name."""
+
+    if enabled:
+        counts[name] = counts.get(name, 0) + n
+
+
+
+def record_mention(entity_text, kb, seconds):
+    """Keep the time to retrieve the candidates of a mention if it is one of the slowest."""
+
+    if not enabled:
+        return
+
+    if len(slowest_mentions) < slowest_size:
+        heapq.heappush(slowest_mentions, (seconds, entity_text, kb))
+
+    elif seconds > slowest_mentions[0][0]:
+        heapq.heapreplace(slowest_mentions, (seconds, entity_text, kb))
+
+
+
+def reset_worker_metrics():
+    """Forget, in a new worker process, the metrics inherited from the parent process."""
+
+    slowest_mentions.clear()
+
+    for cache in candidate_caches:
+        cache.hits, cache.misses, cache.writes = 0, 0, 0
+
+
+
+def collect_worker_metrics():
+    """Metrics recorded in a worker process since the last call, to be sent to the parent process."""
+
+    worker_metrics = {"mentions": list(slowest_mentions), "caches": dict()}
+
+    for cache in candidate_caches:
+        worker_metrics["caches"][cache.filename] = (cache.hits, cache.misses, cache.writes)
+
+    reset_worker_metrics()
+
+    return worker_metrics
+
+
+
+def merge_worker_metrics(worker_metrics):
+    """Add the metrics collected in a worker process to the metrics of the run."""
+
+    if not enabled:
+        return
+
+    for seconds, entity_text, kb in worker_metrics["mentions"]:
+        record_mention(entity_text, kb, seconds)
+
+    for filename, (hits, misses, writes) in worker_metrics["caches"].items():
+        cache_counters = worker_caches.setdefault(filename, [0, 0, 0])
+        cache_counters[0] += hits
+        cache_counters[1] += misses
+        cache_counters[2] += writes
+
+
+
+def cache_metrics():
+    """Lookups and writes of the candidate caches used in the run (in this process and in the workers)."""
+
+    caches = dict()
+
+    for cache in candidate_caches:
+        hits, misses, writes = worker_caches.get(cache.filename, (0, 0, 0))
+        hits, misses, writes = hits + cache.hits, misses + cache.misses, writes + cache.writes
+
+        if hits + misses + writes == 0:
+            continue
+
+        caches[cache.filename] = {"hits": hits, "misses": misses, "writes": writes,
+            "hit_rate": hits / (hits + misses) if hits + misses > 0 else 0.0,
+            "evictions": cache.evictions}
+
+    return caches
+
+
+
+def build_report():
+    """Report with the metrics of the run.
+
+    Ensures:
+        report: is dict with the metrics of each stage, the counters, the candidate caches
+            lookups and the slowest mentions (slowest first)
+    """
+
+    return {"stages": stages, "counts": counts, "caches": cache_metrics(),
+        "slowest_mentions": [{"mention": entity_text, "kb": kb, "seconds": seconds}
+            for seconds, entity_text, kb in sorted(slowest_mentions, reverse=True)],
+        "peak_rss_mb": peak_rss_mb(), "profile_dir": profile_dir}
+
+
+
+def write_report(filename):
+
+    with open(filename, "wb") as report_file:
+        report_file.write(json.dumps(build_report(), option=json.OPT_INDENT_2))
+        report_file.close()
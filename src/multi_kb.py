@@ -0,0 +1,142 @@
+import orjson as json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append("./")
+
+from src.annotations import parse_pubtator_file, parse_typed_input_file
+from src.metrics import count, stage
+from src.pre_process import link_annotations, load_extracted_relations, load_target_kb
+from src.ppr import disambiguate_documents
+from src.ppr_java import JavaPprWorker
+from src.process_results import build_results_dict
+
+
+# Target KBs linked in a single run, the mentions are routed to each KB by entity type
+multi_kb_choices = {"medic+ctd_chem": ("medic", "ctd_chem"), "medic+chebi": ("medic", "chebi")}
+
+
+def load_kb_resources(target_kb, link_mode):
+    """Load a target KB and the respective extracted relations.
+
+    Ensures:
+        resources: is tuple (ontology_graph, name_to_id, synonym_to_id, entity_type, extracted_relations)
+    """
+
+    ontology_graph, name_to_id, synonym_to_id, entity_type = load_target_kb(target_kb)
+    extracted_relations = load_extracted_relations(target_kb, entity_type, link_mode)
+
+    return ontology_graph, name_to_id, synonym_to_id, entity_type, extracted_relations
+
+
+
+def load_target_kbs(target_kbs, link_mode):
+    """Load several target KBs and their extracted relations at the same time, in threads
+    (most of the loading is reading the snapshot arrays and the relations from disk).
+
+    Ensures:
+        kb_resources: is dict, each key is a target KB and values are the tuples outputted by load_kb_resources
+    """
+
+    with ThreadPoolExecutor(max_workers=len(target_kbs)) as executor:
+        futures = {target_kb: executor.submit(load_kb_resources, target_kb, link_mode) for target_kb in target_kbs}
+
+        return {target_kb: futures[target_kb].result() for target_kb in target_kbs}
+
+
+
+def parse_multi_kb_input(input_file):
+    """Parse the corpus once: a json file {'doc_id': {'Chemical': [...], 'Disease': [...]}} or a
+    file in PubTator format (e.g. the BC5CDR corpus files).
+
+    Ensures:
+        annotations_by_type: is dict, each key is an entity type ('Chemical' or 'Disease') and
+            values are dicts with the annotations of each document
+    """
+
+    if input_file.endswith(".json"):
+        return parse_typed_input_file(input_file)
+
+    return parse_pubtator_file(input_file, entity_types=("Chemical", "Disease"))
+
+
+
+def link_multi_kb(annotations_by_type, target_kbs, link_mode, kb_resources, retrieval="cdist", workers=1, 
+        ppr_engine="python"):
+    """Link the mentions of each entity type to the target KB of that entity type. The 
+    candidates, the information content and the answers are kept in memory.
+
+    Requires:
+        annotations_by_type: is dict outputted by parse_multi_kb_input
+        target_kbs: is tuple with the target KBs, e.g. ('medic', 'ctd_chem')
+        kb_resources: is dict outputted by load_target_kbs
+        ppr_engine: is str, 'python' or 'java_worker' (a JVM for each target KB)
+
+    Ensures:
+        results_dict: is dict, each key is a document id, values are dicts with a dict for each 
+            entity type ('Chemical' or 'Disease') with the identifier (in the respective KB) of 
+            the answer for each entity text, so a text typed as both keeps both answers
+    """
+
+    results_dict = dict()
+
+    for target_kb in target_kbs:
+        ontology_graph, name_to_id, synonym_to_id, entity_type, extracted_relations = kb_resources[target_kb]
+        annotations = annotations_by_type.get(entity_type, {})
+
+        print("Linking {} mentions of {} documents to {}".format(entity_type, len(annotations), target_kb))
+        java_worker, disambiguate = None, disambiguate_documents
+
+        if ppr_engine == "java_worker" and len(annotations) > 0:
+            java_worker = JavaPprWorker(entity_type, link_mode)
+            disambiguate = java_worker.disambiguate_documents
+
+        try:
+            answers = link_annotations(annotations, target_kb, link_mode, ontology_graph, name_to_id, synonym_to_id,
+                extracted_relations, retrieval=retrieval, workers=workers, disambiguate=disambiguate)
+
+        finally:
+
+            if java_worker != None:
+                java_worker.close()
+
+        for doc_id, doc_results in build_results_dict(answers, target_kb).items():
+            results_dict.setdefault(doc_id, dict())[entity_type] = doc_results
+
+    return results_dict
+
+
+
+def run_multi_kb(target_kb, link_mode, input_file, out_filename, retrieval="cdist", workers=1, ppr_engine="python"):
+    """Link chemicals and diseases of an input file in a single run: the corpus is parsed
+    once, the target KBs are loaded at the same time and the results are combined in one file.
+
+    Requires:
+        target_kb: is str, a key of multi_kb_choices (e.g. 'medic+ctd_chem')
+        out_filename: is str, path of the json file with the combined results, 
+            {'doc_id': {'Chemical': {'entity_text': 'kb_id'}, 'Disease': {...}}}
+        ppr_engine: is str, 'python' or 'java_worker' (see link_multi_kb)
+    """
+
+    start_time = time.time()
+    target_kbs = multi_kb_choices[target_kb]
+
+    with stage("corpus_parse"):
+        annotations_by_type = parse_multi_kb_input(input_file)
+
+    with stage("kb_load"):
+        kb_resources = load_target_kbs(target_kbs, link_mode)
+
+    for kb in target_kbs:
+        count("kb_concepts", len(kb_resources[kb][1]))
+        count("kb_synonyms", len(kb_resources[kb][2]))
+
+    results_dict = link_multi_kb(annotations_by_type, target_kbs, link_mode, kb_resources,
+        retrieval=retrieval, workers=workers, ppr_engine=ppr_engine)
+
+    with open(out_filename, 'wb') as out_file:
+        out_file.write(json.dumps(results_dict))
+        out_file.close()
+
+    print("Total time (aprox.):", int((time.time() - start_time)/60.0), "minutes\n----------------------------------")
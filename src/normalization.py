@@ -0,0 +1,169 @@
+import numpy as np
+import re
+import sys
+import unicodedata
+
+sys.path.append("./")
+
+from src.snapshot import add_snapshot_arrays, build_string_pool
+
+
+# Index of the names and synonyms of each loaded KB by normalized form, used
+# to resolve the entities that match a KB string exactly without fuzzy matching
+# (or the KBResource of the KB, until the index is needed)
+normalized_indexes = dict()
+
+greek_letters = {"α": "alpha", "β": "beta", "γ": "gamma", "δ": "delta", "ε": "epsilon",
+    "ζ": "zeta", "η": "eta", "θ": "theta", "ι": "iota", "κ": "kappa", "λ": "lambda",
+    "μ": "mu", "ν": "nu", "ξ": "xi", "ο": "omicron", "π": "pi", "ρ": "rho", "σ": "sigma",
+    "ς": "sigma", "τ": "tau", "υ": "upsilon", "φ": "phi", "χ": "chi", "ψ": "psi", "ω": "omega"}
+
+separators = re.compile(r"[\W_]+")
+possessives = re.compile(r"['’]s\b")
+min_stem_length = 3 # plural suffixes are not removed from shorter words
+
+
+def normalize_text(text):
+    """Normalized form of a string: case folded, greek letters spelled out
+    (α -> alpha) and without possessives, whitespace, hyphens or punctuation.
+    """
+
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = possessives.sub("", text)
+    text = "".join(greek_letters.get(character, character) for character in text)
+
+    return separators.sub("", text)
+
+
+
+def singular_forms(key):
+    """Normalized forms of key without plural suffixes ('-ies', '-s', '-es'), 
+    the longest stem first ('doses' -> 'dose', 'dos').
+    """
+
+    forms = []
+
+    if key.endswith("ies") and len(key) - 3 >= min_stem_length:
+        forms.append(key[:-3] + "y")
+
+    if key.endswith("s") and not key.endswith("ss") and len(key) - 1 >= min_stem_length:
+        forms.append(key[:-1])
+
+    if key.endswith("es") and len(key) - 2 >= min_stem_length:
+        forms.append(key[:-2])
+
+    return forms
+
+
+
+def build_normalized_index(name_to_id, synonym_to_id):
+    """Index the names and synonyms of a KB by normalized form.
+
+    Names take precedence over synonyms. The singular form of each KB string 
+    ('-ies' -> '-y' or without '-s') is indexed apart and only when it is not 
+    the normalized form of another KB string. The shorter '-es' forms ('doses' 
+    -> 'dos') are not indexed, they are only tried for the entities.
+
+    Requires:
+        name_to_id: is dict with mappings between each concept name and the respective id
+        synonym_to_id: is dict with mappings between each synonym and the respective id
+
+    Ensures:
+        normalized_index: is dict, each key is a normalized form and values are tuples
+            (string, 100.0, position), position is the index of string in name_to_id or synonym_to_id
+        singular_index: is dict, the same for the singular forms of the KB strings
+    """
+
+    normalized_index, singular_index = dict(), dict()
+
+    for strings in (name_to_id, synonym_to_id):
+
+        for position, string in enumerate(strings):
+            key = normalize_text(string)
+
+            if key != "":
+                normalized_index.setdefault(key, (string, 100.0, position))
+
+    for key in normalized_index:
+        forms = singular_forms(key)
+
+        if forms != [] and forms[0] not in normalized_index:
+            singular_index.setdefault(forms[0], normalized_index[key])
+
+    return normalized_index, singular_index
+
+
+
+def load_normalized_index(kb):
+    """Read the normalized index stored in the snapshot of a KB or build it and store it in 
+    the snapshot directory, so that the names and synonyms are only normalized once.
+
+    Requires:
+        kb: is KBResource object
+
+    Ensures:
+        normalized_index, singular_index: are dicts outputted by build_normalized_index
+    """
+
+    snapshot = kb.snapshot
+
+    try:
+        # Indexes stored before the singular forms were indexed apart have no flags
+        singular = snapshot.normalized_singular.tolist()
+        keys = snapshot.strings("normalized")
+        strings = (snapshot.strings("name"), snapshot.strings("synonym"))
+        indexes = (dict(), dict())
+
+        for key, source, position, is_singular in zip(keys, snapshot.normalized_source.tolist(),
+                snapshot.normalized_position.tolist(), singular):
+            indexes[is_singular][key] = (strings[source][position], 100.0, position)
+
+        normalized_index, singular_index = indexes
+
+    except AttributeError: # The index was not built yet for this snapshot
+        normalized_index, singular_index = build_normalized_index(kb.name_to_id, kb.synonym_to_id)
+        names = list(kb.name_to_id.keys())
+        matches = list(normalized_index.values()) + list(singular_index.values())
+
+        # Strings in both lists at the same position have the same match, whichever list they come from
+        sources = [0 if position < len(names) and names[position] == string else 1
+            for string, score, position in matches]
+        arrays = {"normalized_source": np.array(sources, dtype=np.uint8),
+            "normalized_position": np.array([match[2] for match in matches], dtype=np.int32),
+            "normalized_singular": np.array([0] * len(normalized_index) + [1] * len(singular_index), dtype=np.uint8)}
+        arrays["normalized_pool"], arrays["normalized_offsets"] = build_string_pool(
+            list(normalized_index.keys()) + list(singular_index.keys()))
+
+        # The flags are written last, they mark the index as complete
+        add_snapshot_arrays(snapshot.path, arrays, "normalized_singular")
+
+    return normalized_index, singular_index
+
+
+
+def find_exact_match(entity_text, kb_name):
+    """Get the KB string that matches the normalized form of entity_text. Otherwise, 
+    the KB string that matches one of its singular forms, or the KB string whose 
+    singular form matches it ('dose' -> 'Doses').
+
+    Ensures:
+        match: is tuple (string, 100.0, position) or None if there is no exact match
+    """
+
+    indexes = normalized_indexes.get(kb_name)
+
+    if indexes != None and not isinstance(indexes, tuple):
+        indexes = normalized_indexes[kb_name] = load_normalized_index(indexes)
+
+    if not indexes:
+        return None
+
+    normalized_index, singular_index = indexes
+    key = normalize_text(entity_text)
+
+    for form in [key] + singular_forms(key):
+
+        if form in normalized_index:
+            return normalized_index[form]
+
+    return singular_index.get(key)
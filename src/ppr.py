@@ -0,0 +1,299 @@
+import numpy as np
+import scipy.sparse as sp
+import sys
+
+sys.path.append("./")
+
+
+# Parameters of the random walks, the same used by ppr_for_ned_all
+walkers = 10000 # walkers starting at each node of the disambiguation graph
+teleport = 0.8 # probability of a walker stopping after each step
+iterations = 5 # maximum number of steps of each walker
+gap_lower_bound = 0.1 # below this gap between the two best scores ties are broken by inCount
+n_best = 3
+
+
+def parse_links(links):
+    """Get the ids of the candidates linked to a given candidate.
+
+    Requires:
+        links: is str with the ids separated by ';' (as written by write_candidates) or list of int
+            (as built by build_candidate_links)
+
+    Ensures:
+        linked_ids: is list of int
+    """
+
+    if isinstance(links, str):
+        return [int(link) for link in links.split(";") if link != ""]
+
+    return links
+
+
+
+def build_disambiguation_graph(entity_list):
+    """Build the disambiguation graph of one corpus document.
+
+    There is a node for each distinct candidate id of each entity. Two nodes of
+    different entities are connected if one of the candidates links to the
+    other or if both have the same id.
+
+    Requires:
+        entity_list: is dict of entities in doc, values are the entity string
+            followed by the candidates of each entity (with links already computed)
+
+    Ensures:
+        entities: is list of tuples (entity_text, entity_url) with at least one candidate
+        nodes: is list with the candidate (dict) of each node
+        node_entity: is numpy array with the index in entities of each node
+        adjacency: is CSR matrix where adjacency[i, j] = 1 if nodes i and j are connected
+    """
+
+    entities, nodes, node_entity = [], [], []
+    id_to_nodes, id_links = dict(), dict()
+
+    for e in entity_list:
+        entity_candidates = dict()
+
+        for c in entity_list[e][1:]:
+            entity_candidates[c["id"]] = c
+
+        if len(entity_candidates) == 0: # Entities without candidates are not disambiguated
+            continue
+
+        entity_url = entity_list[e][0].strip("\n").split("\turl:")[-1]
+        entities.append((e, entity_url))
+
+        for candidate_id, c in entity_candidates.items():
+            id_to_nodes.setdefault(candidate_id, []).append(len(nodes))
+            nodes.append(c)
+            node_entity.append(len(entities) - 1)
+
+            for linked_id in parse_links(c["links"]):
+                id_links.setdefault(candidate_id, set()).add(linked_id)
+                id_links.setdefault(linked_id, set()).add(candidate_id)
+
+    node_entity = np.array(node_entity, dtype=np.int64)
+    rows, cols = [], []
+
+    for candidate_id in id_to_nodes:
+        linked_ids = id_links.get(candidate_id, set()) | {candidate_id}
+
+        for linked_id in linked_ids:
+
+            for node_1 in id_to_nodes[candidate_id]:
+
+                for node_2 in id_to_nodes.get(linked_id, []):
+
+                    if node_entity[node_1] != node_entity[node_2]:
+                        rows.append(node_1)
+                        cols.append(node_2)
+
+    adjacency = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(nodes), len(nodes)))
+    adjacency.data[:] = 1.0 # Repeated links count as one edge
+
+    return entities, nodes, node_entity, adjacency
+
+
+
+def personalized_pagerank(adjacency):
+    """Expected number of random walkers starting at each node that stop at every other node.
+
+    Deterministic equivalent of the Monte Carlo walks in ppr_for_ned_all: at each
+    step a walker moves to a random neighbour (or stays if the node has none) and
+    stops with probability 'teleport'. Walkers stopping after the first step
+    are not counted and walkers that did not stop after 'iterations' steps are
+    discarded.
+
+    Requires:
+        adjacency: is CSR matrix representing the disambiguation graph
+
+    Ensures:
+        counts: is CSR matrix, counts[s, t] is the number of walkers starting at s that stopped at t
+    """
+
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    inverse_degree = np.divide(1.0, degree, out=np.zeros_like(degree), where=degree > 0)
+    transition = sp.diags(inverse_degree) @ adjacency + sp.diags((degree == 0).astype(np.float64))
+    transition = transition.tocsr()
+
+    visits = sp.identity(adjacency.shape[0], format="csr")
+    counts = sp.csr_matrix(adjacency.shape)
+    not_stopped = 1.0
+
+    for iteration in range(1, iterations + 1):
+        visits = visits @ transition
+
+        if iteration > 1:
+            counts = counts + visits * (not_stopped * teleport)
+
+        not_stopped *= (1 - teleport)
+
+    return (counts * walkers).tocsr()
+
+
+
+def combine_ppr(counts, node_entity, node_weights):
+    """Score each node with the PPR counts of the other entities and the information content.
+
+    For each node and each other entity only the candidate of that entity with
+    the highest weighted count contributes to the score of the node. Every node
+    also gets a self score proportional to its weight.
+
+    Requires:
+        counts: is CSR matrix outputted by personalized_pagerank
+        node_entity: is numpy array with the entity index of each node
+        node_weights: is numpy array with the normalized information content of each node
+
+    Ensures:
+        scores: is numpy array with the final score of each node
+    """
+
+    n_nodes = len(node_entity)
+    counts = counts.tocoo()
+    sources, targets, values = counts.row, counts.col, counts.data
+
+    # Walkers starting at candidates of the same entity are ignored
+    valid = (node_entity[sources] != node_entity[targets]) & (values > 0)
+    sources, targets, values = sources[valid], targets[valid], values[valid]
+    source_entities = node_entity[sources]
+    weighted = values * node_weights[sources]
+
+    # Keep the best source of each entity for each target node
+    order = np.lexsort((-weighted, source_entities, targets))
+    targets, source_entities = targets[order], source_entities[order]
+    values, weighted = values[order], weighted[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (targets[1:] != targets[:-1]) | (source_entities[1:] != source_entities[:-1])
+
+    scores = np.bincount(targets[first], weights=weighted[first], minlength=n_nodes)
+    total = values[first].sum()
+
+    if total >= 1:
+        total = total / n_nodes
+
+    else:
+        total = 1.0
+
+    return scores + total * node_weights
+
+
+
+def find_best_candidate(entity_nodes, scores, nodes):
+    """Choose the answer for one entity among its candidate nodes.
+
+    If the best score is not higher than the second best by at least
+    'gap_lower_bound', the candidate with highest inCount is chosen instead.
+
+    Requires:
+        entity_nodes: is list with the indexes of the nodes of the entity
+        scores: is numpy array outputted by combine_ppr
+        nodes: is list with the candidate (dict) of each node
+
+    Ensures:
+        best_node: is int, the index of the chosen node
+    """
+
+    best_node, best_score = entity_nodes[0], 0.0
+    max_in_node, max_in = entity_nodes[0], 0
+
+    for node in entity_nodes:
+
+        if scores[node] >= best_score:
+            best_score = scores[node]
+            best_node = node
+
+        if nodes[node]["incount"] >= max_in:
+            max_in = nodes[node]["incount"]
+            max_in_node = node
+
+    if len(entity_nodes) == 1:
+        return best_node
+
+    sorted_scores = sorted(scores[node] for node in entity_nodes)
+    tie_count, tie_node, tie_max_in = 0, best_node, 0
+
+    for node in entity_nodes:
+
+        if scores[node] >= best_score:
+            tie_count += 1
+
+            if nodes[node]["incount"] >= tie_max_in:
+                tie_max_in = nodes[node]["incount"]
+                tie_node = node
+
+    if tie_count > 1:
+        gap = 0.0
+
+    else:
+        gap = best_score - sorted_scores[-2]
+
+    if gap < gap_lower_bound:
+
+        if tie_count > 1:
+            return tie_node
+
+        else:
+            return max_in_node
+
+    return best_node
+
+
+
+def disambiguate_document(entity_list, ic_dict):
+    """Apply the PPR-IC model to the entities of one corpus document.
+
+    Requires:
+        entity_list: is dict of entities in doc, values are the entity string
+            followed by the candidates of each entity (with links already computed)
+        ic_dict: is dict with the information content of each ontology concept
+
+    Ensures:
+        answers: is list of tuples (number_of_mentions, entity_text, correct_answer, answer)
+    """
+
+    entities, nodes, node_entity, adjacency = build_disambiguation_graph(entity_list)
+
+    if len(nodes) == 0:
+        return []
+
+    ic = np.array([ic_dict.get(c["url"], 1.0) for c in nodes])
+    normalization = np.bincount(node_entity, weights=ic, minlength=len(entities))
+    node_weights = ic / normalization[node_entity]
+
+    counts = personalized_pagerank(adjacency)
+    scores = combine_ppr(counts, node_entity, node_weights)
+
+    entity_nodes = [[] for e in entities]
+
+    for node, entity_index in enumerate(node_entity):
+        entity_nodes[entity_index].append(node)
+
+    answers = []
+
+    for entity_index, (entity_text, entity_url) in enumerate(entities):
+        best_node = find_best_candidate(entity_nodes[entity_index], scores, nodes)
+        answers.append((1, entity_text, entity_url, nodes[best_node]["url"]))
+
+    return answers
+
+
+
+def disambiguate_documents(documents_entity_list, ic_dict):
+    """Apply the PPR-IC model to every corpus document.
+
+    Requires:
+        documents_entity_list: is dict, for each document in corpus there is a dict (entity_dict) with each entity mention
+            and respective ontology candidates
+        ic_dict: is dict with the information content of each ontology concept
+
+    Ensures:
+        answers: is dict, each key is a document id, values are lists outputted by disambiguate_document
+    """
+
+    answers = dict()
+
+    for document in documents_entity_list:
+        answers[document] = disambiguate_document(documents_entity_list[document], ic_dict)
+
+    return answers
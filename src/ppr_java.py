@@ -0,0 +1,251 @@
+import os
+import shutil
+import subprocess
+import sys
+
+sys.path.append("./")
+
+from src.candidates import format_candidates
+from src.process_results import parse_results_lines
+
+
+java_class = "ppr_for_ned_all"
+shard_label = "{}_shard_{}" # run label of each shard of the candidates files
+worker_class = "ppr_worker" # persistent worker, see ppr_worker.java
+
+
+def java_command(run_label, model, link_mode):
+
+    return ["java", java_class, run_label, model, link_mode]
+
+
+
+def results_dir(run_label, model, link_mode):
+    """Directory where ppr_for_ned_all writes the results of a run."""
+
+    return "results/{}/{}/{}/".format(run_label, model, link_mode)
+
+
+
+def shard_documents(documents, candidates_dir, shards):
+    """Split the candidates files in shards with about the same total size (the largest
+    files are assigned first, each one to the shard with less bytes so far).
+
+    Requires:
+        documents: is list with the documents names in corpus order
+        candidates_dir: is str, the directory with the candidates file of each document
+
+    Ensures:
+        document_shards: is list with the list of documents of each shard, in corpus order
+    """
+
+    sizes = {document: os.path.getsize(candidates_dir + document) for document in documents
+        if os.path.isfile(candidates_dir + document)}
+    position = {document: i for i, document in enumerate(documents)}
+    shard_sizes, shard_of = [0] * shards, dict()
+
+    for document in sorted(sizes, key=lambda document: (-sizes[document], position[document])):
+        shard = shard_sizes.index(min(shard_sizes))
+        shard_of[document] = shard
+        shard_sizes[shard] += sizes[document]
+
+    return [[document for document in documents if shard_of.get(document) == shard] for shard in range(shards)]
+
+
+
+def split_results_blocks(filename):
+    """Split a results file of ppr_for_ned_all in the block of lines of each document.
+
+    Ensures:
+        blocks: is dict, each key is a document id and values are the lines of the document
+            (starting with the '=' line with the document id)
+    """
+
+    blocks, doc_id = dict(), None
+
+    with open(filename, 'r') as results_file:
+
+        for line in results_file:
+
+            if line[0] == "=" and len(line.split(" ")) > 1:
+                doc_id = line.strip("\n").split(" ")[1]
+                blocks[doc_id] = [line]
+
+            elif doc_id != None:
+                blocks[doc_id].append(line)
+
+        results_file.close()
+
+    return blocks
+
+
+
+def merge_shard_results(run_label, model, link_mode, documents, shards):
+    """Merge the results files of the shards in the results directory of the run. The blocks
+    of each document are written in corpus order, so the merged files do not depend on the
+    number of shards or on which shard finished first.
+    """
+
+    out_dir = results_dir(run_label, model, link_mode)
+    shard_dirs = [results_dir(shard_label.format(run_label, shard), model, link_mode) for shard in range(shards)]
+    filenames = sorted(set(filename for shard_dir in shard_dirs if os.path.isdir(shard_dir)
+        for filename in os.listdir(shard_dir)))
+
+    for filename in filenames:
+        blocks = dict()
+
+        for shard_dir in shard_dirs:
+
+            if os.path.isfile(shard_dir + filename):
+                blocks.update(split_results_blocks(shard_dir + filename))
+
+        with open(out_dir + filename, 'w') as out_file:
+            out_file.write("".join("".join(blocks[document]) for document in documents if document in blocks))
+            out_file.close()
+
+
+
+def run_java_ppr(run_label, model, link_mode, documents, shards=1, subset=False):
+    """Apply ppr_for_ned_all to the candidates files of a run. With more than one shard, the
+    candidates files are split in shards (directories with links to the files) and one JVM
+    disambiguates each shard at the same time. The results are then merged in the results
+    directory of the run, so process_results reads them as usual.
+
+    Requires:
+        documents: is list with the documents names in corpus order
+        shards: is int, number of JVMs
+        subset: is bool, if True only the candidates files of documents are disambiguated 
+            (in a shard, even if there is only one), e.g. the new or changed documents of an 
+            incremental run
+    """
+
+    candidates_dir = "candidates/{}/{}/".format(run_label, link_mode)
+    shards = min(shards, max(len(documents), 1))
+
+    if shards <= 1 and not subset:
+        subprocess.run(java_command(run_label, model, link_mode), check=True)
+        return
+
+    processes = []
+
+    for shard, shard_documents_list in enumerate(shard_documents(documents, candidates_dir, shards)):
+        label = shard_label.format(run_label, shard)
+        shard_dir = "candidates/{}/{}/".format(label, link_mode)
+
+        shutil.rmtree("candidates/{}".format(label), ignore_errors=True)
+        os.makedirs(shard_dir)
+        os.makedirs(results_dir(label, model, link_mode), exist_ok=True)
+
+        for document in shard_documents_list:
+            os.symlink(os.path.abspath(candidates_dir + document), shard_dir + document)
+
+        if os.path.lexists(label + "_ic"):
+            os.remove(label + "_ic")
+
+        os.symlink(os.path.abspath(run_label + "_ic"), label + "_ic")
+        processes.append(subprocess.Popen(java_command(label, model, link_mode)))
+
+    # A shard that failed (e.g. out of memory) would leave its documents out of the merged results
+    failed = ["{} (exit code {})".format(shard_label.format(run_label, shard), returncode) 
+        for shard, returncode in enumerate([process.wait() for process in processes]) if returncode != 0]
+
+    if len(failed) > 0:
+        raise Exception("{} failed for the shards: {}".format(java_class, ", ".join(failed)))
+
+    merge_shard_results(run_label, model, link_mode, documents, shards)
+
+    for shard in range(shards):
+        label = shard_label.format(run_label, shard)
+        shutil.rmtree("candidates/{}".format(label), ignore_errors=True)
+        shutil.rmtree("results/{}".format(label), ignore_errors=True)
+        os.remove(label + "_ic")
+
+
+
+def compile_worker():
+    """Compile ppr_worker.java if the class file is missing or older than the source."""
+
+    source, class_file = worker_class + ".java", worker_class + ".class"
+
+    if not os.path.isfile(class_file) or os.path.getmtime(class_file) < os.path.getmtime(source):
+        subprocess.run(["javac", source], check=True)
+
+
+
+class JavaPprWorker:
+    """Client of a ppr_worker process: one JVM is kept alive and ppr_for_ned_all is
+    applied to the candidates sent over its stdin, without a JVM startup or 
+    candidates files written by REEL for each request.
+    """
+
+    def __init__(self, entity_type, link_mode, model="ppr_ic", verbose=False):
+        """
+        Requires:
+            entity_type: is str, either "Chemical" or "Disease"
+            verbose: is bool, if True the output of ppr_for_ned_all is shown in stderr
+        """
+
+        self.entity_type = entity_type
+        self.link_mode = link_mode
+        self.model = model
+
+        compile_worker()
+        self.process = subprocess.Popen(["java", worker_class], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=None if verbose else subprocess.DEVNULL, encoding="utf-8")
+
+
+    def disambiguate_documents(self, documents_entity_list, ic_dict):
+        """Send the linked candidates of the documents and the information content of 
+        the candidates to the worker and read the answers, same interface as 
+        disambiguate_documents in src/ppr.py.
+
+        Requires:
+            documents_entity_list: is dict outputted by build_entity_candidate_dict, with the links between candidates
+            ic_dict: is dict with the information content of each candidate url
+
+        Ensures:
+            answers: is dict outputted by parse_results_file
+        """
+
+        request = ["RUN {} {}".format(self.model, self.link_mode), "IC {}".format(len(ic_dict))]
+        request.extend("{}\t{}".format(url, ic_dict[url]) for url in ic_dict)
+
+        for document in documents_entity_list:
+            lines, entities_used = format_candidates(documents_entity_list[document], self.entity_type)
+
+            if entities_used > 0:
+                request.append("DOC {} {}".format(len(lines), document))
+                request.extend(line.rstrip("\n") for line in lines)
+
+        request.append("END")
+        self.process.stdin.write("\n".join(request) + "\n")
+        self.process.stdin.flush()
+
+        results, error = [], None
+
+        for line in self.process.stdout:
+
+            if line == "END\n":
+                break
+
+            if line.startswith("ERROR "):
+                error = line[6:].strip()
+
+            else:
+                results.append(line)
+
+        else:
+            raise RuntimeError("ppr_worker exited with code {}".format(self.process.wait()))
+
+        if error != None:
+            raise RuntimeError("ppr_worker: " + error)
+
+        return parse_results_lines(results)
+
+
+    def close(self):
+        """Stop the worker (it removes its candidates and results files)."""
+
+        if self.process.poll() == None:
+            self.process.stdin.close()
+            self.process.wait()
@@ -1,4 +1,5 @@
 import argparse
+import multiprocessing
 import os
 import orjson as json
 import sys
@@ -10,15 +11,20 @@ from src.chebi import load_chebi
 from src.medic import load_medic
 from src.ctd_chemicals import load_ctd_chemicals
 from src.annotations import parse_input_file, parse_craft_chebi_annotations, parse_cdr_annotations_pubtator
-from src.candidates import write_candidates, generate_candidates_for_entity
-from src.information_content import generate_ic_file
+from src.candidate_store import CandidateStore, export_text, store_filename, write_candidate_store
+from src.candidates import build_candidate_links, write_candidates, generate_candidates_for_entity, prefetch_candidates
+from src.incremental import load_manifest, run_version, update_manifest, write_manifest
+from src.information_content import build_extrinsic_information_content_dict, build_ic_table, generate_ic_file
+from src.metrics import collect_worker_metrics, count, merge_worker_metrics, record_mention, reset_worker_metrics, stage
+from src.ppr import disambiguate_documents
+from src.relation_store import load_relation_store
 from src.relations import import_bolstm_output, import_cdr_relations_pubtator
-from src.strings import entity_string
+from src.strings import entity_string, field_text
 
 sys.path.append("./")
 
 
-def check_if_dirs_exist(candidates=False, results=False, run_label=None, dataset=None, link_mode=None):
+def check_if_dirs_exist(candidates=False, results=False, run_label=None, dataset=None, link_mode=None, keep_files=False):
     """asffssf"""
 
     target_dir = ''
@@ -56,10 +62,10 @@ def check_if_dirs_exist(candidates=False, results=False, run_label=None, dataset
     if not os.path.exists(target_dir_2):
         os.mkdir(target_dir_2)
     
-    # Delete existing candidates files
+    # Delete existing candidates files (kept in incremental runs)
     cand_files = os.listdir(target_dir_2)
 
-    if len(cand_files)!=0:
+    if len(cand_files)!=0 and not keep_files:
         
         for file in cand_files:
             os.remove(target_dir_2 + file)
@@ -67,7 +73,169 @@ def check_if_dirs_exist(candidates=False, results=False, run_label=None, dataset
     return target_dir_2
 
 
-def build_entity_candidate_dict(ontology, annotations, min_match_score, ontology_graph, name_to_id, synonym_to_id, dataset=None):
+# Keys of the candidate dicts in the order they are built by generate_candidates_for_entity, 
+# the candidates in the unique mention table are tuples with the values of all keys except "links"
+candidate_fields = ("url", "name", "outcount", "incount", "id", "score")
+
+
+def is_nil_annotation(annotation_id):
+
+    return annotation_id == None or annotation_id == "" or annotation_id == "-1"
+
+
+
+def resolve_unique_mention(key, ontology, min_match_score, ontology_graph, name_to_id, synonym_to_id, dataset=None):
+    """Get the candidates of a unique mention of the corpus.
+
+    Requires:
+        key: is tuple (normalized text, annotation id)
+        (the other arguments are described in build_entity_candidate_dict)
+
+    Ensures:
+        candidates: is tuple with a tuple of values (in candidate_fields order) for each candidate
+        solution_is_first: is bool, True if the correct solution is the first candidate
+    """
+
+    normalized_text, annotation_id = key
+    start = time.perf_counter()
+    structured_candidates, solution_is_first = generate_candidates_for_entity(normalized_text, annotation_id, 
+        ontology, name_to_id, synonym_to_id, min_match_score, ontology_graph, dataset=dataset)
+    record_mention(normalized_text, ontology, time.perf_counter() - start)
+
+    return tuple(tuple(c[field] for field in candidate_fields) for c in structured_candidates), solution_is_first
+
+
+
+# Arguments of resolve_unique_mention shared with the worker processes (inherited when forked)
+worker_arguments = dict()
+
+
+def resolve_unique_mentions_worker(keys):
+    """Apply resolve_unique_mention in a worker process to a chunk of unique mentions."""
+
+    resolved = [resolve_unique_mention(key, worker_arguments["ontology"], worker_arguments["min_match_score"], 
+        worker_arguments["ontology_graph"], worker_arguments["name_to_id"], worker_arguments["synonym_to_id"], 
+        dataset=worker_arguments["dataset"]) for key in keys]
+
+    return resolved, collect_worker_metrics()
+
+
+
+def build_unique_mention_table(ontology, annotations, min_match_score, ontology_graph, name_to_id, synonym_to_id, 
+        dataset=None, show_progress=True, workers=1):
+    """Resolve once each unique mention of the corpus, i.e. each (normalized text, annotation id) 
+    pair of the non-NIL annotations. The annotation id is part of the key because in the datasets
+    the correct solution is moved to the first position of the candidates.
+
+    Ensures:
+        mention_index: is dict, each key is a unique mention and values are its position in unique_mentions
+        unique_mentions: is list with the tuple (candidates, solution_is_first) outputted by 
+            resolve_unique_mention for each unique mention, in the order they first appear in corpus
+    """
+
+    mention_index = dict()
+
+    for document in annotations:
+
+        for annotation_id, entity_text in annotations[document]:
+
+            if not is_nil_annotation(annotation_id):
+                mention_index.setdefault((entity_text.lower(), annotation_id), len(mention_index))
+
+    keys = list(mention_index.keys())
+    unique_mentions = []
+    pbar = tqdm(total=len(keys), colour= 'green', desc='Pre-processing', disable=not show_progress)
+
+    if workers > 1 and len(keys) > 1:
+        worker_arguments.update(ontology=ontology, min_match_score=min_match_score, ontology_graph=ontology_graph, 
+            name_to_id=name_to_id, synonym_to_id=synonym_to_id, dataset=dataset)
+        chunk_size = max(1, min(256, len(keys) // (workers * 8)))
+        chunks = [keys[start:start + chunk_size] for start in range(0, len(keys), chunk_size)]
+        
+        with multiprocessing.get_context("fork").Pool(workers, initializer=reset_worker_metrics) as pool:
+            
+            for resolved, worker_metrics in pool.imap(resolve_unique_mentions_worker, chunks):
+                unique_mentions.extend(resolved)
+                merge_worker_metrics(worker_metrics)
+                pbar.update(len(resolved))
+
+        worker_arguments.clear()
+
+    else:
+
+        for key in keys:
+            unique_mentions.append(resolve_unique_mention(key, ontology, min_match_score, ontology_graph, 
+                name_to_id, synonym_to_id, dataset=dataset))
+            pbar.update(1)
+
+    pbar.close()
+
+    return mention_index, unique_mentions
+
+
+
+def build_document_entity_dict(i, document, document_annotations, ontology, mention_index, unique_mentions, dataset=None):
+    """Builds the dict with candidates for all entity mentions in one corpus document from the 
+    unique mention table. Each candidate is a new dict, since the links are added to the 
+    candidates of each document.
+    
+    Requires: 
+        i: is int, the index of the document in corpus
+        document: is str, the document name
+        document_annotations: is list containing all annotations in document (in tuple format)
+        mention_index, unique_mentions: are outputted by build_unique_mention_table
+    
+    Ensures: 
+        entity_dict: is dict with each entity mention in document and respective ontology candidates
+        counts: is tuple (total_entities, nil_count, total_unique_entities, no_solution, solution_is_first_count)
+    """
+
+    nil_count, total_entities, total_unique_entities, no_solution, solution_is_first_count = int(),int(), int(), int(), int()
+    entity_dict = dict() 
+    document_entities = set()
+    entity_type = str()
+                    
+    if ontology == "chebi" or ontology == "ctd_chem":
+        entity_type = "chemical"
+    
+    elif ontology == "medic":
+        entity_type = "disease"
+
+    for annotation in document_annotations:
+        annotation_id, entity_text = annotation[0], annotation[1]
+        normalized_text = entity_text.lower()
+        total_entities += 1
+        
+        if is_nil_annotation(annotation_id): # The annotations is a NIL entity
+            annotation_id = "NIL"
+            nil_count += 1
+        
+        elif normalized_text not in document_entities: # Repeated instances of the same entity are not considered
+            document_entities.add(normalized_text)
+            total_unique_entities += 1
+            candidates, solution_is_first = unique_mentions[mention_index[(normalized_text, annotation_id)]]
+
+            # Check the solution found for this entity
+            
+            if solution_is_first: # The solution found is the correct one
+                solution_is_first_count += 1
+            
+            if len(candidates) == 0 and dataset != None: # Do not consider this entity if no candidate was found
+                no_solution += 1
+            
+            else:
+                # The entity has candidates (or there are no correct solutions), so it is added to entity_dict
+                entity_str = entity_string.format(field_text(entity_text), field_text(normalized_text), entity_type, i, 
+                    document, annotation_id)
+                entity_dict[normalized_text] = [entity_str] + [{"url": c[0], "name": c[1], "outcount": c[2], 
+                    "incount": c[3], "id": c[4], "links": [], "score": c[5]} for c in candidates]
+
+    return entity_dict, (total_entities, nil_count, total_unique_entities, no_solution, solution_is_first_count)
+
+
+
+def build_entity_candidate_dict(ontology, annotations, min_match_score, ontology_graph, name_to_id, synonym_to_id, 
+        dataset=None, show_progress=True, retrieval="cdist", workers=1, document_positions=None):
     """Builds the dict with candidates for all entity mentions in all corpus documents.
     
     Requires: 
@@ -75,9 +243,15 @@ def build_entity_candidate_dict(ontology, annotations, min_match_score, ontology
         annotations: is dict, each key is a document name, value is a list containing all annotations in document (in tuple format)
         min_match_score: is float that represents minimum edit distance between the mention text and candidate string, 
             candidates below this threshold are excluded from candidates list
-        ontology_graph: is a MultiDiGraph object from Networkx representing the ontology
+        ontology_graph: is a SnapshotGraph object representing the ontology
         name_to_id: is dict with mappings between each ontology concept name and the respective id
         synonym_to_id: is dict with mappings between each synonym for a given ontology concept and the respective id
+        show_progress: is bool, if False the progress bar is not displayed
+        retrieval: is str, how the KB matches of the entities are retrieved in batch ('cdist', 'none' or the approximate 'ngram')
+        workers: is int, number of processes generating the candidates of the unique mentions. The KB is 
+            shared with the forked workers and the new matches are written by each worker to the disk cache
+        document_positions: is dict with the index in corpus of each document, if annotations only 
+            has some of the documents of the corpus (None if annotations has the whole corpus)
     
     Ensures: 
         documents_entity_list: is dict, for each document in corpus there is a dict (entity_dict) with each entity mention
@@ -90,63 +264,38 @@ def build_entity_candidate_dict(ontology, annotations, min_match_score, ontology
     
     documents_entity_list = dict() 
 
-    pbar = tqdm(total= len(annotations.keys()), colour= 'green', desc='Pre-processing')
-
-    for i, document in enumerate(annotations.keys()): 
-        entity_dict = dict() 
-        document_entities = list()
-
-        for annotation in annotations[document]:
-            annotation_id, entity_text = annotation[0], annotation[1]
-            normalized_text = entity_text.lower()
-            total_entities += 1
-            
-            if annotation_id == None or annotation_id == "" or annotation_id == "-1": # The annotations is a NIL entity
-                annotation_id = "NIL"
-                nil_count += 1
-            
-            else:
-                if normalized_text in document_entities: # Repeated instances of the same entity are not considered
-                    continue
-                
-                else:    
-                    document_entities.append(normalized_text)
-                    total_unique_entities += 1
-                     
-                    # Get ontology candidates for entity
-                    entity_dict[normalized_text], solution_is_first = generate_candidates_for_entity(
-                        normalized_text, annotation_id, ontology, name_to_id, synonym_to_id,
-                        min_match_score, ontology_graph, dataset=dataset)
-
-                    # Check the solution found for this entity
-                    
-                    if solution_is_first: # The solution found is the correct one
-                        solution_is_first_count += 1
-                    
-                    if len(entity_dict[normalized_text]) == 0 and dataset != None: # Do not consider this entity if no candidate was found
-                        del entity_dict[normalized_text]
-                        no_solution += 1
-                                     
-                    elif (len(entity_dict[normalized_text]) > 0 and dataset != None) or \
-                            dataset == None:
-                        # The entity has candidates, so it is added to entity_dict
-                        entity_type = str()
-                        
-                        if ontology == "chebi" or ontology == "ctd_chem":
-                            entity_type = "chemical"
-                        
-                        elif ontology == "medic":
-                            entity_type = "disease"
-                        
-                        entity_str = entity_string.format(entity_text, normalized_text, entity_type, i, document, annotation_id)
-                        current_values = entity_dict[normalized_text]
-                        current_values.insert(0, entity_str)
-                        entity_dict[normalized_text] = current_values
-            
-        documents_entity_list[document] = entity_dict
-        pbar.update(1)
+    # Retrieve the matches of all the entity mentions in corpus at once
+    entity_texts = [annotation[1].lower() for document in annotations for annotation in annotations[document] 
+        if annotation[0] not in (None, "", "-1")]
     
-    pbar.close()
+    with stage("retrieval"):
+        prefetch_candidates(entity_texts, ontology, name_to_id, synonym_to_id, retrieval=retrieval, min_match_score=min_match_score)
+
+    with stage("candidates"):
+        mention_index, unique_mentions = build_unique_mention_table(ontology, annotations, min_match_score, 
+            ontology_graph, name_to_id, synonym_to_id, dataset=dataset, show_progress=show_progress, workers=workers)
+        documents = list(annotations.keys())
+
+        for i, document in enumerate(documents): 
+
+            if document_positions != None:
+                i = document_positions[document]
+
+            entity_dict, counts = build_document_entity_dict(i, document, annotations[document], ontology, 
+                mention_index, unique_mentions, dataset=dataset)
+            documents_entity_list[document] = entity_dict
+            total_entities += counts[0]
+            nil_count += counts[1]
+            total_unique_entities += counts[2]
+            no_solution += counts[3]
+            solution_is_first_count += counts[4]
+    
+    count("documents", len(documents))
+    count("unique_mentions", len(unique_mentions))
+    count("mentions", total_entities)
+    count("nil_mentions", nil_count)
+    count("unique_entities", total_unique_entities)
+    count("candidates", sum(len(entity_dict[e]) - 1 for entity_dict in documents_entity_list.values() for e in entity_dict))
     
     # Calculate statistics to output
     statistics = str()
@@ -172,7 +321,13 @@ def build_entity_candidate_dict(ontology, annotations, min_match_score, ontology
     statistics += "\nNumber of documents: " + str(len(documents_entity_list.keys())) 
     statistics += "\nTotal entities: " + str(total_entities) + "\nNILs: " + str(nil_count)
     statistics += "\nValid entities: " + str(total_entities-nil_count)
-    valid_entities_perc = ((total_entities-nil_count)/total_entities)*100
+
+    try:
+        valid_entities_perc = ((total_entities-nil_count)/total_entities)*100
+    
+    except: # No documents to process (e.g. incremental run without new or changed documents)
+        valid_entities_perc = 0
+
     statistics += "\n % of valid entities: " + str(valid_entities_perc)
     statistics += "\n\nTotal unique entities: " + str(total_unique_entities)
     entities_w_solution = total_unique_entities-no_solution
@@ -188,14 +343,131 @@ def build_entity_candidate_dict(ontology, annotations, min_match_score, ontology
     
 
 
+def load_target_kb(target_kb):
+    """Load the target knowledge base.
+
+    Requires:
+        target_kb: is str, either 'chebi', 'ctd_chem' or 'medic'
+
+    Ensures:
+        ontology_graph: is a SnapshotGraph object representing the knowledge base
+        name_to_id: is dict with mappings between each concept name and the respective id
+        synonym_to_id: is dict with mappings between each synonym and the respective id
+        entity_type: is str, either "Chemical" or "Disease"
+    """
+
+    if target_kb == 'chebi':
+        ontology_graph, name_to_id, synonym_to_id  = load_chebi()
+        entity_type = 'Chemical'
+    
+    elif target_kb == 'ctd_chem':
+        ontology_graph, name_to_id, synonym_to_id  = load_ctd_chemicals()
+        entity_type = 'Chemical'
+        
+    elif target_kb == 'medic':
+        ontology_graph, name_to_id, synonym_to_id  = load_medic()
+        entity_type = 'Disease'
+
+    else:
+        raise ValueError("Invalid target KB, valid inputs: 'chebi', 'medic' or 'ctd_chem'")
+
+    return ontology_graph, name_to_id, synonym_to_id, entity_type
+
+
+def load_extracted_relations(target_kb, entity_type, link_mode):
+    """Open the store with the extracted relations if link_mode requires them.
+
+    Ensures:
+        extracted_relations: is RelationStore object, for each entity id get(entity_id) is the set 
+            with the ids of related entities (empty dict if link_mode = 'kb_link')
+    """
+
+    extracted_relations = {}
+
+    if link_mode == "corpus_link" or link_mode == "kb_corpus_link": 
+        
+        if target_kb == "chebi":
+            extracted_relations = load_relation_store('chebi_relations.json')
+            #extracted_relations = import_bolstm_output()
+        
+        elif target_kb == "ctd_chem" or target_kb == "medic":
+            extracted_relations = load_relation_store(entity_type + '_relations.json')
+            #extracted_relations = import_cdr_relations_pubtator(entity_type)
+
+    return extracted_relations
+
+
+def link_annotations(annotations, target_kb, link_mode, ontology_graph, name_to_id, synonym_to_id, 
+        extracted_relations, min_match_score=0.5, retrieval="cdist", workers=1, disambiguate=disambiguate_documents):
+    """Apply the PPR-IC model to the given annotations in memory, no candidates files are written.
+
+    Requires:
+        annotations: is dict, each key is a document name, value is a list containing all annotations in document (in tuple format)
+        target_kb: is str, either 'chebi', 'ctd_chem' or 'medic'
+        link_mode: is str specifying how the edges in disambiguation graph are built ('kb_link', 'corpus_link', 'kb_corpus_link')
+        extracted_relations: is outputted by load_extracted_relations
+        disambiguate: is function with the interface of disambiguate_documents (e.g. the 
+            disambiguate_documents method of a JavaPprWorker)
+
+    Ensures:
+        answers: is dict outputted by disambiguate_documents
+    """
+
+    # Requests may have only documents without entities, e.g. {"doc_id": []}
+    if all(len(annotations[document]) == 0 for document in annotations):
+        return {}
+
+    documents_entity_list, statistics = build_entity_candidate_dict(target_kb, annotations, min_match_score, 
+        ontology_graph, name_to_id, synonym_to_id, show_progress=False, retrieval=retrieval, workers=workers)
+
+    linked_ids = dict()
+
+    with stage("links"):
+
+        for document in documents_entity_list:
+            build_candidate_links(documents_entity_list[document], ontology_graph, link_mode, extracted_relations, 
+                linked_ids=linked_ids)
+    
+    with stage("ic"):
+        ic_dict = build_ic_table(documents_entity_list, build_extrinsic_information_content_dict(annotations))
+
+    with stage("ppr"):
+        answers = disambiguate(documents_entity_list, ic_dict)
+
+    return answers
+
+
 def pre_process(model, run_label=None, link_mode="none", dataset=None, 
-        input_file=None, target_kb=None):
+        input_file=None, target_kb=None, retrieval="cdist", workers=1, write_files=True, incremental=False, 
+        ppr_engine="python", candidate_store=False):
+    """Generate the candidates for each entity and, if not baseline model, the candidates files.
+
+    Requires:
+        retrieval: is str, how the KB matches of the entities are retrieved in batch ('cdist', 'none' or the approximate 'ngram')
+        workers: is int, number of processes generating the candidates of the unique mentions
+        write_files: is bool, if False the links between candidates and the information content are 
+            only built in memory, no candidates files or information content file are written
+        incremental: is bool, if True only the documents that are new or changed since the last run 
+            with the same run_label and link_mode (see src/incremental.py) are processed
+        ppr_engine: is str, the PPR engine of the run (part of the version of the incremental runs)
+        candidate_store: is bool, if True the candidates are written to a single candidate store
+            (see src/candidate_store.py) instead of a candidates file for each document, the text
+            candidates files are only exported from it for the 'java' PPR engine
+
+    Ensures:
+        documents_entity_list: is dict outputted by build_entity_candidate_dict, with the links 
+            between candidates if not baseline model (only the new or changed documents if incremental), 
+            or CandidateStore object opened from the candidate store
+        ic_dict: is dict outputted by generate_ic_file with the information content of each candidate 
+            (empty if baseline model)
+    """
     
     start_time = time.time()
     #-------------------------------------------------------------------------
     
     ontology_graph, name_to_id, synonym_to_id, annotations,  = None, {}, {}, {}
     statistics, entity_type, subset = '', '', ''
+    ic_dict = {}
 
     if dataset != None:
         bc5cdr_medic_list = ["bc5cdr_medic_train", "bc5cdr_medic_dev", "bc5cdr_medic_test", "bc5cdr_medic_all"]
@@ -203,52 +475,83 @@ def pre_process(model, run_label=None, link_mode="none", dataset=None,
         run_label = dataset
 
         if dataset == "craft_chebi":
-            ontology_graph, name_to_id, synonym_to_id  = load_chebi()  # Load ontology file into graph and MultiDiGraph objects of Networkx
+            with stage("kb_load"):
+                ontology_graph, name_to_id, synonym_to_id  = load_chebi()  # Load the ontology snapshot (compiled from the ontology file if needed)
+            
             entity_type = "Chemical"
-            annotations = parse_craft_chebi_annotations() # Parse corpus annotations
+            
+            with stage("corpus_parse"):
+                annotations = parse_craft_chebi_annotations() # Parse corpus annotations
+            
             target_kb = "chebi"
 
         elif dataset in bc5cdr_medic_list:
-            ontology_graph, name_to_id, synonym_to_id  = load_medic()
+            with stage("kb_load"):
+                ontology_graph, name_to_id, synonym_to_id  = load_medic()
+            
             subset = dataset.split("_")[2]
             entity_type = "Disease" 
             target_kb = "medic"
 
-            annotations = parse_cdr_annotations_pubtator(entity_type, subset)
+            with stage("corpus_parse"):
+                annotations = parse_cdr_annotations_pubtator(entity_type, subset)
         
         elif dataset in bc5cdr_chemicals_list:
-            ontology_graph, name_to_id, synonym_to_id  = load_ctd_chemicals()
+            with stage("kb_load"):
+                ontology_graph, name_to_id, synonym_to_id  = load_ctd_chemicals()
+            
             subset = dataset.split("_")[2]
             entity_type = "Chemical"
             target_kb = "ctd_chem"
             
-            annotations = parse_cdr_annotations_pubtator(entity_type, subset)
+            with stage("corpus_parse"):
+                annotations = parse_cdr_annotations_pubtator(entity_type, subset)
     
     else:
         run_label = run_label
 
         if input_file != None:
-
-            if target_kb == 'chebi':
-                ontology_graph, name_to_id, synonym_to_id  = load_chebi()
-                entity_type = 'Chemical'
+            with stage("kb_load"):
+                ontology_graph, name_to_id, synonym_to_id, entity_type = load_target_kb(target_kb)
             
-            elif target_kb == 'ctd_chem':
-                ontology_graph, name_to_id, synonym_to_id  = load_ctd_chemicals()
-                entity_type = 'Chemical'
-                
-            elif target_kb == 'medic':
-                ontology_graph, name_to_id, synonym_to_id  = load_medic()
-                entity_type = 'Disease'
-            
-            annotations = parse_input_file(input_file)
+            with stage("corpus_parse"):
+                annotations = parse_input_file(input_file)
 
         else:
             raise ValueError('You need to input either a dataset or a file with entities!')
+    
+    count("kb_concepts", len(name_to_id))
+    count("kb_synonyms", len(synonym_to_id))
+    count("kb_edges", ontology_graph.number_of_edges())
     #---------------------------------------------------------------------------
     min_match_score = 0.5 # min lexical similarity between entity text and candidate text
-    #print(target_kb)
-    documents_entity_list, statistics = build_entity_candidate_dict(target_kb, annotations, min_match_score, ontology_graph, name_to_id, synonym_to_id, dataset=dataset )
+    corpus_annotations, document_positions, extracted_relations = annotations, None, None
+
+    if incremental:
+        # Only the documents that are new or changed since the last run are processed, the
+        # candidates files of the other documents are kept
+        with stage("relations_load"):
+            extracted_relations = load_extracted_relations(target_kb, entity_type, link_mode)
+
+        candidates_dir = check_if_dirs_exist(candidates=True, run_label=run_label, link_mode=link_mode, keep_files=True)
+        version = run_version(ontology_graph, extracted_relations, retrieval, model, ppr_engine)
+        manifest, stale_documents, removed_documents = update_manifest(load_manifest(run_label, link_mode), 
+            annotations, version, candidates_dir=candidates_dir if write_files else None)
+
+        for document in removed_documents:
+
+            if os.path.isfile(candidates_dir + document):
+                os.remove(candidates_dir + document)
+
+        write_manifest(run_label, link_mode, manifest)
+        print("Unchanged documents:", len(annotations) - len(stale_documents), "of", len(annotations))
+        count("unchanged_documents", len(annotations) - len(stale_documents))
+
+        document_positions = {document: i for i, document in enumerate(annotations)}
+        annotations = {document: corpus_annotations[document] for document in stale_documents}
+    
+    documents_entity_list, statistics = build_entity_candidate_dict(target_kb, annotations, min_match_score, ontology_graph, 
+        name_to_id, synonym_to_id, dataset=dataset, retrieval=retrieval, workers=workers, document_positions=document_positions)
     
 
     if model == "baseline" or dataset != None:
@@ -264,43 +567,83 @@ def pre_process(model, run_label=None, link_mode="none", dataset=None,
     # Import extracted relations from file into list if not baseline model or link_mode = "kb_link"
     if model != "baseline": 
         
-        extracted_relations = []
+        if extracted_relations == None:
+            with stage("relations_load"):
+                extracted_relations = load_extracted_relations(target_kb, entity_type, link_mode)
 
-        if link_mode == "corpus_link" or link_mode == "kb_corpus_link": 
+        if write_files and candidate_store:
+            # Write the candidates of all the corpus documents to a single file
+            candidates_dir = check_if_dirs_exist(candidates=True, run_label=run_label, dataset=dataset, link_mode=link_mode)
+            linked_ids = dict()
+
+            with stage("links"):
+                
+                for document in tqdm(documents_entity_list, colour= 'green', desc='Linking candidates'):
+                    build_candidate_links(documents_entity_list[document], ontology_graph, link_mode, extracted_relations, 
+                        linked_ids=linked_ids)
             
-            if target_kb == "chebi":
+            with stage("write_candidates"):
+                entities_writen = write_candidate_store(store_filename(run_label, link_mode), documents_entity_list, entity_type)
+                documents_entity_list = CandidateStore(store_filename(run_label, link_mode))
 
-                with open('chebi_relations.json', 'r') as rel_file:
-                    extracted_relations = json.loads(rel_file.read())
-                    rel_file.close()
-                #extracted_relations = import_bolstm_output()
+                if ppr_engine == "java": # ppr_for_ned_all reads the text candidates files
+                    export_text(documents_entity_list, candidates_dir)
             
-            elif target_kb == "ctd_chem" or target_kb == "medic":
-                
-                with open(entity_type + '_relations.json', 'r') as rel_file:
-                    extracted_relations = json.loads(rel_file.read())
-                    rel_file.close()
+            print("Entities writen in the candidate store:", entities_writen)
+            
+            with stage("ic"):
+                ic_dict = generate_ic_file(run_label, documents_entity_list, build_extrinsic_information_content_dict(corpus_annotations))
 
-                #extracted_relations = import_cdr_relations_pubtator(entity_type)
+        elif write_files:
+            # Create a candidates file for each corpus document
+            entities_writen = 0
+            
+            check_if_dirs_exist(candidates=True, run_label=run_label, dataset=dataset, link_mode=link_mode, keep_files=incremental)
 
-        # Create a candidates file for each corpus document
-        entities_writen = 0
+            with stage("write_candidates"):
+                pbar = tqdm(total= len(documents_entity_list.keys()), colour= 'green', desc='Writing candidates files')
+                linked_ids = dict()
+
+                for document in documents_entity_list:
+                    candidates_filename = "candidates/{}/{}/{}".format(run_label, link_mode, document)
+                    entities_writen += write_candidates(documents_entity_list[document], candidates_filename, entity_type,  ontology_graph, link_mode, extracted_relations, linked_ids=linked_ids)
+                    pbar.update(1)
+            
+                pbar.close()
+            
+            print("Entities writen in the candidates files:", entities_writen)
+            
+            # Create file with the information content of each ontology candidate appearing in candidates files 
+            with stage("ic"):
+                ic_dict = generate_ic_file(run_label, documents_entity_list, build_extrinsic_information_content_dict(corpus_annotations))
         
-        check_if_dirs_exist(candidates=True, run_label=run_label, dataset=dataset, link_mode=link_mode)
+        else:
+            # The links and the information content are only kept in memory
+            entities_linked = 0
+            linked_ids = dict()
 
-        pbar = tqdm(total= len(documents_entity_list.keys()), colour= 'green', desc='Writing candidates files')
+            with stage("links"):
+                
+                for document in tqdm(documents_entity_list, colour= 'green', desc='Linking candidates'):
+                    build_candidate_links(documents_entity_list[document], ontology_graph, link_mode, extracted_relations, 
+                        linked_ids=linked_ids)
+                    entities_linked += len(documents_entity_list[document])
+            
+            print("Entities linked in memory:", entities_linked)
+            
+            with stage("ic"):
+                ic_dict = build_ic_table(documents_entity_list, build_extrinsic_information_content_dict(corpus_annotations))
 
-        for document in documents_entity_list:
-            candidates_filename = "candidates/{}/{}/{}".format(run_label, link_mode, document)
-            entities_writen += write_candidates(documents_entity_list[document], candidates_filename, entity_type,  ontology_graph, link_mode, extracted_relations)
-            pbar.update(1)
-        
-        pbar.close()
-        print("Entities writen in the candidates files:", entities_writen)
+        if isinstance(documents_entity_list, CandidateStore):
+            count("candidate_links", len(documents_entity_list.links))
         
-        # Create file with the information content of each ontology candidate appearing in candidates files 
-        generate_ic_file(run_label, link_mode, annotations)
+        else:
+            count("candidate_links", sum(len(c["links"]) for entity_dict in documents_entity_list.values() 
+                for e in entity_dict for c in entity_dict[e][1:]))
+
+    if write_files or dataset != None: # The results of the datasets include the statistics files
+        check_if_dirs_exist(results=True, run_label=run_label, dataset=dataset, link_mode=link_mode)
 
-    check_if_dirs_exist(results=True, run_label=run_label, dataset=dataset, link_mode=link_mode)
+    print("Total time (aprox.):", int((time.time() - start_time)/60.0), "minutes\n----------------------------------")
 
-    print("Total time (aprox.):", int((time.time() - start_time)/60.0), "minutes\n----------------------------------")   
\ No newline at end of file
+    return documents_entity_list, ic_dict   
\ No newline at end of file
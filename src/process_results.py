@@ -5,67 +5,116 @@ sys.path.append("./")
 
 doc_id = str()
 
-def process_results(target_kb, link_mode, dataset=None, run_label=None, input_file=None, out_dir=None):
-    """ Process the results after the application of the PPR-IC model."""
+def parse_results_file(filename):
+    """Parse the file outputted by ppr_for_ned_all with the answers for each entity.
 
-    results_dict = dict()
-    correct_answers_count, wrong_answers_count, total_answers, no_solution = int(), int(), int(), int()
+    Ensures:
+        answers: is dict, each key is a document id, values are lists of tuples
+            (number_of_mentions, entity_text, correct_answer, answer)
+    """
 
-    in_mode = ''
+    with open(filename, 'r') as results:
+        data = results.readlines()
+        results.close
 
-    if dataset!= None:
-        in_mode = dataset
+    return parse_results_lines(data)
 
-    elif run_label != None:
-        in_mode = run_label
 
-    filename = "results/" + in_mode + "/ppr_ic/" + link_mode + "/all_all"
 
-    with open(filename, 'r') as results:
-        data = results.readlines()
-        results.close
+def parse_results_lines(data):
+    """Parse the lines outputted by ppr_for_ned_all (or by ppr_worker) with the answers for each entity.
 
-    temp_dict = {}
+    Ensures:
+        answers: is dict outputted by parse_results_file
+    """
+
+    answers = dict()
     doc_id = ''
-    first_doc = True
     
     for line in data:
         
         if line != "\n":
             
             if line[0] == "=":
-                
-                if first_doc:
-                    doc_id = line.strip("\n").split(" ")[1]
-                    results_dict[doc_id] = temp_dict
-                    first_doc = False
-                
-                else:
-                    results_dict[doc_id] = temp_dict
-    
                 doc_id = line.strip("\n").split(" ")[1]
-                temp_dict = dict()
+                answers[doc_id] = list()
             
             else:
                 number_of_mentions = int(line.split("\t")[0])
-                total_answers += 1 * number_of_mentions
                 entity_text = line.split("\t")[1].split("=")[1]
                 correct_answer = line.split("\t")[2]
                 answer = line.split("\t")[3].strip("ANS=").strip("\n")
-                
-                if target_kb == 'chebi':
-                    temp_dict[entity_text] = answer.replace('_', ':')
-                
-                elif target_kb == 'ctd_chem' or target_kb == 'medic':
-                    temp_dict[entity_text] = "MESH:" + answer
+                answers[doc_id].append((number_of_mentions, entity_text, correct_answer, answer))
+
+    return answers
 
-                if answer == correct_answer:
-                    correct_answers_count += number_of_mentions* 1
+
+
+def build_results_dict(answers, target_kb):
+    """Map each entity in each document to the chosen KB identifier.
+
+    Requires:
+        answers: is dict outputted by disambiguate_documents or parse_results_file
+        target_kb: is str, either 'chebi', 'ctd_chem' or 'medic'
+
+    Ensures:
+        results_dict: is dict, each key is a document id, values are dicts 
+            with the identifier of the answer for each entity text
+    """
+
+    results_dict = dict()
+
+    for doc_id in answers:
+        temp_dict = dict()
+        
+        for number_of_mentions, entity_text, correct_answer, answer in answers[doc_id]:
                 
-                else:
-                    wrong_answers_count += number_of_mentions* 1
+            if target_kb == 'chebi':
+                temp_dict[entity_text] = answer.replace('_', ':')
+            
+            elif target_kb == 'ctd_chem' or target_kb == 'medic':
+                temp_dict[entity_text] = "MESH:" + answer
+
+        results_dict[doc_id] = temp_dict
+
+    return results_dict
+
+
+
+def process_results(target_kb, link_mode, dataset=None, run_label=None, input_file=None, out_dir=None, answers=None):
+    """ Process the results after the application of the PPR-IC model.
+    
+    Requires:
+        answers: is dict outputted by disambiguate_documents, if None the answers 
+            are read from the file outputted by ppr_for_ned_all
+    """
+
+    correct_answers_count, wrong_answers_count, total_answers, no_solution = int(), int(), int(), int()
+
+    in_mode = ''
 
-    results_dict[doc_id] = temp_dict
+    if dataset!= None:
+        in_mode = dataset
+
+    elif run_label != None:
+        in_mode = run_label
+
+    if answers == None:
+        filename = "results/" + in_mode + "/ppr_ic/" + link_mode + "/all_all"
+        answers = parse_results_file(filename)
+
+    results_dict = build_results_dict(answers, target_kb)
+
+    for doc_id in answers:
+        
+        for number_of_mentions, entity_text, correct_answer, answer in answers[doc_id]:
+            total_answers += 1 * number_of_mentions
+
+            if answer == correct_answer:
+                correct_answers_count += number_of_mentions* 1
+            
+            else:
+                wrong_answers_count += number_of_mentions* 1
 
     if dataset!= None:
         # Import NIL count from baseline statistics file
@@ -0,0 +1,189 @@
+import numpy as np
+import orjson as json
+import os
+import sys
+
+sys.path.append("./")
+
+from src.snapshot import KBSnapshot, build_csr, build_string_pool, snapshot_dir, snapshot_is_current, write_snapshot
+
+
+def relation_store_path(relations_file):
+
+    return "{}/{}_store".format(snapshot_dir, os.path.splitext(os.path.basename(relations_file))[0])
+
+
+
+def compile_relation_store(relations_file):
+    """Compile a relations file into a relation store in 'temp/<relations file name>_store'.
+
+    Requires:
+        relations_file: is str, path of a json file, keys are entities ids and values are
+            lists with the ids of related entities
+
+    Ensures:
+        relation_store: is RelationStore object opened from the compiled store
+    """
+
+    with open(relations_file, "rb") as rel_file:
+        extracted_relations = json.loads(rel_file.read())
+        rel_file.close()
+
+    entity_ids = set(extracted_relations.keys())
+
+    for entity_id in extracted_relations:
+        entity_ids.update(extracted_relations[entity_id])
+
+    entity_ids = sorted(entity_ids)
+    entity_index = {entity_id: i for i, entity_id in enumerate(entity_ids)}
+    sources, targets = [], []
+
+    for entity_id in extracted_relations:
+        i = entity_index[entity_id]
+
+        for related_id in extracted_relations[entity_id]:
+            sources.append(i)
+            targets.append(entity_index[related_id])
+
+    arrays = dict()
+    arrays["node_pool"], arrays["node_offsets"] = build_string_pool(entity_ids)
+    arrays["indptr"], arrays["indices"] = build_csr(np.array(sources, dtype=np.int32),
+        np.array(targets, dtype=np.int32), len(entity_ids))
+    meta = {"entities": len(entity_ids), "relations": len(arrays["indices"])}
+
+    return RelationStore(write_snapshot(relation_store_path(relations_file), relations_file, arrays, meta))
+
+
+
+def load_relation_store(relations_file):
+    """Open the relation store of relations_file, compiling it first if it does not
+    exist or if relations_file changed.
+    """
+
+    if snapshot_is_current(relation_store_path(relations_file), relations_file):
+        return RelationStore(relation_store_path(relations_file))
+
+    return compile_relation_store(relations_file)
+
+
+
+class RelationStore(KBSnapshot):
+    """Extracted relations compiled like the KB snapshots: the entities ids are
+    in a string pool with dense integer ids in lexicographic order and the related
+    entities of each entity are a sorted row of a memory-mapped CSR adjacency.
+
+    It can be used like the dict of extracted relations: store.get(entity_id) is
+    the set of related entities ids.
+    """
+
+    def __init__(self, path):
+        KBSnapshot.__init__(self, path)
+        self.entity_index = None
+        self.kb_index = None # (ontology_graph, dense id in ontology_graph of each entity of the store)
+
+
+    def index(self, entity_id):
+        """Dense id of an entity id, -1 if the entity has no relations."""
+
+        if self.entity_index == None:
+            self.entity_index = {entity_id: i for i, entity_id in enumerate(self.node_ids())}
+
+        return self.entity_index.get(entity_id, -1)
+
+
+    def neighbors(self, entity_id):
+        """Sorted numpy array with the dense ids of the entities related to entity_id."""
+
+        i = self.index(entity_id)
+
+        if i == -1:
+            return self.indices[:0]
+
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+
+    def related(self, entity_id_1, entity_id_2):
+        """Check if there is a relation from entity_id_1 to entity_id_2 (binary search in the row of entity_id_1)."""
+
+        neighbors = self.neighbors(entity_id_1)
+        j = self.index(entity_id_2)
+        position = np.searchsorted(neighbors, j)
+
+        return j != -1 and position < len(neighbors) and neighbors[position] == j
+
+
+    def related_among(self, entity_id, entity_ids):
+        """Get the entities among entity_ids related to entity_id, with a single
+        intersection of sorted arrays.
+
+        Ensures:
+            related_ids: is set with the ids in entity_ids related to entity_id
+        """
+
+        candidates = np.array(sorted(j for j in map(self.index, entity_ids) if j != -1), dtype=np.int32)
+        common = np.intersect1d(self.neighbors(entity_id), candidates, assume_unique=True)
+
+        return set(self.string("node", j) for j in common)
+
+
+    def related_kb_ids(self, entity_id, ontology_graph):
+        """Get the dense ids in the KB of the entities related to entity_id (the entities 
+        of the store are translated to the ids of the KB once, in a single array).
+
+        Requires:
+            ontology_graph: is SnapshotGraph object, the interning table of the KB
+
+        Ensures:
+            related_ids: is numpy array with the KB dense ids of the related entities in the KB
+        """
+
+        if self.kb_index == None or self.kb_index[0] is not ontology_graph:
+            self.kb_index = (ontology_graph, np.array([ontology_graph.index(related_id) 
+                for related_id in self.node_ids()], dtype=np.int32))
+
+        related_ids = self.kb_index[1][self.neighbors(entity_id)]
+
+        return related_ids[related_ids != -1]
+
+
+    def __contains__(self, entity_id):
+
+        return len(self.neighbors(entity_id)) > 0
+
+
+    def __getitem__(self, entity_id):
+
+        if entity_id not in self:
+            raise KeyError(entity_id)
+
+        return self.get(entity_id)
+
+
+    def get(self, entity_id, default=()):
+
+        neighbors = self.neighbors(entity_id)
+
+        if len(neighbors) == 0:
+            return default
+
+        return set(self.string("node", j) for j in neighbors)
+
+
+
+def related_kb_ids(extracted_relations, entity_id, ontology_graph):
+    """Dense ids in the KB of the entities related to entity_id.
+
+    Requires:
+        extracted_relations: is RelationStore object or dict, get(entity_id) is the set with the ids of related entities
+
+    Ensures:
+        related_ids: is set of int
+    """
+
+    if isinstance(extracted_relations, RelationStore):
+        return set(extracted_relations.related_kb_ids(entity_id, ontology_graph).tolist())
+
+    related_ids = set(ontology_graph.index(related_id) for related_id in extracted_relations.get(entity_id, ()))
+    related_ids.discard(-1)
+
+    return related_ids
@@ -1,5 +1,3 @@
-from spacy.lang.en import English
-from spacy.pipeline import Sentencizer
 import os
 import orjson as json
 import sys
@@ -88,7 +86,10 @@ def import_bolstm_output():
 def craft_input_to_bolstm():
         """Convert the documents in the CRAFT corpus to the input structure of BO-LSTM."""
 
-        # Sentence segmentation using Spacy
+        # Sentence segmentation using Spacy (only imported here, it is slow to import)
+        from spacy.lang.en import English
+        from spacy.pipeline import Sentencizer
+
         nlp = English()
         sentencizer = Sentencizer()
         nlp.add_pipe(sentencizer)
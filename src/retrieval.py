@@ -0,0 +1,310 @@
+import numpy as np
+import scipy.sparse as sp
+import sys
+
+from rapidfuzz import fuzz, process, utils
+
+sys.path.append("./")
+
+from src.snapshot import add_snapshot_arrays, build_string_pool, kb_source_files, open_snapshot
+
+
+# Character n-gram TF-IDF index over the names and synonyms of a KB, used to
+# select a shortlist of strings for each entity mention before the ranking with
+# fuzz.token_sort_ratio. The shortlist is approximate: strings with a high
+# token_sort_ratio but a low n-gram similarity are left out, so the top 10 of
+# 'ngram' retrieval can differ from the full ranking of 'cdist' and 'none'
+# (it is only used when requested with retrieval='ngram')
+ngram_size = 3
+shortlist_size = 200 # strings kept for each mention among names and among synonyms
+batch_size = 256 # mentions scored in each sparse matrix product
+cdist_max_scores = 2 ** 24 # maximum size of each score matrix calculated by process.cdist
+
+ngram_indexes = dict()
+
+
+def sort_tokens(text):
+    """Preprocessing of fuzz.token_sort_ratio: lowercase, no punctuation and sorted tokens."""
+
+    return " ".join(sorted(utils.default_process(text).split()))
+
+
+
+def text_ngrams(text):
+    """Character n-grams of the text after the same preprocessing as the fuzzy matching."""
+
+    text = " " + sort_tokens(text) + " "
+
+    return [text[i:i + ngram_size] for i in range(max(len(text) - ngram_size + 1, 1))]
+
+
+
+def vectorize(texts, vocabulary, idf=None, update_vocabulary=False):
+    """TF-IDF matrix of the texts with rows normalized to unit length.
+
+    Requires:
+        texts: is iterable of str
+        vocabulary: is dict with the column of each n-gram
+        idf: is numpy array with the inverse document frequency of each n-gram
+            (if None the raw counts are returned)
+        update_vocabulary: is bool, if True n-grams not in vocabulary are added to it,
+            otherwise they are ignored
+
+    Ensures:
+        matrix: is CSR matrix with one row for each text
+    """
+
+    indptr, indices = [0], []
+
+    for text in texts:
+
+        for ngram in text_ngrams(text):
+            column = vocabulary.get(ngram)
+
+            if column == None and update_vocabulary:
+                column = len(vocabulary)
+                vocabulary[ngram] = column
+
+            if column != None:
+                indices.append(column)
+
+        indptr.append(len(indices))
+
+    matrix = sp.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr),
+        shape=(len(indptr) - 1, len(vocabulary)))
+    matrix.sum_duplicates()
+
+    if idf is None:
+        return matrix
+
+    matrix = matrix @ sp.diags(idf.astype(np.float32))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+
+    return (sp.diags(1.0 / norms) @ matrix).tocsr().astype(np.float32)
+
+
+
+class NgramIndex:
+    """TF-IDF matrix of the names (first rows) and synonyms of a KB."""
+
+    def __init__(self, vocabulary, idf, matrix, n_names):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.matrix = matrix
+        self.n_names = n_names
+        self.matrix_t = None
+
+
+    def shortlist(self, texts):
+        """Select the names and synonyms with the highest cosine similarity to each text.
+
+        Requires:
+            texts: is list of str
+
+        Ensures:
+            shortlists: is list with a tuple (name_rows, synonym_rows) for each text, the rows of the
+                'shortlist_size' most similar names and synonyms in ascending order
+        """
+
+        shortlists = []
+
+        if self.matrix_t is None:
+            self.matrix_t = self.matrix.T.tocsr()
+
+        for start in range(0, len(texts), batch_size):
+            queries = vectorize(texts[start:start + batch_size], self.vocabulary, self.idf)
+            scores = (queries @ self.matrix_t).tocsr()
+
+            for row in range(scores.shape[0]):
+                columns = scores.indices[scores.indptr[row]:scores.indptr[row + 1]]
+                values = scores.data[scores.indptr[row]:scores.indptr[row + 1]]
+                is_name = columns < self.n_names
+                shortlists.append((top_rows(columns[is_name], values[is_name]),
+                    top_rows(columns[~is_name] - self.n_names, values[~is_name])))
+
+        return shortlists
+
+
+
+def top_rows(columns, values):
+
+    if len(columns) > shortlist_size:
+        columns = columns[np.argpartition(-values, shortlist_size)[:shortlist_size]]
+
+    return np.sort(columns)
+
+
+
+def build_ngram_index(names, synonyms):
+
+    vocabulary = dict()
+    counts = vectorize(list(names) + list(synonyms), vocabulary, update_vocabulary=True)
+    document_frequency = np.bincount(counts.indices, minlength=len(vocabulary))
+    idf = np.log((1 + counts.shape[0]) / (1 + document_frequency)) + 1
+    matrix = vectorize(list(names) + list(synonyms), vocabulary, idf)
+
+    return NgramIndex(vocabulary, idf, matrix, len(names))
+
+
+
+def load_ngram_index(kb_name):
+    """Load the n-gram index stored with the snapshot of the KB or build it and
+    store it in the snapshot directory.
+
+    Ensures:
+        ngram_index: is NgramIndex object or None if the KB has no snapshot
+    """
+
+    if kb_name in ngram_indexes:
+        return ngram_indexes[kb_name]
+
+    snapshot = open_snapshot(kb_name, kb_source_files[kb_name])
+
+    if snapshot == None:
+        return None
+
+    try:
+        vocabulary = {ngram: i for i, ngram in enumerate(snapshot.strings("ngram"))}
+        matrix = sp.csr_matrix((snapshot.ngram_data, snapshot.ngram_indices, snapshot.ngram_indptr),
+            shape=(len(snapshot.ngram_indptr) - 1, len(vocabulary)))
+        ngram_index = NgramIndex(vocabulary, np.asarray(snapshot.ngram_idf), matrix, snapshot.meta["names"])
+
+    except AttributeError: # The index was not built yet for this snapshot
+        ngram_index = build_ngram_index(snapshot.strings("name"), snapshot.strings("synonym"))
+        ngram_pool, ngram_offsets = build_string_pool(ngram_index.vocabulary.keys())
+        arrays = {"ngram_pool": ngram_pool, "ngram_offsets": ngram_offsets, "ngram_idf": ngram_index.idf,
+            "ngram_data": ngram_index.matrix.data, "ngram_indices": ngram_index.matrix.indices,
+            "ngram_indptr": ngram_index.matrix.indptr}
+
+        # The pool is written last, it marks the index as complete
+        add_snapshot_arrays(snapshot.path, arrays, "ngram_pool")
+
+    ngram_indexes[kb_name] = ngram_index
+
+    return ngram_index
+
+
+
+def shortlist_choices(kb_name, entity_texts, name_to_id, synonym_to_id):
+    """Select with the n-gram index the names and synonyms of the KB to compare with each entity text.
+
+    Requires:
+        kb_name: is str, either 'chebi', 'ctd_chem' or 'medic'
+        entity_texts: is list of str
+        name_to_id, synonym_to_id: are the dicts returned by the KB loader (same order as in the snapshot)
+
+    Ensures:
+        choices: is dict, each key is an entity text and values are tuples (names, synonyms) of dicts
+            {position in name_to_id (or synonym_to_id): string}, None if all the strings must be compared
+    """
+
+    ngram_index = load_ngram_index(kb_name)
+    choices = dict()
+
+    if ngram_index == None or ngram_index.n_names != len(name_to_id) \
+            or ngram_index.matrix.shape[0] != len(name_to_id) + len(synonym_to_id):
+        return choices
+
+    names, synonyms = list(name_to_id.keys()), list(synonym_to_id.keys())
+
+    for entity_text, (name_rows, synonym_rows) in zip(entity_texts, ngram_index.shortlist(entity_texts)):
+
+        # With less than 10 similar strings the top 10 also includes unrelated strings
+        if len(name_rows) < 10 or len(synonym_rows) < 10:
+            choices[entity_text] = None
+
+        else:
+            choices[entity_text] = ({int(i): names[i] for i in name_rows}, {int(i): synonyms[i] for i in synonym_rows})
+
+    return choices
+
+
+
+def cdist_matches(entity_texts, choices, score_cutoff=0, limit=10):
+    """Best matches of each entity text among all choices according to fuzz.token_sort_ratio, 
+    calculated with process.cdist in all CPU cores. The choices are preprocessed only once.
+
+    Requires:
+        entity_texts: is list of str
+        choices: is list of str
+        score_cutoff: is float, matches with lower score are not returned
+
+    Ensures:
+        matches: is list with the matches of each entity text, the same tuples 
+            (choice, score, position) returned by process.extract
+    """
+
+    processed_choices = [sort_tokens(choice) for choice in choices]
+    queries = [sort_tokens(entity_text) for entity_text in entity_texts]
+    rows = max(1, cdist_max_scores // max(len(choices), 1))
+    matches = []
+
+    for start in range(0, len(queries), rows):
+        scores = process.cdist(queries[start:start + rows], processed_choices, scorer=fuzz.ratio, 
+            score_cutoff=score_cutoff, workers=-1, dtype=np.float64)
+
+        for row in scores:
+            columns = np.flatnonzero(row >= score_cutoff) if score_cutoff > 0 else np.arange(len(row))
+
+            if len(columns) > limit: # Keep every choice tied with the last one before sorting
+                last_score = np.partition(row[columns], len(columns) - limit)[len(columns) - limit]
+                columns = columns[row[columns] >= last_score]
+
+            columns = columns[np.lexsort((columns, -row[columns]))][:limit]
+            matches.append([(choices[i], float(row[i]), int(i)) for i in columns])
+
+    return matches
+
+
+
+def batch_matches(kb_name, entity_texts, name_to_id, synonym_to_id, retrieval="cdist", score_cutoff=0):
+    """Retrieve at once the best names and synonyms of the KB for each entity text.
+
+    Requires:
+        kb_name: is str, either 'chebi', 'ctd_chem' or 'medic'
+        entity_texts: is list of str
+        name_to_id, synonym_to_id: are the dicts returned by the KB loader
+        retrieval: is str, 'cdist' (rank all names and synonyms with process.cdist, same top 10 as
+            process.extract) or 'ngram' (approximate, rank only the names and synonyms shortlisted 
+            by the n-gram index)
+        score_cutoff: is float, in 'cdist' retrieval matches with lower score are not returned
+
+    Ensures:
+        matches: is dict, each key is an entity text and values are tuples (name_matches, synonym_matches), 
+            synonym_matches is None if there is a name with score 100. Entity texts that must 
+            be compared with all names and synonyms one at a time are not included
+    """
+
+    matches = dict()
+
+    if retrieval == "ngram":
+        choices = shortlist_choices(kb_name, entity_texts, name_to_id, synonym_to_id)
+
+        for entity_text in choices:
+
+            if choices[entity_text] != None:
+                names, synonyms = choices[entity_text]
+                name_matches = process.extract(entity_text, names, scorer=fuzz.token_sort_ratio, 
+                    processor=utils.default_process, limit=10)
+                synonym_matches = None
+
+                if name_matches[0][1] < 100:
+                    synonym_matches = process.extract(entity_text, synonyms, scorer=fuzz.token_sort_ratio, 
+                        processor=utils.default_process, limit=10)
+
+                matches[entity_text] = (name_matches, synonym_matches)
+
+    elif retrieval == "cdist":
+        names_matches = cdist_matches(entity_texts, list(name_to_id.keys()), score_cutoff=score_cutoff)
+        
+        # Synonyms are only needed if there is no exact match with a name
+        synonym_texts = [entity_text for entity_text, name_matches in zip(entity_texts, names_matches) 
+            if len(name_matches) == 0 or name_matches[0][1] < 100]
+        synonyms_matches = dict(zip(synonym_texts, 
+            cdist_matches(synonym_texts, list(synonym_to_id.keys()), score_cutoff=score_cutoff)))
+
+        for entity_text, name_matches in zip(entity_texts, names_matches):
+            matches[entity_text] = (name_matches, synonyms_matches.get(entity_text))
+
+    return matches
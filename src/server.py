@@ -0,0 +1,310 @@
+import orjson as json
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.append("./")
+
+from src.annotations import build_input_annotations
+from src.ppr import disambiguate_documents
+from src.ppr_java import JavaPprWorker
+from src.pre_process import link_annotations, load_extracted_relations, load_target_kb
+from src.process_results import build_results_dict
+
+
+class LinkingService:
+    """Keep the target KB and the extracted relations in memory and link the
+    entities of each request with the PPR-IC model.
+    """
+
+    def __init__(self, target_kb, link_mode, retrieval="cdist", ppr_engine="python"):
+        self.target_kb = target_kb
+        self.link_mode = link_mode
+        self.retrieval = retrieval
+
+        self.ontology_graph, self.name_to_id, self.synonym_to_id, entity_type = load_target_kb(target_kb)
+        self.extracted_relations = load_extracted_relations(target_kb, entity_type, link_mode)
+
+        # With the 'java_worker' engine one JVM is kept alive for all the requests
+        self.java_worker, self.disambiguate = None, disambiguate_documents
+
+        if ppr_engine == "java_worker":
+            self.java_worker = JavaPprWorker(entity_type, link_mode)
+            self.disambiguate = self.java_worker.disambiguate_documents
+
+        self.start_time = time.time()
+        self.requests, self.documents, self.mentions = 0, 0, 0
+        self.total_latency, self.max_latency = 0.0, 0.0
+
+
+    def link(self, in_annotations):
+        """Link the entities in a request.
+
+        Requires:
+            in_annotations: is dict, each key is a document id, values are
+                lists with the entities text, e.g. {"doc_id": ["entity_text_1", "entity_text_2"]}
+
+        Ensures:
+            results_dict: is dict outputted by build_results_dict
+        """
+
+        start = time.time()
+
+        annotations = build_input_annotations(in_annotations)
+        answers = link_annotations(annotations, self.target_kb, self.link_mode, self.ontology_graph,
+            self.name_to_id, self.synonym_to_id, self.extracted_relations, retrieval=self.retrieval,
+            disambiguate=self.disambiguate)
+        results_dict = build_results_dict(answers, self.target_kb)
+
+        latency = time.time() - start
+        self.requests += 1
+        self.documents += len(in_annotations)
+        self.mentions += sum(len(in_annotations[doc_id]) for doc_id in in_annotations)
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+        return results_dict
+
+
+    def stats(self):
+        """Counters since the service started."""
+
+        mean_latency, throughput = 0.0, 0.0
+
+        if self.requests > 0:
+            mean_latency = self.total_latency / self.requests
+
+        if self.total_latency > 0:
+            throughput = self.mentions / self.total_latency
+
+        return {"target_kb": self.target_kb, "link_mode": self.link_mode,
+            "uptime": time.time() - self.start_time, "requests": self.requests,
+            "documents": self.documents, "mentions": self.mentions,
+            "mean_latency": mean_latency, "max_latency": self.max_latency,
+            "mentions_per_second": throughput}
+
+
+    def close(self):
+
+        if self.java_worker != None:
+            self.java_worker.close()
+
+
+
+def valid_request(in_annotations):
+    """Check that a request has the format {"doc_id": ["entity_text_1", ...]}."""
+
+    return isinstance(in_annotations, dict) and all(isinstance(entities, list) 
+        and all(isinstance(entity_text, str) for entity_text in entities) for entities in in_annotations.values())
+
+
+
+def build_request_handler(service):
+    """Request handler class with POST /link and GET /stats endpoints."""
+
+    class LinkingRequestHandler(BaseHTTPRequestHandler):
+
+        def send_json(self, status, output):
+            output = json.dumps(output)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(output)))
+            self.end_headers()
+            self.wfile.write(output)
+
+
+        def do_GET(self):
+
+            if self.path == "/stats":
+                self.send_json(200, service.stats())
+
+            else:
+                self.send_json(404, {"error": "not found"})
+
+
+        def do_POST(self):
+
+            if self.path != "/link":
+                self.send_json(404, {"error": "not found"})
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+
+            try:
+                in_annotations = json.loads(self.rfile.read(length) or b"{}")
+
+            except json.JSONDecodeError:
+                self.send_json(400, {"error": "invalid JSON"})
+                return
+
+            if not valid_request(in_annotations):
+                self.send_json(400, {"error": "expected an object {'doc_id': ['entity_text_1', ...]}"})
+                return
+
+            try:
+                results_dict = service.link(in_annotations)
+
+            except Exception as error: # The service keeps answering the next requests
+                self.send_json(500, {"error": "{}: {}".format(type(error).__name__, error)})
+                return
+
+            self.send_json(200, results_dict)
+
+
+        def log_message(self, format, *args):
+            pass
+
+    return LinkingRequestHandler
+
+
+
+def serve(target_kb, link_mode, host="127.0.0.1", port=8000, retrieval="cdist", ppr_engine="python"):
+    """Load the target KB once and answer linking requests over HTTP until interrupted.
+
+    Requires:
+        target_kb: is str, either 'chebi', 'ctd_chem' or 'medic'
+        link_mode: is str specifying how the edges in disambiguation graph are built ('kb_link', 'corpus_link', 'kb_corpus_link')
+    """
+
+    service = LinkingService(target_kb, link_mode, retrieval=retrieval, ppr_engine=ppr_engine)
+    httpd = HTTPServer((host, port), build_request_handler(service))
+    print("Serving {} ({}) on http://{}:{}".format(target_kb, link_mode, host, port))
+
+    try:
+        httpd.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    httpd.server_close()
+    service.close()
+    print(json.dumps(service.stats()).decode("utf-8"))
+
+
+
+def link_window(service, requests, out_stream):
+    """Link the documents of several requests at once and write one JSON line 
+    with the results of each request.
+
+    Requires:
+        requests: is list of dicts {"doc_id": ["entity_text_1", ...]} (None for invalid requests), 
+            without repeated document ids
+
+    If the window cannot be linked, the line of each valid request is {"error": ...}.
+    """
+
+    in_annotations = dict()
+
+    for request in requests:
+
+        if request != None:
+            in_annotations.update(request)
+
+    results_dict, window_error = {}, None
+
+    try:
+        results_dict = service.link(in_annotations) if len(in_annotations) > 0 else {}
+
+    except Exception as error: # The requests of the window get an error line, the stream continues
+        window_error = {"error": "{}: {}".format(type(error).__name__, error)}
+
+    for request in requests:
+        output = {"error": "invalid request"}
+
+        if request != None:
+            output = window_error or {doc_id: results_dict.get(doc_id, {}) for doc_id in request}
+
+        out_stream.write(json.dumps(output).decode("utf-8") + "\n")
+
+    out_stream.flush()
+
+
+
+def link_stream(service, in_stream, out_stream, window_size=1):
+    """Link the documents of a JSON lines stream: each line is a request 
+    {"doc_id": ["entity_text_1", ...]} and one line with its results is written 
+    for each line, in the same order.
+
+    The lines are linked in windows of window_size lines, so the memory used
+    depends on the window and not on the length of the stream. The documents
+    are disambiguated independently, so the results are the same as when the
+    whole corpus is linked at once.
+
+    Ensures:
+        lines: is int, the number of lines answered
+    """
+
+    window, window_ids, lines = [], set(), 0
+
+    for line in in_stream:
+
+        if line.strip() == "":
+            continue
+
+        try:
+            request = json.loads(line)
+
+            if not valid_request(request):
+                request = None
+
+        except json.JSONDecodeError:
+            request = None
+
+        # A document id repeated in a later line is linked in the next window
+        if request != None and not window_ids.isdisjoint(request.keys()):
+            link_window(service, window, out_stream)
+            lines += len(window)
+            window, window_ids = [], set()
+
+        window.append(request)
+        window_ids.update(request.keys() if request != None else ())
+
+        if len(window) >= window_size:
+            link_window(service, window, out_stream)
+            lines += len(window)
+            window, window_ids = [], set()
+
+    if len(window) > 0:
+        link_window(service, window, out_stream)
+        lines += len(window)
+
+    return lines
+
+
+
+def serve_stdin(target_kb, link_mode, in_stream=sys.stdin, out_stream=sys.stdout, retrieval="cdist", ppr_engine="python"):
+    """Load the target KB once and answer each JSON line read from stdin with
+    a JSON line with the results.
+    """
+
+    service = LinkingService(target_kb, link_mode, retrieval=retrieval, ppr_engine=ppr_engine)
+    link_stream(service, in_stream, out_stream)
+    service.close()
+    sys.stderr.write(json.dumps(service.stats()).decode("utf-8") + "\n")
+
+
+
+def stream_file(target_kb, link_mode, input_file, out_filename, window_size=256, retrieval="cdist", ppr_engine="python"):
+    """Link the documents of a JSON lines file (one request per line) and write
+    the results to a JSON lines file, one line for each input line.
+
+    Requires:
+        input_file: is str, path of the input file, '-' to read from stdin
+        out_filename: is str, path of the output file
+        window_size: is int, number of lines linked at once
+    """
+
+    service = LinkingService(target_kb, link_mode, retrieval=retrieval, ppr_engine=ppr_engine)
+    in_stream = sys.stdin if input_file == "-" else open(input_file, "r")
+
+    with open(out_filename, "w") as out_stream:
+        lines = link_stream(service, in_stream, out_stream, window_size=window_size)
+        out_stream.close()
+
+    if in_stream != sys.stdin:
+        in_stream.close()
+
+    service.close()
+
+    print("Lines linked:", lines)
+    print(json.dumps(service.stats()).decode("utf-8"))
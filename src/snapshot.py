@@ -0,0 +1,570 @@
+import hashlib
+import numpy as np
+import orjson as json
+import os
+import shutil
+import sys
+from collections.abc import Mapping
+
+sys.path.append("./")
+
+
+# Compiled KB snapshots: each KB is stored in the directory 'temp/<kb>_snapshot'
+# as a set of .npy arrays that are opened with mmap, so the pages are shared
+# between processes using the same snapshot
+snapshot_dir = "temp"
+snapshot_version = 1
+kb_source_files = {"chebi": "chebi.obo", "medic": "CTD_diseases.obo", "ctd_chem": "CTD_chemicals.tsv"}
+
+
+def file_hash(filepath):
+    """SHA-256 hex digest of the contents of a file."""
+
+    digest = hashlib.sha256()
+
+    with open(filepath, "rb") as in_file:
+
+        for block in iter(lambda: in_file.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+
+def snapshot_path(kb_name):
+
+    return "{}/{}_snapshot".format(snapshot_dir, kb_name)
+
+
+
+def build_string_pool(strings):
+    """Encode a list of strings as a single '\\0' separated byte array.
+
+    Ensures:
+        pool: is numpy uint8 array with the encoded strings, each followed by '\\0'
+        offsets: is numpy int64 array, string i is pool[offsets[i]:offsets[i + 1] - 1]
+    """
+
+    encoded = [string.encode("utf-8") + b"\0" for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    pool = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    return pool, offsets
+
+
+
+def build_csr(sources, targets, n_nodes):
+    """CSR adjacency with the sorted and unique targets of each source node."""
+
+    edges = np.unique(np.stack([sources, targets], axis=1), axis=0) if len(sources) > 0 else np.zeros((0, 2), dtype=np.int32)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edges[:, 0], minlength=n_nodes), out=indptr[1:])
+
+    return indptr, edges[:, 1].astype(np.int32)
+
+
+
+def compile_snapshot(kb_name, source_file, edge_list, name_to_id, synonym_to_id):
+    """Compile the structures of a KB into a snapshot stored in 'temp/<kb_name>_snapshot'.
+
+    Requires:
+        kb_name: is str, the name of the KB ('chebi', 'medic' or 'ctd_chem')
+        source_file: is str, the path of the file from where the KB was loaded
+        edge_list: is list of tuples (concept id, parent id) with the is-a relations of the KB
+            (repeated relations are counted in the degrees)
+        name_to_id: is dict with mappings between each concept name and the respective id
+        synonym_to_id: is dict with mappings between each synonym and the respective id
+
+    Ensures:
+        snapshot: is KBSnapshot object opened from the compiled snapshot
+    """
+
+    # Dense ids: every concept in a relation and every id with a name or synonym, in lexicographic order
+    node_ids = set(edge[0] for edge in edge_list)
+    node_ids.update(edge[1] for edge in edge_list)
+    node_ids.update(name_to_id.values())
+    node_ids.update(synonym_to_id.values())
+    node_ids = sorted(node_ids)
+    node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+    n_nodes = len(node_ids)
+
+    arrays = dict()
+    arrays["node_pool"], arrays["node_offsets"] = build_string_pool(node_ids)
+
+    # The order of the names and synonyms is kept, so the candidates retrieved
+    # with ties in the lexical similarity are the same
+    arrays["name_pool"], arrays["name_offsets"] = build_string_pool(name_to_id.keys())
+    arrays["name_node"] = np.array([node_index[node_id] for node_id in name_to_id.values()], dtype=np.int32)
+    arrays["synonym_pool"], arrays["synonym_offsets"] = build_string_pool(synonym_to_id.keys())
+    arrays["synonym_node"] = np.array([node_index[node_id] for node_id in synonym_to_id.values()], dtype=np.int32)
+
+    sources = np.array([node_index[edge[0]] for edge in edge_list], dtype=np.int32)
+    targets = np.array([node_index[edge[1]] for edge in edge_list], dtype=np.int32)
+    arrays["out_indptr"], arrays["out_indices"] = build_csr(sources, targets, n_nodes)
+    arrays["in_indptr"], arrays["in_indices"] = build_csr(targets, sources, n_nodes)
+
+    # Degrees count repeated edges
+    arrays["out_degree"] = np.bincount(sources, minlength=n_nodes).astype(np.int32)
+    arrays["in_degree"] = np.bincount(targets, minlength=n_nodes).astype(np.int32)
+
+    meta = {"kb": kb_name, "nodes": n_nodes, "names": len(name_to_id),
+        "synonyms": len(synonym_to_id), "edges": len(sources)}
+
+    return KBSnapshot(write_snapshot(snapshot_path(kb_name), source_file, arrays, meta))
+
+
+
+def write_snapshot(path, source_file, arrays, meta):
+    """Save the arrays of a snapshot compiled from source_file in the directory path.
+
+    The snapshot is written to a temporary directory first and then renamed, so
+    that other processes never open an incomplete snapshot.
+
+    Requires:
+        arrays: is dict, each key is the name of a numpy array
+        meta: is dict with the properties of the snapshot, the version and the 
+            size, modification time and hash of source_file are added to it
+
+    Ensures:
+        path: is str, the directory of the snapshot
+    """
+
+    source_stat = os.stat(source_file)
+    meta = dict(meta, version=snapshot_version, source_file=source_file, source_hash=file_hash(source_file),
+        source_size=source_stat.st_size, source_mtime=source_stat.st_mtime)
+
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    os.makedirs(tmp_path, exist_ok=True)
+
+    for array_name in arrays:
+        np.save("{}/{}.npy".format(tmp_path, array_name), arrays[array_name])
+
+    with open(tmp_path + "/meta.json", "wb") as meta_file:
+        meta_file.write(json.dumps(meta))
+        meta_file.close()
+
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+    os.rename(tmp_path, path)
+
+    return path
+
+
+
+def add_snapshot_arrays(path, arrays, last_array):
+    """Store arrays built after the snapshot in the directory path was compiled (e.g. an index).
+    Each array is written to a temporary file and renamed, last_array is written last 
+    and marks the arrays as complete.
+    """
+
+    for array_name in sorted(arrays, key=lambda array_name: array_name == last_array):
+        tmp_filename = "{}/{}.{}.tmp.npy".format(path, array_name, os.getpid())
+        np.save(tmp_filename, arrays[array_name])
+        os.replace(tmp_filename, "{}/{}.npy".format(path, array_name))
+
+
+
+def snapshot_is_current(path, source_file):
+    """Check if the snapshot in the directory path was compiled from the current version of source_file.
+
+    The snapshot is current if the hash of source_file matches the hash stored in
+    the snapshot (the hash is only calculated if the size or the modification
+    time of the file changed).
+    """
+
+    meta_filename = path + "/meta.json"
+
+    if not os.path.isfile(meta_filename) or not os.path.isfile(source_file):
+        return False
+
+    with open(meta_filename, "rb") as meta_file:
+        meta = json.loads(meta_file.read())
+        meta_file.close()
+
+    if meta.get("version") != snapshot_version:
+        return False
+
+    source_stat = os.stat(source_file)
+
+    if source_stat.st_size != meta["source_size"] or source_stat.st_mtime != meta["source_mtime"]:
+
+        if source_stat.st_size != meta["source_size"] or file_hash(source_file) != meta["source_hash"]:
+            return False
+
+    return True
+
+
+
+def open_snapshot(kb_name, source_file):
+    """Open the snapshot of a KB if it was compiled from the current version of source_file.
+
+    Ensures:
+        snapshot: is KBSnapshot object or None if there is no valid snapshot
+    """
+
+    if not snapshot_is_current(snapshot_path(kb_name), source_file):
+        return None
+
+    return KBSnapshot(snapshot_path(kb_name))
+
+
+
+class KBSnapshot:
+    """Read-only view of a compiled KB snapshot, the arrays are memory-mapped."""
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path + "/meta.json", "rb") as meta_file:
+            self.meta = json.loads(meta_file.read())
+            meta_file.close()
+
+        self.arrays = dict()
+
+
+    def __getattr__(self, array_name):
+        # Arrays are only mapped when first needed
+        if array_name.startswith("__") or array_name in ("path", "meta", "arrays"):
+            raise AttributeError(array_name)
+
+        if array_name not in self.arrays:
+            filename = "{}/{}.npy".format(self.path, array_name)
+
+            if not os.path.isfile(filename):
+                raise AttributeError(array_name)
+
+            self.arrays[array_name] = np.load(filename, mmap_mode="r")
+
+        return self.arrays[array_name]
+
+
+    def strings(self, pool_name):
+        """Decode all the strings of a string pool ('node', 'name' or 'synonym')."""
+
+        pool = getattr(self, pool_name + "_pool")
+
+        return pool.tobytes().decode("utf-8").split("\0")[:-1]
+
+
+    def string(self, pool_name, i):
+        """Decode string i of a string pool."""
+
+        pool = getattr(self, pool_name + "_pool")
+        offsets = getattr(self, pool_name + "_offsets")
+
+        return pool[offsets[i]:offsets[i + 1] - 1].tobytes().decode("utf-8")
+
+
+    def node_index(self, node_id):
+        """Dense id of a KB id (binary search in the sorted node string pool), -1 if it does not exist."""
+
+        low, high = 0, len(self.node_offsets) - 1
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.string("node", middle) < node_id:
+                low = middle + 1
+
+            else:
+                high = middle
+
+        if low < len(self.node_offsets) - 1 and self.string("node", low) == node_id:
+            return low
+
+        return -1
+
+
+    def node_ids(self):
+        """List with the KB id of each dense id."""
+
+        return self.strings("node")
+
+
+    def name_to_id(self):
+
+        node_ids = self.node_ids()
+
+        return dict(zip(self.strings("name"), (node_ids[i] for i in self.name_node.tolist())))
+
+
+    def synonym_to_id(self):
+
+        node_ids = self.node_ids()
+
+        return dict(zip(self.strings("synonym"), (node_ids[i] for i in self.synonym_node.tolist())))
+
+
+    def graph(self):
+
+        return SnapshotGraph(self)
+
+
+
+class KBResource:
+    """Components of a KB opened from its snapshot, each one materialized on first use:
+    the graph decodes the KB ids (and maps the CSR arrays) when first queried, the degrees
+    are read from the precomputed degree arrays, the names and synonyms dicts are decoded 
+    on the first lookup and the index of normalized forms is read from the snapshot
+    on the first exact match (see load_normalized_index).
+
+    It unpacks like the tuple (ontology_graph, name_to_id, synonym_to_id).
+    """
+
+    __slots__ = ("kb_name", "snapshot", "graph", "name_to_id", "synonym_to_id")
+
+    def __init__(self, kb_name, snapshot):
+        self.kb_name = kb_name
+        self.snapshot = snapshot
+        self.graph = SnapshotGraph(snapshot)
+        self.name_to_id = SnapshotStrings(self.graph, "name")
+        self.synonym_to_id = SnapshotStrings(self.graph, "synonym")
+
+
+    def __iter__(self):
+
+        return iter((self.graph, self.name_to_id, self.synonym_to_id))
+
+
+
+class SnapshotStrings(Mapping):
+    """Read-only dict of the names (or synonyms) of a KB snapshot to the respective KB ids,
+    decoded from the string pool on the first lookup. The size is read from the metadata.
+    """
+
+    __slots__ = ("graph", "pool_name", "mapping")
+
+    def __init__(self, graph, pool_name):
+        self.graph = graph
+        self.pool_name = pool_name
+        self.mapping = None
+
+
+    def materialize(self):
+
+        if self.mapping == None:
+            node_ids = self.graph.node_ids
+            nodes = getattr(self.graph.snapshot, self.pool_name + "_node").tolist()
+            self.mapping = dict(zip(self.graph.snapshot.strings(self.pool_name), (node_ids[i] for i in nodes)))
+
+        return self.mapping
+
+
+    def __len__(self):
+
+        return self.graph.snapshot.meta[self.pool_name + "s"]
+
+
+    def __getitem__(self, string):
+
+        return self.materialize()[string]
+
+
+    def __iter__(self):
+
+        return iter(self.materialize())
+
+
+    def __contains__(self, string):
+
+        return string in self.materialize()
+
+
+    def keys(self):
+
+        return self.materialize().keys()
+
+
+    def values(self):
+
+        return self.materialize().values()
+
+
+    def items(self):
+
+        return self.materialize().items()
+
+
+
+class SnapshotGraph:
+    """Ontology graph backed by the CSR arrays of a KBSnapshot: the is-a relations
+    go from each concept to its parents (forward adjacency) and from each concept
+    to its children (reverse adjacency), the degrees are precomputed arrays.
+
+    It is also the interning table of the KB: each KB id is mapped once to its
+    dense id (the position in the sorted node string pool), used as the id of
+    the candidates and of the links between them.
+    """
+
+    __slots__ = ("snapshot", "id_list", "id_index")
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.id_list, self.id_index = None, None # decoded on first use
+
+
+    @property
+    def node_ids(self):
+        """List with the KB id of each dense id."""
+
+        if self.id_list == None:
+            self.id_list = self.snapshot.node_ids()
+
+        return self.id_list
+
+
+    @property
+    def node_index(self):
+        """Dict with the dense id of each KB id."""
+
+        if self.id_index == None:
+            self.id_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+
+        return self.id_index
+
+
+    def index(self, node_id):
+        """Dense id of a KB id, -1 if it is not in the KB."""
+
+        return self.node_index.get(node_id, -1)
+
+
+    def node_id(self, i):
+        """KB id of a dense id."""
+
+        return self.node_ids[i]
+
+
+    def __contains__(self, node_id):
+
+        return node_id in self.node_index
+
+
+    def __len__(self):
+
+        return self.snapshot.meta["nodes"]
+
+
+    def nodes(self):
+
+        return self.node_index.keys()
+
+
+    def number_of_edges(self):
+        """Number of is-a relations (repeated relations included)."""
+
+        return int(self.snapshot.out_degree.sum())
+
+
+    def out_degree(self, node_id):
+        """Number of is-a relations from node_id to its parents (0 if node_id is not in the KB)."""
+
+        if node_id not in self.node_index:
+            return 0
+
+        return int(self.snapshot.out_degree[self.node_index[node_id]])
+
+
+    def in_degree(self, node_id):
+        """Number of is-a relations from the children of node_id (0 if node_id is not in the KB)."""
+
+        if node_id not in self.node_index:
+            return 0
+
+        return int(self.snapshot.in_degree[self.node_index[node_id]])
+
+
+    def degree(self, node_id):
+        """Number of is-a relations of node_id, to its parents and from its children."""
+
+        return self.out_degree(node_id) + self.in_degree(node_id)
+
+
+    def neighbors(self, node_id):
+        """Parents of node_id."""
+
+        return self.successors(node_id)
+
+
+    def successors(self, node_id):
+
+        i = self.node_index[node_id]
+        indptr, indices = self.snapshot.out_indptr, self.snapshot.out_indices
+
+        return [self.node_ids[j] for j in indices[indptr[i]:indptr[i + 1]]]
+
+
+    def predecessors(self, node_id):
+
+        i = self.node_index[node_id]
+        indptr, indices = self.snapshot.in_indptr, self.snapshot.in_indices
+
+        return [self.node_ids[j] for j in indices[indptr[i]:indptr[i + 1]]]
+
+
+    def has_edge(self, source_id, target_id):
+
+        if source_id not in self.node_index or target_id not in self.node_index:
+            return False
+
+        i, j = self.node_index[source_id], self.node_index[target_id]
+        indptr, indices = self.snapshot.out_indptr, self.snapshot.out_indices
+        neighbors = indices[indptr[i]:indptr[i + 1]]
+        position = np.searchsorted(neighbors, j)
+
+        return position < len(neighbors) and neighbors[position] == j
+
+
+    def reachable(self, node_id, indptr, indices):
+        """Dense ids of the nodes reachable from node_id in the CSR adjacency (indptr, indices),
+        without node_id. Each step visits the adjacency rows of the whole frontier at once.
+        """
+
+        visited = np.zeros(len(self.node_ids), dtype=bool)
+        frontier = np.array([self.node_index[node_id]], dtype=np.int64)
+
+        while len(frontier) > 0:
+            next_nodes = np.concatenate([indices[indptr[i]:indptr[i + 1]] for i in frontier.tolist()])
+            frontier = np.unique(next_nodes[~visited[next_nodes]])
+            visited[frontier] = True
+
+        visited[self.node_index[node_id]] = False
+
+        return np.flatnonzero(visited)
+
+
+    def ancestors(self, node_id):
+        """Set with the ids of all the ancestors (is-a parents, their parents, ...) of node_id."""
+
+        return set(self.node_ids[i] for i in self.reachable(node_id, self.snapshot.out_indptr, self.snapshot.out_indices))
+
+
+    def descendants(self, node_id):
+        """Set with the ids of all the descendants (children, their children, ...) of node_id."""
+
+        return set(self.node_ids[i] for i in self.reachable(node_id, self.snapshot.in_indptr, self.snapshot.in_indices))
+
+
+    def edges(self):
+
+        return SnapshotEdgeView(self)
+
+
+
+class SnapshotEdgeView:
+    """Membership test of (source_id, target_id) edges, like the edge view of Networkx."""
+
+    __slots__ = ("graph",)
+
+    def __init__(self, graph):
+        self.graph = graph
+
+
+    def __contains__(self, edge):
+
+        if isinstance(edge, tuple) and len(edge) in (2, 3):
+            return self.graph.has_edge(edge[0], edge[1])
+
+        return False
@@ -3,4 +3,14 @@
 entity_string = "ENTITY\ttext:{0}\tnormalName:{1}\tpredictedType:{2}\tq:true"
 entity_string += "\tqid:Q{3}\tdocId:{4}\torigText:{0}\turl:{5}\n"
 candidate_string = "CANDIDATE\tid:{0}\tinCount:{1}\toutCount:{2}\tlinks:{3}\t"
-candidate_string += "url:{4}\tname:{5}\tnormalName:{6}\tnormalWikiTitle:{7}\tpredictedType:{8}\n"
\ No newline at end of file
+candidate_string += "url:{4}\tname:{5}\tnormalName:{6}\tnormalWikiTitle:{7}\tpredictedType:{8}\n"
+entity_fields = 9 # fields of each entity string, separated by tabs
+
+
+
+def field_text(text):
+    """Text of a field of the entity and candidate strings, without the tabs and 
+    line breaks that separate the fields and the lines of the candidates files.
+    """
+
+    return text.replace("\t", " ").replace("\r", " ").replace("\n", " ")
\ No newline at end of file